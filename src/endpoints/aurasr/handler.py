@@ -1,15 +1,24 @@
+from functools import partial
 import torch
 import runpod
-from src.shared.predict import create_predict_for_upscale
-from .upscale import upscale
+from src.shared.constants import AURASR_CHANNELS_LAST, AURASR_PRECISION
+from src.shared.predict import concurrency_modifier, create_predict_for_upscale
+from .upscale import prefetch_images, upscale
 from .pipe import MODEL_NAME, get_pipe_object
 
 torch.cuda.empty_cache()
 
 predict = create_predict_for_upscale(
     model_name=MODEL_NAME,
-    get_pipe_object=get_pipe_object,
+    get_pipe_object=partial(
+        get_pipe_object,
+        precision=AURASR_PRECISION,
+        channels_last=AURASR_CHANNELS_LAST,
+    ),
     upscale=upscale,
+    prefetch_images=prefetch_images,
 )
 
-runpod.serverless.start({"handler": predict})
+runpod.serverless.start(
+    {"handler": predict, "concurrency_modifier": concurrency_modifier}
+)
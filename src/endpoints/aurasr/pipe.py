@@ -7,9 +7,13 @@ MODEL_NAME = "AuraSR"
 MODEL_ID = "fal/AuraSR-v2"
 
 
-def get_pipe_object(to_cuda: bool = True) -> AuraSrPipeObject:
+def get_pipe_object(
+    to_cuda: bool = True, precision: str = "fp32", channels_last: bool = False
+) -> AuraSrPipeObject:
     device = DEVICE_CUDA if to_cuda else DEVICE_CPU
-    pipe = AuraSR.from_pretrained(MODEL_ID, device=device)
+    pipe = AuraSR.from_pretrained(
+        MODEL_ID, device=device, precision=precision, channels_last=channels_last
+    )
     return AuraSrPipeObject(pipe=pipe)
 
 
@@ -1,74 +1,153 @@
 import time
+from concurrent.futures import Future
 from PIL import Image
-from typing import List
+from typing import Iterator, List, cast
 from urllib.parse import urlparse
 import requests
 from io import BytesIO
 import logging
 
 
-from src.shared.classes import UpscaleFunctionProps, UpscaleOutput
+from src.shared.classes import (
+    InputValidationError,
+    UpscaleFunctionProps,
+    UpscaleInput,
+    UpscaleOutput,
+)
+from src.shared.constants import AURASR_MAX_TILE_BATCH_SIZE, UPSCALE_MAX_OUTPUT_PIXELS
+from src.shared.helpers import DOWNLOAD_EXECUTOR
+from src.shared.image_cache import IMAGE_CACHE, ImageCacheStats
 from src.shared.pipe_classes import AuraSrPipeObject
 
 
-def upscale(props: UpscaleFunctionProps[AuraSrPipeObject]) -> List[UpscaleOutput]:
+def prefetch_images(input: UpscaleInput):
+    """Start downloading the input images of a job in the background."""
+    input.image_downloads = [
+        DOWNLOAD_EXECUTOR.submit(
+            load_image_from_url, image_url, cache_stats=input.image_cache_stats
+        )
+        for image_url in input.images
+    ]
+
+
+def upscale(
+    props: UpscaleFunctionProps[AuraSrPipeObject],
+) -> Iterator[UpscaleOutput]:
     # Props
     input = props.input
     pipe_object = props.pipe_object
     model_name = props.model_name
     # ---------------------------------------------------------------------
 
-    output_images: List[Image.Image] = []
-
-    for image_url in input.images:
-        logging.info("🟡 Upscale | Started")
-        s = time.time()
-        logging.info("🟡 Upscale | Image is a URL, downloading...")
-        image = load_image_from_url(image_url)
+    logging.info(f"🟡 Upscale | Started | {len(input.images)} image(s)")
+    # All images download in parallel, the first group starts as soon as its images are in
+    s = time.time()
+    if input.image_downloads is None:
+        prefetch_images(input)
+    downloads = cast(List["Future[Image.Image]"], input.image_downloads)
+
+    # Consecutive images are pooled until they fill a tile batch, so small images share upsampler passes
+    tile_batch_size = pipe_object.pipe.get_tile_batch_size(AURASR_MAX_TILE_BATCH_SIZE)
+    group: List[Image.Image] = []
+    group_tiles = 0
+    for i, download in enumerate(downloads):
+        image = download.result()
         e = time.time()
-        logging.info(f"🟢 Upscale | Image downloaded | {round((e - s) * 1000)}ms")
-
-        inf_start_time = time.time()
-        upscaled_image = pipe_object.pipe.upscale_4x_overlapped(image)
-        inf_end_time = time.time()
         logging.info(
-            f"🔮 🟢 Upscale |  {model_name} | Scale: {input.scale} | {round((inf_end_time - inf_start_time) * 1000)}ms"
+            f"🟢 Upscale | Image {i + 1} downloaded | {round((e - s) * 1000)}ms"
         )
-        output_images.append(upscaled_image)
-
-    outputs: List[UpscaleOutput] = []
-    for image in output_images:
-        outputs.append(UpscaleOutput(image=image))
-
-    return outputs
-
-
-def load_image_from_url(url, timeout=10, max_size=8 * 1024 * 1024):
+        if input.tile_overlap is not None:
+            tiles = pipe_object.pipe.get_feathered_tile_count(
+                image.width, image.height, input.tile_overlap
+            )
+        else:
+            tiles = pipe_object.pipe.get_overlapped_tile_count(
+                image.width, image.height
+            )
+        if len(group) > 0 and group_tiles + tiles > tile_batch_size:
+            yield from upscale_group(pipe_object, model_name, input, group)
+            group = []
+            group_tiles = 0
+        group.append(image)
+        group_tiles += tiles
+    if len(group) > 0:
+        yield from upscale_group(pipe_object, model_name, input, group)
+
+
+def upscale_group(
+    pipe_object: AuraSrPipeObject,
+    model_name: str,
+    input: UpscaleInput,
+    images: List[Image.Image],
+) -> Iterator[UpscaleOutput]:
+    inf_start_time = time.time()
+    if input.tile_overlap is not None:
+        upscaled_images = pipe_object.pipe.upscale_4x_feathered_many(
+            images,
+            tile_overlap=input.tile_overlap,
+            max_batch_size=AURASR_MAX_TILE_BATCH_SIZE,
+        )
+    else:
+        upscaled_images = pipe_object.pipe.upscale_4x_overlapped_many(
+            images, max_batch_size=AURASR_MAX_TILE_BATCH_SIZE
+        )
+    inf_end_time = time.time()
+    logging.info(
+        f"🔮 🟢 Upscale |  {model_name} | Scale: {input.scale} | Tile overlap: {input.tile_overlap} | {len(images)} image(s) | Tile batch size: {pipe_object.pipe.get_tile_batch_size(AURASR_MAX_TILE_BATCH_SIZE)} | {round((inf_end_time - inf_start_time) * 1000)}ms"
+    )
+    for upscaled_image in upscaled_images:
+        yield UpscaleOutput(image=upscaled_image)
+
+
+def load_image_from_url(
+    url,
+    timeout=10,
+    max_size=8 * 1024 * 1024,
+    max_output_pixels=UPSCALE_MAX_OUTPUT_PIXELS,
+    cache_stats: ImageCacheStats | None = None,
+):
     # Validate URL
     if not url or not urlparse(url).scheme:
         raise ValueError("Invalid URL")
 
-    try:
-        # Send request with timeout
-        response = requests.get(url, timeout=timeout)
-        response.raise_for_status()
-
-        # Check content type
-        content_type = response.headers.get("Content-Type", "")
-        if not content_type.startswith("image/"):
-            raise ValueError(
-                f"URL does not point to an image (Content-Type: {content_type})"
-            )
+    def fetch() -> bytes:
+        # Send request with timeout, the body is streamed so oversized files are cut off early
+        with requests.get(url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+
+            # Check content type
+            content_type = response.headers.get("Content-Type", "")
+            if not content_type.startswith("image/"):
+                raise InputValidationError(
+                    f"URL does not point to an image (Content-Type: {content_type})"
+                )
+
+            # Check file size, up front when the server tells us and while reading otherwise
+            content_length = response.headers.get("Content-Length")
+            if content_length is not None and int(content_length) > max_size:
+                raise InputValidationError(
+                    f"Image size ({content_length} bytes) exceeds maximum allowed size ({max_size} bytes)"
+                )
+            data = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                data.extend(chunk)
+                if len(data) > max_size:
+                    raise InputValidationError(
+                        f"Image size exceeds maximum allowed size ({max_size} bytes)"
+                    )
+
+            return bytes(data)
 
-        # Check file size
-        if len(response.content) > max_size:
-            raise ValueError(
-                f"Image size ({len(response.content)} bytes) exceeds maximum allowed size ({max_size} bytes)"
-            )
+    try:
+        # Only fetched when the image isn't in the cache yet
+        image_data = BytesIO(IMAGE_CACHE.get_bytes(url, fetch=fetch, stats=cache_stats))
 
-        # Load image
-        image_data = BytesIO(response.content)
+        # Only reads the header, the size is checked before anything is decoded
         image = Image.open(image_data)
+        fit_output_pixels(image, max_output_pixels)
+
+        # Decoded right away so it happens on the download thread
+        image.load()
 
         return image
 
@@ -78,3 +157,34 @@ def load_image_from_url(url, timeout=10, max_size=8 * 1024 * 1024):
     except (IOError, ValueError) as e:
         logging.error(f"Error processing image: {e}")
         raise
+
+
+def fit_output_pixels(image: Image.Image, max_output_pixels: int):
+    """Make sure the 4x output of a not yet decoded image stays within max_output_pixels.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale instead when that fits, anything else is rejected.
+    """
+    width, height = image.size
+    output_pixels = width * height * 16
+    if output_pixels <= max_output_pixels:
+        return
+    if image.format == "JPEG":
+        for reduction in (2, 4, 8):
+            if output_pixels // (reduction * reduction) <= max_output_pixels:
+                # Draft picks the largest scale that is still at least the requested size
+                image.draft(
+                    "RGB",
+                    (
+                        (width + reduction - 1) // reduction,
+                        (height + reduction - 1) // reduction,
+                    ),
+                )
+                if image.width * image.height * 16 <= max_output_pixels:
+                    logging.warning(
+                        f"Image of {width}x{height} is decoded at {image.width}x{image.height} to fit the output pixel limit ({max_output_pixels})"
+                    )
+                    return
+                break
+    raise InputValidationError(
+        f"Image of {width}x{height} would be upscaled to {output_pixels} pixels, maximum allowed is {max_output_pixels}"
+    )
@@ -1,12 +1,15 @@
 import logging
 import os
-from typing import Any, List, cast
-from PIL import Image
+from typing import Any, Iterator, cast
 import torch
 from src.shared.classes import GenerateFunctionProps, GenerateOutput
-from src.shared.device import DEVICE_CUDA
-from src.shared.helpers import log_gpu_memory
+from src.shared.helpers import create_generators, get_batch_chunks, log_gpu_memory
 from src.shared.pipe_classes import Flux1PipeObject
+from src.shared.prompt_cache import (
+    encode_flux_text,
+    get_prompt_embeds,
+    log_prompt_embeds_cache_stats,
+)
 import time
 
 MAX_INFERENCE_STEPS = 4
@@ -14,7 +17,7 @@ MAX_INFERENCE_STEPS = 4
 
 def generate(
     props: GenerateFunctionProps[Flux1PipeObject],
-) -> List[GenerateOutput]:
+) -> Iterator[GenerateOutput]:
     # Props -------------------------------------
     input = props.input
     pipe_object = props.pipe_object
@@ -30,37 +33,46 @@ def generate(
     if seed is None:
         seed = int.from_bytes(os.urandom(3), "big")
         logging.info(f"Using seed: {seed}")
-    generator = torch.Generator(device=DEVICE_CUDA).manual_seed(seed)
 
     # The process is: text2img
     pipe_selected = pipe_object.text2img
 
-    output_images: List[Image.Image] = []
+    # T5 runs once per prompt, not once per output
+    prompt_embeds = get_prompt_embeds(
+        pipe=pipe_selected, model=model_name, text=prompt, encode=encode_flux_text
+    )
+    pooled_prompt_embeds = cast(torch.Tensor, prompt_embeds.pooled_embeds)
 
-    for i in range(input.num_outputs):
-        generator = torch.Generator(device=DEVICE_CUDA).manual_seed(seed + i)
+    batches = get_batch_chunks(
+        num_outputs=input.num_outputs, width=input.width, height=input.height
+    )
+    for indexes in batches:
+        # FluxPipeline doesn't repeat precomputed embeds, so there is one row per output
         out = cast(
             Any,
             pipe_selected(
-                prompt=prompt,
-                generator=generator,
+                prompt_embeds=prompt_embeds.embeds.repeat(len(indexes), 1, 1),
+                pooled_prompt_embeds=pooled_prompt_embeds.repeat(len(indexes), 1),
+                generator=create_generators(seed=seed, indexes=indexes),
                 guidance_scale=0,
                 num_images_per_prompt=1,
                 num_inference_steps=min(input.num_inference_steps, MAX_INFERENCE_STEPS),
                 width=input.width,
                 height=input.height,
             ),
-        ).images[0]
-        output_images.append(out)
+        ).images
+        for image in out:
+            yield GenerateOutput(image=image)
+
+    if len(batches) > 1:
+        logging.info(
+            f"-- Split {input.num_outputs} image(s) into {len(batches)} batch(es)"
+        )
+
+    log_prompt_embeds_cache_stats()
 
     inference_end = time.time()
     logging.info(
         f"🔮 🟢 Inference | {model_name} | {input.num_outputs} image(s) | {round((inference_end - inference_start) * 1000)}ms"
     )
     log_gpu_memory(message="After inference")
-
-    outputs: List[GenerateOutput] = []
-    for image in output_images:
-        outputs.append(GenerateOutput(image=image))
-
-    return outputs
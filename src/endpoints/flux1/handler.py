@@ -1,6 +1,6 @@
 import torch
 import runpod
-from src.shared.predict import create_predict_for_generate
+from src.shared.predict import concurrency_modifier, create_predict_for_generate
 from src.shared.schedulers import (
     SD_SCHEDULER_CHOICES,
     SD_SCHEDULER_DEFAULT,
@@ -19,4 +19,6 @@ predict = create_predict_for_generate(
     dont_set_scheduler=True,
 )
 
-runpod.serverless.start({"handler": predict})
+runpod.serverless.start(
+    {"handler": predict, "concurrency_modifier": concurrency_modifier}
+)
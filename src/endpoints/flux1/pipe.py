@@ -3,7 +3,8 @@ import torch
 from typing import cast
 from diffusers import FluxPipeline
 from src.shared.pipe_classes import Flux1PipeObject
-from src.shared.device import DEVICE_CUDA
+from src.shared.device import DEVICE_CPU, DEVICE_CUDA
+from src.shared.pipe_loader import PipelineLoad, load_pipelines
 import os
 
 MODEL_NAME = "FLUX.1"
@@ -11,16 +12,20 @@ MODEL_ID = "black-forest-labs/FLUX.1-schnell"
 
 
 def get_pipe_object(to_cuda: bool = True) -> Flux1PipeObject:
-    text2img = FluxPipeline.from_pretrained(
-        MODEL_ID,
-        torch_dtype=torch.bfloat16,
-        add_watermark=False,
-        safety_checker=None,
+    (text2img,) = load_pipelines(
+        [
+            PipelineLoad(
+                FluxPipeline,
+                MODEL_ID,
+                torch_dtype=torch.bfloat16,
+                add_watermark=False,
+                safety_checker=None,
+            )
+        ],
+        device=DEVICE_CUDA if to_cuda else DEVICE_CPU,
     )
 
-    if to_cuda:
-        text2img = text2img.to(DEVICE_CUDA)
-    else:
+    if not to_cuda:
         del text2img
         text2img = None
 
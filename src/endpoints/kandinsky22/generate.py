@@ -1,33 +1,34 @@
 import os
 import time
-from PIL import Image
 from diffusers import (
     KandinskyV22Pipeline,
     KandinskyV22Img2ImgPipeline,
     KandinskyV22InpaintPipeline,
 )
-from typing import Any, List, cast
-import torch
+from typing import Any, Iterator, cast
 import logging
 from src.shared.classes import (
     GenerateFunctionProps,
     GenerateOutput,
 )
-from src.shared.device import DEVICE_CUDA
 from src.shared.helpers import (
-    crop_images,
+    create_generators,
+    crop_image,
     download_and_fit_image,
     download_and_fit_image_mask,
+    get_batch_chunks,
     log_gpu_memory,
     pad_image_mask_nd,
     pad_image_pil,
 )
 from src.shared.pipe_classes import Kandinsky22PipeObject
-from src.shared.schedulers import KANDINSKY_22_SCHEDULERS
-
-PRIOR_STEPS = 25
-PRIOR_GUIDANCE_SCALE = 4.0
-
+from src.shared.schedulers import KANDINSKY_22_SCHEDULER_CACHE
+from .prior import (
+    get_image_embeds,
+    get_interpolated_image_embeds,
+    get_negative_image_embeds,
+    log_prior_cache_stats,
+)
 
 kandinsky_2_2_negative_prompt_prefix = "overexposed"
 
@@ -38,17 +39,12 @@ def get_scheduler(
         KandinskyV22Pipeline | KandinskyV22InpaintPipeline | KandinskyV22Img2ImgPipeline
     ),
 ):
-    if "from_config" in KANDINSKY_22_SCHEDULERS[name]:
-        return KANDINSKY_22_SCHEDULERS[name]["scheduler"].from_config(
-            pipeline.scheduler.config
-        )
-    else:
-        return KANDINSKY_22_SCHEDULERS[name]["scheduler"]()
+    return KANDINSKY_22_SCHEDULER_CACHE.get(name, pipeline)
 
 
 def generate(
     props: GenerateFunctionProps[Kandinsky22PipeObject],
-) -> List[GenerateOutput]:
+) -> Iterator[GenerateOutput]:
     # Props
     input = props.input
     pipe_object = props.pipe_object
@@ -65,7 +61,8 @@ def generate(
     if seed is None:
         seed = int.from_bytes(os.urandom(3), "big")
         logging.info(f"Using seed: {seed}")
-    generator = torch.Generator(device=DEVICE_CUDA).manual_seed(seed)
+    # Output i is seeded with seed + i in the prior and the decoder, so a seed gives completely
+    # different images than when every output of a job drew from one shared generator
 
     if input.prompt_prefix is not None:
         prompt = f"{input.prompt_prefix} {input.prompt}"
@@ -83,19 +80,35 @@ def generate(
 
     logging.info(f"Negative prompt for Kandinsky 2.2: {negative_prompt}")
 
-    output_images: List[Image.Image] = []
+    negative_image_embeds = get_negative_image_embeds(
+        prior=pipe_object.prior,
+        negative_prompt=negative_prompt,
+        num_outputs=input.num_outputs,
+        pinned=negative_prompt == kandinsky_2_2_negative_prompt_prefix,
+    )
+
+    pipe_selected: (
+        KandinskyV22Pipeline | KandinskyV22InpaintPipeline | KandinskyV22Img2ImgPipeline
+    ) = pipe_object.text2img
+    extra_kwargs = {}
+    init_image = None
+    mask_image = None
+    width = input.width
+    height = input.height
 
     if (
         input.init_image_url is not None
         and input.mask_image_url is not None
         and pipe_object.inpaint is not None
     ):
-        pipe_object.inpaint.scheduler = get_scheduler(
-            input.scheduler, pipe_object.inpaint
-        )
+        pipe_selected = pipe_object.inpaint
         start = time.time()
         init_image = download_and_fit_image(
-            input.init_image_url, input.width, input.height
+            input.init_image_url,
+            input.width,
+            input.height,
+            prefetched=input.init_image,
+            cache_stats=input.image_cache_stats,
         )
         init_image = pad_image_pil(init_image, 64)
         end = time.time()
@@ -107,140 +120,91 @@ def generate(
             url=input.mask_image_url,
             width=input.width,
             height=input.height,
+            prefetched=input.mask_image,
+            cache_stats=input.image_cache_stats,
         )
         mask_image = pad_image_mask_nd(mask_image, 64, 0)
         end = time.time()
         logging.info(
             f"-- Downloaded and cropped mask image in: {round((end - start) * 1000)}ms"
         )
-        for i in range(input.num_outputs):
-            generator = torch.Generator(device=DEVICE_CUDA).manual_seed(seed + i)
-            img_emb = cast(
-                Any,
-                pipe_object.prior(
-                    prompt=prompt,
-                    num_inference_steps=PRIOR_STEPS,
-                    guidance_scale=PRIOR_GUIDANCE_SCALE,
-                    num_images_per_prompt=1,
-                    generator=generator,
-                ),
-            )
-            neg_emb = cast(
-                Any,
-                pipe_object.prior(
-                    prompt=negative_prompt,
-                    num_inference_steps=PRIOR_STEPS,
-                    guidance_scale=PRIOR_GUIDANCE_SCALE,
-                    num_images_per_prompt=1,
-                    generator=generator,
-                ),
-            )
-            out = cast(
-                Any,
-                pipe_object.inpaint(
-                    image=cast(Any, [init_image] * 1),
-                    mask_image=cast(Any, [mask_image] * 1),
-                    image_embeds=img_emb.image_embeds,
-                    negative_image_embeds=neg_emb.image_embeds,
-                    width=init_image.width,
-                    height=init_image.height,
-                    num_inference_steps=input.num_inference_steps,
-                    guidance_scale=input.guidance_scale,
-                    generator=generator,
-                ),
-            ).images[0]
-            output_images.append(out)
-    elif input.init_image_url is not None and input.prompt_strength is not None:
-        pipe_object.text2img.scheduler = get_scheduler(
-            input.scheduler, pipe_object.text2img
+        width = init_image.width
+        height = init_image.height
+        image_embeds = get_image_embeds(
+            prior=pipe_object.prior,
+            prompt=prompt,
+            seed=seed,
+            num_outputs=input.num_outputs,
         )
+    elif input.init_image_url is not None and input.prompt_strength is not None:
         start = time.time()
         init_image = download_and_fit_image(
-            input.init_image_url, input.width, input.height
+            input.init_image_url,
+            input.width,
+            input.height,
+            prefetched=input.init_image,
+            cache_stats=input.image_cache_stats,
         )
         end = time.time()
         logging.info(
             f"-- Downloaded and cropped init image in: {round((end - start) * 1000)}ms"
         )
-        start = time.time()
-        images_and_texts = [prompt, init_image]
-        weights = [input.prompt_strength, 1 - input.prompt_strength]
-        for i in range(input.num_outputs):
-            generator = torch.Generator(device=DEVICE_CUDA).manual_seed(seed + i)
-            prior_out = pipe_object.prior.interpolate(
-                images_and_texts,
-                weights,
-                negative_prompt=negative_prompt,
-                num_inference_steps=PRIOR_STEPS,
-                guidance_scale=PRIOR_GUIDANCE_SCALE,
-                num_images_per_prompt=1,
-                generator=generator,
-            )
-            out = cast(
-                Any,
-                pipe_object.text2img(
-                    **prior_out,
-                    width=input.width,
-                    height=input.height,
-                    num_inference_steps=input.num_inference_steps,
-                    guidance_scale=input.guidance_scale,
-                    generator=generator,
-                ),
-            ).images[0]
-            output_images.append(out)
+        image_embeds = get_interpolated_image_embeds(
+            prior=pipe_object.prior,
+            prompt=prompt,
+            image=init_image,
+            prompt_weight=input.prompt_strength,
+            seed=seed,
+            num_outputs=input.num_outputs,
+        )
     else:
-        pipe_object.text2img.scheduler = get_scheduler(
-            input.scheduler, pipe_object.text2img
+        image_embeds = get_image_embeds(
+            prior=pipe_object.prior,
+            prompt=prompt,
+            seed=seed,
+            num_outputs=input.num_outputs,
         )
-        for i in range(input.num_outputs):
-            generator = torch.Generator(device=DEVICE_CUDA).manual_seed(seed + i)
-            img_emb = cast(
-                Any,
-                pipe_object.prior(
-                    prompt=prompt,
-                    num_inference_steps=PRIOR_STEPS,
-                    guidance_scale=PRIOR_GUIDANCE_SCALE,
-                    num_images_per_prompt=1,
-                    generator=generator,
-                ),
-            )
-            neg_emb = cast(
-                Any,
-                pipe_object.prior(
-                    prompt=negative_prompt,
-                    num_inference_steps=PRIOR_STEPS,
-                    guidance_scale=PRIOR_GUIDANCE_SCALE,
-                    num_images_per_prompt=1,
-                    generator=generator,
-                ),
-            )
-            out = cast(
-                Any,
-                pipe_object.text2img(
-                    num_inference_steps=input.num_inference_steps,
-                    guidance_scale=input.guidance_scale,
-                    width=input.width,
-                    height=input.height,
-                    generator=generator,
-                    image_embeds=img_emb.image_embeds,
-                    negative_image_embeds=neg_emb.image_embeds,
-                ),
-            ).images[0]
-            output_images.append(out)
-
-    output_images = crop_images(
-        images=output_images, width=input.width, height=input.height
+
+    pipe_selected.scheduler = get_scheduler(input.scheduler, pipe_selected)
+
+    # One decoder run per batch, each output keeps its own embeds and "seed + i" generator
+    batches = get_batch_chunks(
+        num_outputs=input.num_outputs, width=width, height=height
     )
+    for indexes in batches:
+        if mask_image is not None:
+            # The inpaint pipeline needs one image and mask per output. They are the same object, but
+            # MoVQ still encodes every copy: diffusers only takes images, and reuses no latents
+            # across rows with their own embeds
+            extra_kwargs["image"] = cast(Any, [init_image] * len(indexes))
+            extra_kwargs["mask_image"] = cast(Any, [mask_image] * len(indexes))
+        out = cast(
+            Any,
+            pipe_selected(
+                image_embeds=image_embeds[indexes],
+                negative_image_embeds=negative_image_embeds[indexes],
+                width=width,
+                height=height,
+                num_inference_steps=input.num_inference_steps,
+                guidance_scale=input.guidance_scale,
+                generator=create_generators(seed=seed, indexes=indexes),
+                **extra_kwargs,
+            ),
+        ).images
+        for image in out:
+            yield GenerateOutput(
+                image=crop_image(image=image, width=input.width, height=input.height)
+            )
+
+    if len(batches) > 1:
+        logging.info(
+            f"-- Split {input.num_outputs} image(s) into {len(batches)} batch(es)"
+        )
+
+    log_prior_cache_stats()
 
     inference_end = time.time()
     logging.info(
         f"🔮 🟢 Inference | {model_name} | {input.num_outputs} image(s) | {round((inference_end - inference_start) * 1000)}ms"
     )
     log_gpu_memory(message="After inference")
-
-    outputs: List[GenerateOutput] = []
-
-    for image in output_images:
-        outputs.append(GenerateOutput(image=image))
-
-    return outputs
@@ -1,6 +1,6 @@
 import torch
 import runpod
-from src.shared.predict import create_predict_for_generate
+from src.shared.predict import concurrency_modifier, create_predict_for_generate
 from src.shared.schedulers import (
     KANDINSKY_22_SCHEDULER_CHOICES,
     KANDINSKY_22_SCHEDULER_DEFAULT,
@@ -18,4 +18,6 @@ predict = create_predict_for_generate(
     default_scheduler=KANDINSKY_22_SCHEDULER_DEFAULT,
 )
 
-runpod.serverless.start({"handler": predict})
+runpod.serverless.start(
+    {"handler": predict, "concurrency_modifier": concurrency_modifier}
+)
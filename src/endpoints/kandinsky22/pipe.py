@@ -4,8 +4,9 @@ from diffusers import (
     KandinskyV22Pipeline,
     KandinskyV22PriorPipeline,
 )
-from src.shared.device import DEVICE_CUDA
+from src.shared.device import DEVICE_CPU, DEVICE_CUDA
 from src.shared.pipe_classes import Kandinsky22PipeObject
+from src.shared.pipe_loader import PipelineLoad, load_pipelines
 
 MODEL_NAME = "Kandinsky 2.2"
 MODEL_ID = "kandinsky-community/kandinsky-2-2-decoder"
@@ -13,23 +14,24 @@ PRIOR_MODEL_ID = "kandinsky-community/kandinsky-2-2-prior"
 
 
 def get_pipe_object(to_cuda: bool = True) -> Kandinsky22PipeObject:
-    prior = KandinskyV22PriorPipeline.from_pretrained(
-        PRIOR_MODEL_ID,
-        torch_dtype=torch.float16,
+    prior, text2img = load_pipelines(
+        [
+            PipelineLoad(
+                KandinskyV22PriorPipeline,
+                PRIOR_MODEL_ID,
+                torch_dtype=torch.float16,
+            ),
+            PipelineLoad(
+                KandinskyV22Pipeline,
+                MODEL_ID,
+                torch_dtype=torch.float16,
+            ),
+        ],
+        device=DEVICE_CUDA if to_cuda else DEVICE_CPU,
     )
-    if to_cuda:
-        prior = prior.to(DEVICE_CUDA)
-    else:
+    if not to_cuda:
         del prior
         prior = None
-
-    text2img = KandinskyV22Pipeline.from_pretrained(
-        MODEL_ID,
-        torch_dtype=torch.float16,
-    )
-    if to_cuda:
-        text2img = text2img.to(DEVICE_CUDA)
-    else:
         del text2img
         text2img = None
 
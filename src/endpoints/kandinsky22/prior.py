@@ -0,0 +1,107 @@
+import logging
+from typing import Any, List, Tuple, cast
+import torch
+from PIL import Image
+from diffusers import KandinskyV22PriorPipeline
+from src.shared.constants import KANDINSKY_PRIOR_CACHE_MAX_ENTRIES
+from src.shared.device import DEVICE_CUDA
+from src.shared.helpers import create_generators
+from src.shared.lru_cache import LRUCache
+
+PRIOR_STEPS = 25
+PRIOR_GUIDANCE_SCALE = 4.0
+# Negative embeds don't depend on the seed of the job, so they can be shared across jobs
+NEGATIVE_PRIOR_SEED = 0
+
+# (prompt, seed of the output) -> image embeds of that output
+PRIOR_CACHE: LRUCache[Tuple[str, int], torch.Tensor] = LRUCache(
+    max_size=KANDINSKY_PRIOR_CACHE_MAX_ENTRIES, get_size=lambda _: 1
+)
+# Negative prompt -> image embeds
+NEGATIVE_PRIOR_CACHE: LRUCache[str, torch.Tensor] = LRUCache(
+    max_size=KANDINSKY_PRIOR_CACHE_MAX_ENTRIES, get_size=lambda _: 1
+)
+
+
+def get_image_embeds(
+    prior: KandinskyV22PriorPipeline, prompt: str, seed: int, num_outputs: int
+) -> torch.Tensor:
+    """Image embeds of every output, output i uses seed + i. Uncached outputs run in a single prior batch."""
+    rows: List[torch.Tensor | None] = [
+        PRIOR_CACHE.get((prompt, seed + i)) for i in range(num_outputs)
+    ]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if len(missing) > 0:
+        out = cast(
+            Any,
+            prior(
+                prompt=prompt,
+                num_inference_steps=PRIOR_STEPS,
+                guidance_scale=PRIOR_GUIDANCE_SCALE,
+                num_images_per_prompt=len(missing),
+                generator=create_generators(seed=seed, indexes=missing),
+            ),
+        ).image_embeds
+        for j, i in enumerate(missing):
+            rows[i] = out[j : j + 1]
+            PRIOR_CACHE.put((prompt, seed + i), out[j : j + 1])
+    return torch.cat(cast(List[torch.Tensor], rows))
+
+
+def get_negative_image_embeds(
+    prior: KandinskyV22PriorPipeline,
+    negative_prompt: str,
+    num_outputs: int,
+    pinned: bool = False,
+) -> torch.Tensor:
+    """Negative image embeds, computed once per negative prompt and repeated for every output."""
+    embeds = NEGATIVE_PRIOR_CACHE.get(negative_prompt)
+    if embeds is None:
+        embeds = cast(
+            Any,
+            prior(
+                prompt=negative_prompt,
+                num_inference_steps=PRIOR_STEPS,
+                guidance_scale=PRIOR_GUIDANCE_SCALE,
+                num_images_per_prompt=1,
+                generator=torch.Generator(device=DEVICE_CUDA).manual_seed(
+                    NEGATIVE_PRIOR_SEED
+                ),
+            ),
+        ).image_embeds
+        NEGATIVE_PRIOR_CACHE.put(negative_prompt, embeds, pinned=pinned)
+    return cast(torch.Tensor, embeds).repeat(num_outputs, 1)
+
+
+@torch.no_grad()
+def get_interpolated_image_embeds(
+    prior: KandinskyV22PriorPipeline,
+    prompt: str,
+    image: Image.Image,
+    prompt_weight: float,
+    seed: int,
+    num_outputs: int,
+) -> torch.Tensor:
+    """Same as prior.interpolate with a prompt and an image, reusing the cached prompt embeds."""
+    text_embeds = get_image_embeds(
+        prior=prior, prompt=prompt, seed=seed, num_outputs=num_outputs
+    )
+    pixel_values = (
+        prior.image_processor(image, return_tensors="pt")
+        .pixel_values[0]
+        .unsqueeze(0)
+        .to(dtype=prior.image_encoder.dtype, device=prior.device)
+    )
+    image_embeds = prior.image_encoder(pixel_values)["image_embeds"]
+    return text_embeds * prompt_weight + image_embeds * (1 - prompt_weight)
+
+
+def log_prior_cache_stats():
+    for name, cache in (
+        ("Prior", PRIOR_CACHE),
+        ("Negative prior", NEGATIVE_PRIOR_CACHE),
+    ):
+        stats = cache.stats()
+        logging.info(
+            f"🗂️ {name} cache | Hits: {stats['hits']} | Misses: {stats['misses']} | Evictions: {stats['evictions']} | Entries: {stats['entries']}"
+        )
@@ -2,23 +2,29 @@ import torch
 from typing import cast
 from diffusers import StableDiffusionPipeline, StableDiffusionImg2ImgPipeline
 from src.shared.pipe_classes import StableDiffusionPipeObject
-from src.shared.device import DEVICE_CUDA
+from src.shared.device import DEVICE_CPU, DEVICE_CUDA
+from src.shared.pipe_loader import PipelineLoad, load_pipelines
 
 MODEL_NAME = "Luna Diffusion"
 MODEL_ID = "proximasanfinetuning/luna-diffusion"
 
 
 def get_pipe_object(to_cuda: bool = True) -> StableDiffusionPipeObject:
-    text2img = StableDiffusionPipeline.from_pretrained(
-        MODEL_ID,
-        torch_dtype=torch.float16,
-        add_watermark=False,
-        safety_checker=None,
+    (text2img,) = load_pipelines(
+        [
+            PipelineLoad(
+                StableDiffusionPipeline,
+                MODEL_ID,
+                torch_dtype=torch.float16,
+                add_watermark=False,
+                safety_checker=None,
+            )
+        ],
+        device=DEVICE_CUDA if to_cuda else DEVICE_CPU,
     )
 
     img2img = None
     if to_cuda:
-        text2img = text2img.to(DEVICE_CUDA)
         img2img = StableDiffusionImg2ImgPipeline(**text2img.components)
     else:
         del text2img
@@ -1,8 +1,9 @@
 import torch
 from typing import cast
 from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline
-from src.shared.device import DEVICE_CUDA
+from src.shared.device import DEVICE_CPU, DEVICE_CUDA
 from src.shared.pipe_classes import StableDiffusionPipeObject
+from src.shared.pipe_loader import PipelineLoad, load_pipelines
 
 MODEL_NAME = "SSD-1B"
 MODEL_ID = "segmind/SSD-1B"
@@ -11,31 +12,33 @@ VARIANT = "fp16"
 
 
 def get_pipe_object(to_cuda: bool = True) -> StableDiffusionPipeObject:
-    text2img = StableDiffusionXLPipeline.from_pretrained(
-        MODEL_ID,
-        torch_dtype=torch.float16,
-        add_watermark=False,
-        safety_checker=None,
-        variant=VARIANT,
+    text2img, refiner = load_pipelines(
+        [
+            PipelineLoad(
+                StableDiffusionXLPipeline,
+                MODEL_ID,
+                torch_dtype=torch.float16,
+                add_watermark=False,
+                safety_checker=None,
+                variant=VARIANT,
+            ),
+            PipelineLoad(
+                StableDiffusionXLImg2ImgPipeline,
+                REFINER_ID,
+                torch_dtype=torch.float16,
+                add_watermark=False,
+                variant=VARIANT,
+            ),
+        ],
+        device=DEVICE_CUDA if to_cuda else DEVICE_CPU,
     )
 
     img2img = None
     if to_cuda:
-        text2img = text2img.to(DEVICE_CUDA)
         img2img = StableDiffusionXLImg2ImgPipeline(**text2img.components)
     else:
         del text2img
         text2img = None
-
-    refiner = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-        REFINER_ID,
-        torch_dtype=torch.float16,
-        add_watermark=False,
-        variant=VARIANT,
-    )
-    if to_cuda:
-        refiner = refiner.to(DEVICE_CUDA)
-    else:
         del refiner
         refiner = None
 
@@ -1,8 +1,9 @@
 import torch
 import runpod
-from src.shared.predict import create_predict_for_generate
+from src.shared.coalescer import GenerateCoalescer
+from src.shared.predict import concurrency_modifier, create_predict_for_generate
 from src.shared.schedulers import SD_SCHEDULER_CHOICES, SD_SCHEDULER_DEFAULT
-from src.shared.sd import generate
+from src.shared.sd import encode_prompts, generate, generate_batch, get_batch_key
 from .pipe import (
     DEFAULT_NEGATIVE_PROMPT_PREFIX,
     DEFAULT_PROMPT_PREFIX,
@@ -20,6 +21,12 @@ predict = create_predict_for_generate(
     default_scheduler=SD_SCHEDULER_DEFAULT,
     default_prompt_prefix=DEFAULT_PROMPT_PREFIX,
     default_negative_prompt_prefix=DEFAULT_NEGATIVE_PROMPT_PREFIX,
+    encode_prompts=encode_prompts,
+    coalescer=GenerateCoalescer(
+        get_batch_key=get_batch_key, generate_batch=generate_batch
+    ),
 )
 
-runpod.serverless.start({"handler": predict})
+runpod.serverless.start(
+    {"handler": predict, "concurrency_modifier": concurrency_modifier}
+)
@@ -3,7 +3,7 @@
 #
 # https://mingukkang.github.io/GigaGAN/
 from math import log2, ceil
-from functools import partial
+from functools import lru_cache, partial
 from typing import Any, Optional, List, Iterable
 
 import torch
@@ -109,10 +109,12 @@ class AdaptiveConv2DMod(nn.Module):
         weights = weights * (mod + 1)
 
         if self.demod:
+            # In fp32, the sum of squares overflows fp16 and eps underflows it
             inv_norm = (
-                reduce(weights**2, "b o i k1 k2 -> b o 1 1 1", "sum")
+                reduce(weights.float() ** 2, "b o i k1 k2 -> b o 1 1 1", "sum")
                 .clamp(min=self.eps)
                 .rsqrt()
+                .to(weights.dtype)
             )
             weights = weights * inv_norm
 
@@ -711,19 +713,21 @@ class UnetUpsampler(torch.nn.Module):
         return rgb, []
 
 
+# Splits a (c, h, w) image into a (h_chunks * w_chunks, c, chunk_size, chunk_size) batch, row by row.
+# Sides that aren't a multiple of chunk_size are zero padded at the end.
 def tile_image(image, chunk_size=64):
     c, h, w = image.shape
     h_chunks = ceil(h / chunk_size)
     w_chunks = ceil(w / chunk_size)
-    tiles = []
-    for i in range(h_chunks):
-        for j in range(w_chunks):
-            tile = image[
-                :,
-                i * chunk_size : (i + 1) * chunk_size,
-                j * chunk_size : (j + 1) * chunk_size,
-            ]
-            tiles.append(tile)
+    pad_h = h_chunks * chunk_size - h
+    pad_w = w_chunks * chunk_size - w
+    if pad_h > 0 or pad_w > 0:
+        image = F.pad(image, (0, pad_w, 0, pad_h))
+    tiles = (
+        image.reshape(c, h_chunks, chunk_size, w_chunks, chunk_size)
+        .permute(1, 3, 0, 2, 4)
+        .reshape(h_chunks * w_chunks, c, chunk_size, chunk_size)
+    )
     return tiles, h_chunks, w_chunks
 
 
@@ -761,33 +765,161 @@ def create_offset_weights(weights, image_size):
     return full_weights[offset:, offset:]
 
 
+# Normalized (tile_size, tile_size) blend weights of the aligned and the offset pass, cached per tile size and device.
+# The full size weights of both passes repeat every tile, so only one tile is kept and it is broadcast over the grid.
+# The returned tensors are shared between calls and must not be modified in place.
+@lru_cache(maxsize=4)
+def get_overlapped_blend_weights(tile_size, device):
+    weights_aligned = create_checkerboard_weights(tile_size)
+    # The offset pass is shifted by half a tile, same as create_offset_weights over a whole image
+    offset = tile_size // 2
+    weights_offset = torch.roll(weights_aligned, shifts=(-offset, -offset), dims=(0, 1))
+
+    normalizer = weights_offset + weights_aligned
+    weights_aligned = (weights_aligned / normalizer).to(device)
+    weights_offset = (weights_offset / normalizer).to(device)
+    return weights_aligned, weights_offset
+
+
+# Feathered (tile_size, tile_size) weights, linear ramps over the overlap on every edge, cached per size and device.
+# The returned tensor is shared between calls and must not be modified in place.
+@lru_cache(maxsize=16)
+def create_feather_weights(tile_size, overlap, device):
+    ramp = torch.ones(tile_size)
+    if overlap > 0:
+        # Never zero, so the image border where only one tile contributes stays covered
+        edge = (torch.arange(overlap) + 0.5) / overlap
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge.flip(0)
+    return torch.outer(ramp, ramp).to(device)
+
+
+# Splits a (c, h, w) image into overlapping tiles, h and w must be chunk_size + a multiple of stride
+def tile_image_overlapped(image, chunk_size=64, stride=48):
+    c = image.shape[0]
+    tiles = image.unfold(1, chunk_size, stride).unfold(2, chunk_size, stride)
+    h_chunks, w_chunks = tiles.shape[1], tiles.shape[2]
+    tiles = tiles.permute(1, 2, 0, 3, 4).reshape(
+        h_chunks * w_chunks, c, chunk_size, chunk_size
+    )
+    return tiles, h_chunks, w_chunks
+
+
+# Inverse of tile_image_overlapped, overlapping tiles are blended with the given (s, s) weights
+def merge_tiles_overlapped(tiles, h_chunks, w_chunks, stride, weights):
+    n, c, s, _ = tiles.shape
+    output_size = (s + (h_chunks - 1) * stride, s + (w_chunks - 1) * stride)
+    columns = (tiles * weights).reshape(n, c * s * s).t().unsqueeze(0)
+    merged = F.fold(columns, output_size, kernel_size=s, stride=stride)
+    weight_columns = weights.reshape(1, s * s, 1).expand(1, s * s, n)
+    normalizer = F.fold(weight_columns, output_size, kernel_size=s, stride=stride)
+    return merged[0] / normalizer[0]
+
+
+# Inverse of tile_image, reassembles a batch of tiles into a single (c, h, w) image on the tiles' device
 def merge_tiles(tiles, h_chunks, w_chunks, chunk_size=64):
-    # Determine the shape of the output tensor
-    c = tiles[0].shape[0]
-    h = h_chunks * chunk_size
-    w = w_chunks * chunk_size
+    c = tiles.shape[1]
+    return (
+        tiles.reshape(h_chunks, w_chunks, c, chunk_size, chunk_size)
+        .permute(2, 0, 3, 1, 4)
+        .reshape(c, h_chunks * chunk_size, w_chunks * chunk_size)
+    )
 
-    # Create an empty tensor to hold the merged image
-    merged = torch.zeros((c, h, w), dtype=tiles[0].dtype)
 
-    # Iterate over the tiles and place them in the correct position
-    for idx, tile in enumerate(tiles):
-        i = idx // w_chunks
-        j = idx % w_chunks
+def is_out_of_memory_error(e: Exception) -> bool:
+    # Non-CUDA backends raise a plain RuntimeError when an allocation fails
+    return isinstance(e, torch.cuda.OutOfMemoryError) or (
+        isinstance(e, RuntimeError) and "out of memory" in str(e).lower()
+    )
 
-        h_start = i * chunk_size
-        w_start = j * chunk_size
 
-        tile_h, tile_w = tile.shape[1:]
-        merged[:, h_start : h_start + tile_h, w_start : w_start + tile_w] = tile
+class TileBatchSizer:
+    """Largest number of tiles per upsampler pass that fits in memory, tracked per device and dtype.
 
-    return merged
+    Batches start at max_batch_size and are halved on out of memory errors until they fit. After
+    probe_after_passes full passes in a row without one, the batch size is doubled again up to
+    max_batch_size, so memory that was only short for a while doesn't cap the batches for good.
+    simulated_max_batch_size makes larger batches fail like an OOM would, to test on CPU.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 64,
+        simulated_max_batch_size: int | None = None,
+        probe_after_passes: int = 16,
+    ):
+        self.max_batch_size = max_batch_size
+        self.simulated_max_batch_size = simulated_max_batch_size
+        self.probe_after_passes = probe_after_passes
+        self.batch_sizes: dict[tuple[str, str], int] = {}
+        self.clean_passes: dict[tuple[str, str], int] = {}
+
+    def get_batch_size(self, device, dtype) -> int:
+        return self.batch_sizes.get((str(device), str(dtype)), self.max_batch_size)
+
+    def back_off(self, device, dtype, batch_size: int) -> int:
+        """Remember and return the batch size to retry with after batch_size ran out of memory."""
+        key = (str(device), str(dtype))
+        new_batch_size = max(1, batch_size // 2)
+        self.batch_sizes[key] = new_batch_size
+        self.clean_passes[key] = 0
+        return new_batch_size
+
+    def record_pass(self, device, dtype, batch_size: int):
+        """Count a pass of batch_size tiles that fit, the batch size is doubled after enough of them in a row."""
+        key = (str(device), str(dtype))
+        current = self.get_batch_size(device, dtype)
+        # Smaller passes, like the last one of an image, don't show that the current size fits
+        if current >= self.max_batch_size or batch_size < current:
+            return
+        clean_passes = self.clean_passes.get(key, 0) + 1
+        if clean_passes >= self.probe_after_passes:
+            self.batch_sizes[key] = min(self.max_batch_size, current * 2)
+            clean_passes = 0
+        self.clean_passes[key] = clean_passes
+
+    def check(self, batch_size: int):
+        if (
+            self.simulated_max_batch_size is not None
+            and batch_size > self.simulated_max_batch_size
+        ):
+            raise torch.cuda.OutOfMemoryError(
+                f"Simulated out of memory: {batch_size} tiles > {self.simulated_max_batch_size}"
+            )
+
+
+AURASR_DTYPES = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
 
 
 class AuraSR:
-    def __init__(self, config: dict[str, Any], device: str = "cuda"):
-        self.upsampler = UnetUpsampler(**config).to(device)
+    def __init__(
+        self,
+        config: dict[str, Any],
+        device: str = "cuda",
+        tile_batch_sizer: TileBatchSizer | None = None,
+        precision: str = "fp32",
+        channels_last: bool = False,
+    ):
+        if precision not in AURASR_DTYPES:
+            raise ValueError(
+                f'Invalid precision: "{precision}". Must be one of {list(AURASR_DTYPES.keys())}.'
+            )
+        self.dtype = AURASR_DTYPES[precision]
+        self.channels_last = channels_last
+        self.upsampler = UnetUpsampler(**config).to(device=device, dtype=self.dtype)
+        if channels_last:
+            # Only the regular convolutions, the modulated conv weights are 5D and used as grouped convs
+            for module in self.upsampler.modules():
+                if isinstance(module, nn.Conv2d):
+                    module.to(memory_format=torch.channels_last)
         self.input_image_size = config["input_image_size"]
+        self.tile_batch_sizer = (
+            tile_batch_sizer if tile_batch_sizer is not None else TileBatchSizer()
+        )
 
     @classmethod
     def from_pretrained(
@@ -795,6 +927,8 @@ class AuraSR:
         model_id: str = "fal-ai/AuraSR",
         use_safetensors: bool = True,
         device: str = "cuda",
+        precision: str = "fp32",
+        channels_last: bool = False,
     ):
         import json
         import torch
@@ -830,7 +964,7 @@ class AuraSR:
             hf_model_path = Path(snapshot_download(model_id))
             config = json.loads((hf_model_path / "config.json").read_text())
 
-        model = cls(config, device)
+        model = cls(config, device, precision=precision, channels_last=channels_last)
 
         if use_safetensors:
             try:
@@ -857,12 +991,69 @@ class AuraSR:
         model.upsampler.load_state_dict(checkpoint, strict=True)
         return model
 
+    # Tiles per upsampler pass for the current device and dtype, capped by max_batch_size
+    def get_tile_batch_size(self, max_batch_size: int | None = None) -> int:
+        batch_size = self.tile_batch_sizer.get_batch_size(
+            self.upsampler.device, self.dtype
+        )
+        if max_batch_size is not None:
+            batch_size = min(batch_size, max_batch_size)
+        return batch_size
+
+    # Runs the upsampler over a batch of tiles. Every finished batch is copied into an fp32 buffer on the CPU,
+    # so the device only holds the batch being upscaled and merging never needs full size device copies.
+    # Batches that run out of memory are retried with half the tiles.
+    def process_tiles(self, tiles: Tensor, max_batch_size: int | None = None) -> Tensor:
+        device = self.upsampler.device
+        dtype = self.dtype
+        output_size = self.input_image_size * 4
+        reconstructed_tiles = torch.empty(
+            (tiles.shape[0], tiles.shape[1], output_size, output_size),
+            dtype=torch.float32,
+        )
+        batch_size = self.get_tile_batch_size(max_batch_size)
+        i = 0
+        while i < tiles.shape[0]:
+            model_input = tiles[i : i + batch_size].to(device=device, dtype=dtype)
+            if self.channels_last:
+                model_input = model_input.contiguous(memory_format=torch.channels_last)
+            try:
+                self.tile_batch_sizer.check(model_input.shape[0])
+                generator_output = self.upsampler(
+                    lowres_image=model_input,
+                    # Drawn in fp32 so every precision gets the same noise
+                    noise=torch.randn(model_input.shape[0], 128, device=device).to(
+                        dtype
+                    ),
+                )
+            except RuntimeError as e:
+                failed_batch_size = model_input.shape[0]
+                if not is_out_of_memory_error(e) or failed_batch_size == 1:
+                    raise
+                del model_input
+                if device.type == "cuda":
+                    torch.cuda.empty_cache()
+                batch_size = self.tile_batch_sizer.back_off(
+                    device, dtype, failed_batch_size
+                )
+                continue
+            reconstructed_tiles[i : i + model_input.shape[0]].copy_(
+                generator_output.clamp_(0, 1)
+            )
+            i += model_input.shape[0]
+            self.tile_batch_sizer.record_pass(device, dtype, model_input.shape[0])
+            batch_size = self.get_tile_batch_size(max_batch_size)
+            del model_input, generator_output
+        return reconstructed_tiles
+
     @torch.no_grad()
-    def upscale_4x(self, image: Image.Image, max_batch_size=8) -> Image.Image:
+    def upscale_4x(
+        self, image: Image.Image, max_batch_size: int | None = None
+    ) -> Image.Image:
         tensor_transform = transforms.ToTensor()
         device = self.upsampler.device
 
-        image_tensor = tensor_transform(image).unsqueeze(0)
+        image_tensor = tensor_transform(image).unsqueeze(0).to(device)
         _, _, h, w = image_tensor.shape
         pad_h = (
             self.input_image_size - h % self.input_image_size
@@ -876,23 +1067,7 @@ class AuraSR:
             image_tensor, (0, pad_w, 0, pad_h), mode="reflect"
         ).squeeze(0)
         tiles, h_chunks, w_chunks = tile_image(image_tensor, self.input_image_size)
-
-        # Batch processing of tiles
-        num_tiles = len(tiles)
-        batches = [
-            tiles[i : i + max_batch_size] for i in range(0, num_tiles, max_batch_size)
-        ]
-        reconstructed_tiles = []
-
-        for batch in batches:
-            model_input = torch.stack(batch).to(device)
-            generator_output = self.upsampler(
-                lowres_image=model_input,
-                noise=torch.randn(model_input.shape[0], 128, device=device),
-            )
-            reconstructed_tiles.extend(
-                list(generator_output.clamp_(0, 1).detach().cpu())
-            )
+        reconstructed_tiles = self.process_tiles(tiles, max_batch_size)
 
         merged_tensor = merge_tiles(
             reconstructed_tiles, h_chunks, w_chunks, self.input_image_size * 4
@@ -905,95 +1080,193 @@ class AuraSR:
     # Tiled 4x upscaling with overlapping tiles to reduce seam artifacts
     # weights options are 'checkboard' and 'constant'
     @torch.no_grad()
-    def upscale_4x_overlapped(self, image, max_batch_size=8, weight_type="checkboard"):
+    def upscale_4x_overlapped(
+        self, image, max_batch_size: int | None = None, weight_type="checkboard"
+    ):
+        return self.upscale_4x_overlapped_many([image], max_batch_size, weight_type)[0]
+
+    # Number of tiles upscale_4x_overlapped runs through the upsampler for an image of this size
+    def get_overlapped_tile_count(self, width: int, height: int) -> int:
+        h_chunks = ceil(height / self.input_image_size)
+        w_chunks = ceil(width / self.input_image_size)
+        # The offset pass pads half a tile on every side, one more tile per row and column
+        return h_chunks * w_chunks + (h_chunks + 1) * (w_chunks + 1)
+
+    # Number of tiles upscale_4x_feathered_many runs through the upsampler for an image of this size
+    def get_feathered_tile_count(
+        self, width: int, height: int, tile_overlap: int
+    ) -> int:
+        stride = self.input_image_size - tile_overlap
+        h_chunks = 1 + ceil(max(height - self.input_image_size, 0) / stride)
+        w_chunks = 1 + ceil(max(width - self.input_image_size, 0) / stride)
+        return h_chunks * w_chunks
+
+    # Single pass 4x upscaling with tiles overlapping by tile_overlap input pixels, blended with feathered weights.
+    # Costs about (tile / (tile - tile_overlap))^2 tiles per tile of the image, instead of 2x for the offset pass.
+    @torch.no_grad()
+    def upscale_4x_feathered_many(
+        self,
+        images: List[Image.Image],
+        tile_overlap: int = 16,
+        max_batch_size: int | None = None,
+    ) -> List[Image.Image]:
+        if tile_overlap < 0 or tile_overlap >= self.input_image_size:
+            raise ValueError(
+                f"tile_overlap should be between 0 and {self.input_image_size - 1} but got {tile_overlap}"
+            )
         tensor_transform = transforms.ToTensor()
         device = self.upsampler.device
+        stride = self.input_image_size - tile_overlap
+
+        tiles = []
+        grids = []
+        for image in images:
+            image_tensor = tensor_transform(image).unsqueeze(0).to(device)
+            _, _, h, w = image_tensor.shape
+
+            # Pad to one tile plus a whole number of strides
+            pad_h = (
+                self.input_image_size
+                + ceil(max(h - self.input_image_size, 0) / stride) * stride
+                - h
+            )
+            pad_w = (
+                self.input_image_size
+                + ceil(max(w - self.input_image_size, 0) / stride) * stride
+                - w
+            )
+            image_tensor = torch.nn.functional.pad(
+                image_tensor, (0, pad_w, 0, pad_h), mode="reflect"
+            ).squeeze(0)
 
-        image_tensor = tensor_transform(image).unsqueeze(0)
-        _, _, h, w = image_tensor.shape
-
-        # Calculate paddings
-        pad_h = (
-            self.input_image_size - h % self.input_image_size
-        ) % self.input_image_size
-        pad_w = (
-            self.input_image_size - w % self.input_image_size
-        ) % self.input_image_size
+            image_tiles, h_chunks, w_chunks = tile_image_overlapped(
+                image_tensor, self.input_image_size, stride
+            )
+            tiles.append(image_tiles)
+            grids.append((h, w, h_chunks, w_chunks))
 
-        # Pad the image
-        image_tensor = torch.nn.functional.pad(
-            image_tensor, (0, pad_w, 0, pad_h), mode="reflect"
-        ).squeeze(0)
+        reconstructed_tiles = self.process_tiles(torch.cat(tiles), max_batch_size)
+        weights = create_feather_weights(
+            self.input_image_size * 4, tile_overlap * 4, reconstructed_tiles.device
+        )
 
-        # Function to process tiles
-        def process_tiles(tiles, h_chunks, w_chunks):
-            num_tiles = len(tiles)
-            batches = [
-                tiles[i : i + max_batch_size]
-                for i in range(0, num_tiles, max_batch_size)
-            ]
-            reconstructed_tiles = []
-
-            for batch in batches:
-                model_input = torch.stack(batch).to(device)
-                generator_output = self.upsampler(
-                    lowres_image=model_input,
-                    noise=torch.randn(model_input.shape[0], 128, device=device),
-                )
-                reconstructed_tiles.extend(
-                    list(generator_output.clamp_(0, 1).detach().cpu())
-                )
+        to_pil = transforms.ToPILImage()
+        upscaled_images = []
+        start = 0
+        for h, w, h_chunks, w_chunks in grids:
+            end = start + h_chunks * w_chunks
+            merged = merge_tiles_overlapped(
+                reconstructed_tiles[start:end], h_chunks, w_chunks, stride * 4, weights
+            )
+            start = end
+            upscaled_images.append(to_pil(merged[:, : h * 4, : w * 4]))
+        return upscaled_images
 
-            return merge_tiles(
-                reconstructed_tiles, h_chunks, w_chunks, self.input_image_size * 4
+    # Same as upscale_4x_overlapped for several images, tiles of every image share the upsampler batches
+    @torch.no_grad()
+    def upscale_4x_overlapped_many(
+        self,
+        images: List[Image.Image],
+        max_batch_size: int | None = None,
+        weight_type="checkboard",
+    ) -> List[Image.Image]:
+        if weight_type not in ("checkboard", "constant"):
+            raise ValueError(
+                "weight_type should be either 'gaussian' or 'constant' but got",
+                weight_type,
             )
+        tensor_transform = transforms.ToTensor()
+        device = self.upsampler.device
+        offset = self.input_image_size // 2
 
-        # First pass
-        tiles1, h_chunks1, w_chunks1 = tile_image(image_tensor, self.input_image_size)
-        result1 = process_tiles(tiles1, h_chunks1, w_chunks1)
+        # Tiles of both passes of every image, in order, and the grids to reassemble them
+        tiles = []
+        grids = []
+        for image in images:
+            image_tensor = tensor_transform(image).unsqueeze(0).to(device)
+            _, _, h, w = image_tensor.shape
+
+            # Calculate paddings
+            pad_h = (
+                self.input_image_size - h % self.input_image_size
+            ) % self.input_image_size
+            pad_w = (
+                self.input_image_size - w % self.input_image_size
+            ) % self.input_image_size
+
+            # Pad the image
+            image_tensor = torch.nn.functional.pad(
+                image_tensor, (0, pad_w, 0, pad_h), mode="reflect"
+            ).squeeze(0)
+
+            # First pass
+            tiles1, h_chunks1, w_chunks1 = tile_image(
+                image_tensor, self.input_image_size
+            )
 
-        # Second pass with offset
-        offset = self.input_image_size // 2
-        image_tensor_offset = torch.nn.functional.pad(
-            image_tensor, (offset, offset, offset, offset), mode="reflect"
-        ).squeeze(0)
+            # Second pass with offset
+            image_tensor_offset = torch.nn.functional.pad(
+                image_tensor, (offset, offset, offset, offset), mode="reflect"
+            ).squeeze(0)
+            tiles2, h_chunks2, w_chunks2 = tile_image(
+                image_tensor_offset, self.input_image_size
+            )
 
-        tiles2, h_chunks2, w_chunks2 = tile_image(
-            image_tensor_offset, self.input_image_size
-        )
-        result2 = process_tiles(tiles2, h_chunks2, w_chunks2)
+            tiles.extend([tiles1, tiles2])
+            grids.append((h, w, [(h_chunks1, w_chunks1), (h_chunks2, w_chunks2)]))
+
+        reconstructed_tiles = self.process_tiles(torch.cat(tiles), max_batch_size)
+
+        upscaled_images = []
+        start = 0
+        for h, w, pass_grids in grids:
+            results = []
+            for h_chunks, w_chunks in pass_grids:
+                end = start + h_chunks * w_chunks
+                results.append(
+                    merge_tiles(
+                        reconstructed_tiles[start:end],
+                        h_chunks,
+                        w_chunks,
+                        self.input_image_size * 4,
+                    )
+                )
+                start = end
+            upscaled_images.append(
+                self.blend_overlapped(results[0], results[1], h, w, weight_type)
+            )
+        return upscaled_images
 
+    # Blends the aligned and the offset pass of upscale_4x_overlapped, weights options are 'checkboard' and 'constant'
+    def blend_overlapped(
+        self, result1: Tensor, result2: Tensor, h: int, w: int, weight_type: str
+    ) -> Image.Image:
         # unpad
-        offset_4x = offset * 4
+        offset_4x = self.input_image_size // 2 * 4
         result2_interior = result2[:, offset_4x:-offset_4x, offset_4x:-offset_4x]
 
+        # Both passes are blended in place, viewed as (c, h_chunks, tile, w_chunks, tile) grids so the
+        # (tile, tile) weights broadcast over the channels and the tiles without a full size weight map
+        tile_size = self.input_image_size * 4
         if weight_type == "checkboard":
-            weight_tile = create_checkerboard_weights(self.input_image_size * 4)
-
-            weight_shape = result2_interior.shape[1:]
-            weights_1 = create_offset_weights(weight_tile, weight_shape)
-            weights_2 = repeat_weights(weight_tile, weight_shape)
-
-            normalizer = weights_1 + weights_2
-            weights_1 = weights_1 / normalizer
-            weights_2 = weights_2 / normalizer
-
-            weights_1 = weights_1.unsqueeze(0).repeat(3, 1, 1)
-            weights_2 = weights_2.unsqueeze(0).repeat(3, 1, 1)
-        elif weight_type == "constant":
-            weights_1 = torch.ones_like(result2_interior) * 0.5
-            weights_2 = weights_1
-        else:
-            raise ValueError(
-                "weight_type should be either 'gaussian' or 'constant' but got",
-                weight_type,
+            weights_2, weights_1 = get_overlapped_blend_weights(
+                tile_size, result1.device
             )
+            weights_2 = weights_2[:, None, :]
+            weights_1 = weights_1[:, None, :]
+        else:
+            weights_1 = 0.5
+            weights_2 = 0.5
 
-        result1 = result1 * weights_2
-        result2 = result2_interior * weights_1
+        result1.unflatten(1, (-1, tile_size)).unflatten(3, (-1, tile_size)).mul_(
+            weights_2
+        )
+        result2_interior.unflatten(1, (-1, tile_size)).unflatten(
+            3, (-1, tile_size)
+        ).mul_(weights_1)
 
         # Average the overlapping region
-        result1 = result1 + result2
+        result1.add_(result2_interior)
 
         # Remove padding
         unpadded = result1[:, : h * 4, : w * 4]
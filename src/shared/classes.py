@@ -1,9 +1,11 @@
+from concurrent.futures import Future
 from typing import Any, Dict, Generic, List, Optional, TypeVar
 from urllib.parse import urlparse
 from pydantic import BaseModel, Field, validator
 
 from PIL import Image
 from .constants import SIZE_LIST
+from .image_cache import ImageCacheStats
 
 T = TypeVar("T")
 
@@ -34,6 +36,8 @@ class GenerateInput:
         prompt_strength: float | None,
         scheduler: Any,
         seed: int,
+        init_image: "Future[Image.Image] | None" = None,
+        mask_image: "Future[Image.Image] | None" = None,
     ):
         self.prompt = prompt
         self.negative_prompt = negative_prompt
@@ -49,6 +53,10 @@ class GenerateInput:
         self.prompt_strength = prompt_strength
         self.scheduler = scheduler
         self.seed = seed
+        # Downloads started by prefetch_input_images, resolved by the generate function
+        self.init_image = init_image
+        self.mask_image = mask_image
+        self.image_cache_stats = ImageCacheStats()
 
 
 class GenerateOutput:
@@ -244,14 +252,24 @@ class GenerateFunctionProps(Generic[P]):
         self.dont_set_scheduler = dont_set_scheduler
 
 
+class InputValidationError(ValueError):
+    """The job input turned out to be invalid while it was being processed, like an input image that is too large."""
+
+
 class UpscaleInput:
     def __init__(
         self,
         images: List[str],
         scale: int,
+        tile_overlap: int | None = None,
+        image_downloads: "List[Future[Image.Image]] | None" = None,
     ):
         self.images = images
         self.scale = scale
+        self.tile_overlap = tile_overlap
+        # Downloads started by the endpoint's prefetch, resolved by the upscale function
+        self.image_downloads = image_downloads
+        self.image_cache_stats = ImageCacheStats()
 
 
 U = TypeVar("U")
@@ -279,6 +297,12 @@ class PredictionUpscaleInput(BaseModel):
         le=4,
         default=4,
     )
+    tile_overlap: Optional[int] = Field(
+        description="Overlap in pixels between neighbouring tiles, upscaled in a single pass with feathered blending. Higher hides seams better but is slower. If not set, two full offset passes are blended.",
+        ge=0,
+        le=32,
+        default=None,
+    )
     output_image_extension: str = Field(
         description="Output type of the image. Can be 'png' or 'jpeg' or 'webp'.",
         default="jpeg",
@@ -335,4 +359,5 @@ def predict_input_to_upscale_input(
     return UpscaleInput(
         images=input.images,
         scale=input.scale,
+        tile_overlap=input.tile_overlap,
     )
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import (
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    List,
+    Set,
+    Tuple,
+    TypeVar,
+)
+from .classes import GenerateFunctionProps, GenerateOutput
+from .constants import GENERATE_COALESCE_MAX_OUTPUTS, GENERATE_COALESCE_WINDOW_MS
+from .gpu_queue import run_on_gpu
+
+T = TypeVar("T")
+
+
+class CoalescedJob(Generic[T]):
+    def __init__(
+        self,
+        props: GenerateFunctionProps[T],
+        on_output: Callable[[GenerateOutput], None],
+        done: "asyncio.Future[None]",
+    ):
+        self.props = props
+        self.on_output = on_output
+        self.done = done
+        self.queued_at = time.time()
+
+
+class CoalescedBatch(Generic[T]):
+    def __init__(self):
+        self.jobs: List[CoalescedJob[T]] = []
+        self.num_outputs = 0
+
+
+class GenerateCoalescer(Generic[T]):
+    """Groups compatible jobs that queue for the GPU close together into one batched generate call.
+
+    A batch takes jobs until the GPU picks it up, which is at least window_ms after its first job,
+    so under load batches fill up while they wait their turn and an idle GPU only waits the window.
+    Jobs with the same batch key can share a call, a None key means the job runs on its own.
+    """
+
+    def __init__(
+        self,
+        get_batch_key: Callable[[GenerateFunctionProps[T]], Hashable | None],
+        generate_batch: Callable[
+            [List[GenerateFunctionProps[T]]], Iterable[Tuple[int, GenerateOutput]]
+        ],
+        window_ms: int = GENERATE_COALESCE_WINDOW_MS,
+        max_outputs: int = GENERATE_COALESCE_MAX_OUTPUTS,
+    ):
+        self.get_batch_key = get_batch_key
+        self.generate_batch = generate_batch
+        self.window_ms = window_ms
+        self.max_outputs = max_outputs
+        self.lock = threading.Lock()
+        # Batch key -> batch that still takes jobs
+        self.open_batches: Dict[Hashable, CoalescedBatch[T]] = {}
+        # The event loop only keeps weak references to tasks, so pending batches are kept here
+        self.tasks: Set["asyncio.Task[None]"] = set()
+        # Jobs per batch -> number of batches
+        self.batch_sizes: Dict[int, int] = {}
+
+    def get_key(self, props: GenerateFunctionProps[T]) -> Hashable | None:
+        """Batch key of a job, None when it runs on its own."""
+        # Also turns coalescing off when max_outputs is 1
+        if props.input.num_outputs >= self.max_outputs:
+            return None
+        return self.get_batch_key(props)
+
+    async def run(
+        self,
+        batch_key: Hashable,
+        props: GenerateFunctionProps[T],
+        on_output: Callable[[GenerateOutput], None],
+    ):
+        """Generate the outputs of a job as part of a batch, on_output is called on the GPU thread."""
+        loop = asyncio.get_running_loop()
+        job = CoalescedJob(props=props, on_output=on_output, done=loop.create_future())
+        num_outputs = props.input.num_outputs
+        with self.lock:
+            batch = self.open_batches.get(batch_key)
+            if batch is None or batch.num_outputs + num_outputs > self.max_outputs:
+                batch = CoalescedBatch()
+                self.open_batches[batch_key] = batch
+                task = loop.create_task(self._run_batch(batch_key, batch))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            batch.jobs.append(job)
+            batch.num_outputs += num_outputs
+        await job.done
+
+    async def _run_batch(self, batch_key: Hashable, batch: CoalescedBatch[T]):
+        await asyncio.sleep(self.window_ms / 1000)
+        try:
+            await run_on_gpu(self._generate_batch, batch_key, batch)
+        except Exception as e:
+            for job in batch.jobs:
+                job.done.set_exception(e)
+        else:
+            for job in batch.jobs:
+                job.done.set_result(None)
+
+    def _generate_batch(self, batch_key: Hashable, batch: CoalescedBatch[T]):
+        # Closed once the GPU gets to it, later jobs start a new batch
+        with self.lock:
+            if self.open_batches.get(batch_key) is batch:
+                del self.open_batches[batch_key]
+            self.batch_sizes[len(batch.jobs)] = (
+                self.batch_sizes.get(len(batch.jobs), 0) + 1
+            )
+        logging.info(
+            f"🧺 Coalesced batch | {len(batch.jobs)} job(s) | {batch.num_outputs} output(s) | Waited: {round((time.time() - batch.jobs[0].queued_at) * 1000)}ms"
+        )
+        outputs = self.generate_batch([job.props for job in batch.jobs])
+        for job_index, output in outputs:
+            batch.jobs[job_index].on_output(output)
+
+    def log_stats(self):
+        with self.lock:
+            batch_sizes = sorted(self.batch_sizes.items())
+        logging.info(
+            f"🧺 Coalesced batch sizes | {' | '.join(f'{size} job(s): {count}' for size, count in batch_sizes)}"
+        )
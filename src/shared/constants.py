@@ -2,12 +2,74 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+import os
+import tempfile
 from enum import Enum
 
 
 WORKER_VERSION = "v1.20"
 SIZE_LIST = list(range(256, 1537, 8))
 
+# Max number of jobs the worker takes at once, their GPU work is queued and runs one job at a time
+WORKER_MAX_CONCURRENCY = int(os.environ.get("WORKER_MAX_CONCURRENCY", 4))
+# Max number of output pixels (width * height * images) denoised in a single pipeline call.
+# Outputs beyond this budget are split into multiple batched calls.
+GENERATE_MAX_BATCH_PIXELS = int(
+    os.environ.get("GENERATE_MAX_BATCH_PIXELS", 4 * 1024 * 1024)
+)
+# Compatible text2img jobs that queue for the GPU within this window are generated in one batch
+GENERATE_COALESCE_WINDOW_MS = int(os.environ.get("GENERATE_COALESCE_WINDOW_MS", 10))
+# Max number of outputs of a coalesced batch, 1 turns coalescing off
+GENERATE_COALESCE_MAX_OUTPUTS = int(os.environ.get("GENERATE_COALESCE_MAX_OUTPUTS", 8))
+# Refine the first output on its own so it's ready before the rest of the batch
+REFINER_STREAM_FIRST_OUTPUT = (
+    os.environ.get("REFINER_STREAM_FIRST_OUTPUT", "false").lower() == "true"
+)
+# Timeout in seconds for downloading input images
+DOWNLOAD_TIMEOUT = float(os.environ.get("DOWNLOAD_TIMEOUT", 10))
+# Number of threads downloading input images in the background
+DOWNLOAD_MAX_WORKERS = int(os.environ.get("DOWNLOAD_MAX_WORKERS", 8))
+# Downloaded input images are cached on disk, decoded and fitted ones in memory
+IMAGE_CACHE_DIR = os.environ.get(
+    "IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sc-worker-image-cache")
+)
+IMAGE_CACHE_DISK_MAX_BYTES = int(
+    os.environ.get("IMAGE_CACHE_DISK_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+)
+IMAGE_CACHE_MEMORY_MAX_BYTES = int(
+    os.environ.get("IMAGE_CACHE_MEMORY_MAX_BYTES", 512 * 1024 * 1024)
+)
+# Max number of keep-alive connections per host in the process-wide upload session
+UPLOAD_POOL_MAXSIZE = int(os.environ.get("UPLOAD_POOL_MAXSIZE", 16))
+# Number of threads encoding images before they are handed to the upload threads
+UPLOAD_ENCODE_WORKERS = int(os.environ.get("UPLOAD_ENCODE_WORKERS", 4))
+# Images with at least this many pixels are encoded into a temporary file and streamed to S3
+UPLOAD_SPOOL_MIN_PIXELS = int(os.environ.get("UPLOAD_SPOOL_MIN_PIXELS", 4096 * 4096))
+# Image encoder backend: "pil", "simplejpeg" or "auto" (simplejpeg for JPEG when installed)
+# simplejpeg isn't in requirements.txt, it wasn't faster than PIL in src/tools/encode_benchmark.py
+IMAGE_ENCODER = os.environ.get("IMAGE_ENCODER", "pil")
+# WebP encoder effort, 0 (fast) to 6 (slow, smaller files)
+WEBP_METHOD = int(os.environ.get("WEBP_METHOD", 4))
+# Max GPU memory in bytes used by cached prompt embeddings, pinned prompts don't count
+PROMPT_EMBEDS_CACHE_MAX_BYTES = int(
+    os.environ.get("PROMPT_EMBEDS_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+# Max number of Kandinsky 2.2 prior outputs cached per (prompt, seed) and per negative prompt
+KANDINSKY_PRIOR_CACHE_MAX_ENTRIES = int(
+    os.environ.get("KANDINSKY_PRIOR_CACHE_MAX_ENTRIES", 4096)
+)
+# Upper bound of AuraSR tiles per upsampler pass, lower values are found automatically on out of memory errors
+AURASR_MAX_TILE_BATCH_SIZE = int(os.environ.get("AURASR_MAX_TILE_BATCH_SIZE", 64))
+# AuraSR upsampler precision: "fp32", "fp16" or "bf16"
+# Check reduced precision on the pretrained weights with src/tools/aura_sr_quality.py --model first
+AURASR_PRECISION = os.environ.get("AURASR_PRECISION", "fp32")
+# Run the AuraSR upsampler convolutions in channels_last memory format
+AURASR_CHANNELS_LAST = os.environ.get("AURASR_CHANNELS_LAST", "false").lower() == "true"
+# Max pixels of an upscaled output, larger inputs are decoded at a lower scale (JPEG) or rejected
+UPSCALE_MAX_OUTPUT_PIXELS = int(
+    os.environ.get("UPSCALE_MAX_OUTPUT_PIXELS", 12288 * 12288)
+)
+
 
 class TabulateLevels(Enum):
     PRIMARY = "simple_grid"
@@ -0,0 +1,113 @@
+from io import BytesIO
+import tempfile
+from typing import IO, Callable, Dict
+import numpy as np
+from PIL import Image
+from .constants import IMAGE_ENCODER, WEBP_METHOD
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+
+def to_rgb_array(image: Image.Image | np.ndarray) -> np.ndarray:
+    if isinstance(image, np.ndarray):
+        return np.ascontiguousarray(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return np.asarray(image)
+
+
+def to_pil_image(image: Image.Image | np.ndarray) -> Image.Image:
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image)
+    return image
+
+
+def save_with_pil(
+    image: Image.Image | np.ndarray, extension: str, quality: int, fp: IO[bytes]
+):
+    pil_image = to_pil_image(image)
+    # JPEG has no alpha channel, other formats keep the mode they already have
+    if extension == "jpeg" and pil_image.mode != "RGB":
+        pil_image = pil_image.convert("RGB")
+    save_kwargs = {}
+    if extension == "webp":
+        save_kwargs["method"] = WEBP_METHOD
+    pil_image.save(fp, format=extension.upper(), quality=quality, **save_kwargs)
+
+
+def encode_with_pil(
+    image: Image.Image | np.ndarray, extension: str, quality: int
+) -> memoryview:
+    img_bytes = BytesIO()
+    save_with_pil(image, extension, quality, img_bytes)
+    # getbuffer() exposes the encoded bytes without the copy getvalue() makes
+    return img_bytes.getbuffer()
+
+
+def encode_with_simplejpeg(
+    image: Image.Image | np.ndarray, extension: str, quality: int
+) -> memoryview:
+    if simplejpeg is None:
+        raise ImportError(
+            "The simplejpeg library is not installed. "
+            "Please install it with `pip install simplejpeg` or set IMAGE_ENCODER to 'pil'."
+        )
+    if extension != "jpeg":
+        return encode_with_pil(image, extension, quality)
+    return memoryview(
+        simplejpeg.encode_jpeg(
+            to_rgb_array(image),
+            quality=quality,
+            colorspace="RGB",
+            # Same chroma subsampling as PIL so file sizes match
+            colorsubsampling="420",
+        )
+    )
+
+
+ImageEncoder = Callable[[Image.Image | np.ndarray, str, int], memoryview]
+
+IMAGE_ENCODERS: Dict[str, ImageEncoder] = {
+    "pil": encode_with_pil,
+    "simplejpeg": encode_with_simplejpeg,
+}
+
+
+def get_image_encoder(name: str = IMAGE_ENCODER) -> ImageEncoder:
+    if name == "auto":
+        name = "simplejpeg" if simplejpeg is not None else "pil"
+    if name not in IMAGE_ENCODERS:
+        raise ValueError(
+            f'Invalid image encoder: "{name}". Must be one of {["auto", *IMAGE_ENCODERS.keys()]}.'
+        )
+    return IMAGE_ENCODERS[name]
+
+
+IMAGE_ENCODER_SELECTED = get_image_encoder()
+
+
+def encode_image(
+    image: Image.Image | np.ndarray, extension: str, quality: int
+) -> memoryview:
+    """Encode a PIL image or an HxWx3 uint8 array to the target format."""
+    return IMAGE_ENCODER_SELECTED(image, extension, quality)
+
+
+def encode_image_to_file(
+    image: Image.Image | np.ndarray, extension: str, quality: int
+) -> IO[bytes]:
+    """Encode straight into an anonymous temporary file, rewound and ready to be streamed.
+
+    PIL writes the encoder output to the file chunk by chunk, so the encoded image is
+    never held in memory as a whole."""
+    file = tempfile.TemporaryFile()
+    try:
+        save_with_pil(image, extension, quality, file)
+        file.seek(0)
+    except Exception:
+        file.close()
+        raise
+    return file
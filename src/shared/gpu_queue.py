@@ -0,0 +1,20 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+
+# Single thread, so GPU work of concurrent jobs runs one job at a time, in the order it was queued
+GPU_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+
+
+async def run_on_gpu(fn: Callable[..., T], *args) -> T:
+    """Run fn on the GPU thread, the event loop is free to set up and upload other jobs meanwhile."""
+    return await asyncio.get_running_loop().run_in_executor(GPU_EXECUTOR, fn, *args)
+
+
+async def wait_for_downloads(downloads: Iterable["Future | None"]):
+    """Wait for input image downloads without raising, failures surface when the job resolves them."""
+    pending = [asyncio.wrap_future(download) for download in downloads if download]
+    if len(pending) > 0:
+        await asyncio.wait(pending)
@@ -6,12 +6,18 @@ import textwrap
 import torch
 from contextlib import contextmanager
 from PIL import Image, ImageOps
-from io import BytesIO
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Optional
 from tabulate import tabulate
-from src.shared.classes import PredictionGenerateInput
-from .constants import TabulateLevels
+from src.shared.classes import GenerateInput, PredictionGenerateInput
+from src.shared.device import DEVICE_CUDA
+from .image_cache import IMAGE_CACHE, ImageCacheStats
+from .constants import (
+    DOWNLOAD_MAX_WORKERS,
+    DOWNLOAD_TIMEOUT,
+    GENERATE_MAX_BATCH_PIXELS,
+    TabulateLevels,
+)
 
 
 @contextmanager
@@ -42,11 +48,45 @@ def time_log(
         logging.info(f"{end_prefix}{job_name} | {execution_time:.0f}{unit}")
 
 
-def download_image(url: str) -> Image.Image:
-    response = requests.get(url)
+DOWNLOAD_EXECUTOR = ThreadPoolExecutor(
+    max_workers=DOWNLOAD_MAX_WORKERS, thread_name_prefix="download"
+)
+
+
+def fetch_image_bytes(url: str, timeout: float = DOWNLOAD_TIMEOUT) -> bytes:
+    response = requests.get(url, timeout=timeout)
     if response.status_code != 200:
         raise Exception(f"Failed to download image from {url}")
-    return Image.open(BytesIO(response.content)).convert("RGB")
+    return response.content
+
+
+def download_image(
+    url: str,
+    timeout: float = DOWNLOAD_TIMEOUT,
+    cache_stats: ImageCacheStats | None = None,
+) -> Image.Image:
+    return IMAGE_CACHE.get_image(
+        url, fetch=lambda: fetch_image_bytes(url, timeout=timeout), stats=cache_stats
+    )
+
+
+def prefetch_image(
+    url: str, cache_stats: ImageCacheStats | None = None
+) -> "Future[Image.Image]":
+    """Start downloading an image in the background."""
+    return DOWNLOAD_EXECUTOR.submit(download_image, url, cache_stats=cache_stats)
+
+
+def prefetch_input_images(input: GenerateInput):
+    """Start downloading the init and mask images of a job, so they're fetched while the job is set up."""
+    if input.init_image_url is not None:
+        input.init_image = prefetch_image(
+            input.init_image_url, cache_stats=input.image_cache_stats
+        )
+    if input.mask_image_url is not None:
+        input.mask_image = prefetch_image(
+            input.mask_image_url, cache_stats=input.image_cache_stats
+        )
 
 
 def fit_image(image: Image.Image, width: int, height: int):
@@ -54,17 +94,38 @@ def fit_image(image: Image.Image, width: int, height: int):
     return resized_image
 
 
-def download_and_fit_image(url: str, width: int, height: int):
-    image = download_image(url=url)
-    if image.width == width and image.height == height:
-        return image
-    return fit_image(image, width, height)
+def download_and_fit_image(
+    url: str,
+    width: int,
+    height: int,
+    prefetched: "Future[Image.Image] | None" = None,
+    cache_stats: ImageCacheStats | None = None,
+):
+    # A cached fitted variant skips both the download and the fit
+    return IMAGE_CACHE.get_fitted_image(
+        url,
+        width,
+        height,
+        load_image=lambda: (
+            prefetched.result()
+            if prefetched is not None
+            else download_image(url=url, cache_stats=cache_stats)
+        ),
+        stats=cache_stats,
+    )
 
 
 def download_and_fit_image_mask(
-    url: str, width: int, height: int, inverted: bool = False
+    url: str,
+    width: int,
+    height: int,
+    inverted: bool = False,
+    prefetched: "Future[Image.Image] | None" = None,
+    cache_stats: ImageCacheStats | None = None,
 ):
-    image = download_and_fit_image(url, width, height)
+    image = download_and_fit_image(
+        url, width, height, prefetched=prefetched, cache_stats=cache_stats
+    )
     image = image.convert("L")
     mask = 1 - np.array(image) / 255.0 if inverted else np.array(image) / 255.0
     return mask
@@ -175,23 +236,40 @@ def pad_dim(width: int, height: int, multiple: int):
     return new_width, new_height
 
 
+def crop_image(image: Image.Image, width: int, height: int) -> Image.Image:
+    old_width, old_height = image.size
+    if old_width < width or old_height < height:
+        return image
+    left = int((old_width - width) / 2)
+    top = int((old_height - height) / 2)
+    right = int((old_width + width) / 2)
+    bottom = int((old_height + height) / 2)
+    return image.crop((left, top, right, bottom))
+
+
 def crop_images(
     images: List[Image.Image], width: int, height: int
 ) -> List[Image.Image]:
-    cropped_images: List[Image.Image] = []
-    for image in images:
-        old_width, old_height = image.size
-        if old_width < width or old_height < height:
-            cropped_images.append(image)
-        else:
-            left = int((old_width - width) / 2)
-            top = int((old_height - height) / 2)
-            right = int((old_width + width) / 2)
-            bottom = int((old_height + height) / 2)
-
-            cropped_image = image.crop((left, top, right, bottom))
-            cropped_images.append(cropped_image)
-    return cropped_images
+    return [crop_image(image, width, height) for image in images]
+
+
+def get_batch_chunks(
+    num_outputs: int,
+    width: int,
+    height: int,
+    max_batch_pixels: int = GENERATE_MAX_BATCH_PIXELS,
+) -> List[List[int]]:
+    # Split output indexes into batches that fit within the pixel budget, at least 1 per batch
+    batch_size = max(1, min(num_outputs, max_batch_pixels // (width * height)))
+    indexes = list(range(num_outputs))
+    return [indexes[i : i + batch_size] for i in range(0, num_outputs, batch_size)]
+
+
+def create_generators(
+    seed: int, indexes: List[int], device: str = DEVICE_CUDA
+) -> List[torch.Generator]:
+    # One generator per output, seeded the same way as a single image run with "seed + i"
+    return [torch.Generator(device=device).manual_seed(seed + i) for i in indexes]
 
 
 def log_gpu_memory(device_id: int = 0, message: str = "Value"):
@@ -0,0 +1,329 @@
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+from typing import Callable, Dict, List, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+from PIL import Image, ImageOps
+from .constants import (
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_DISK_MAX_BYTES,
+    IMAGE_CACHE_MEMORY_MAX_BYTES,
+)
+from .lru_cache import LRUCache
+
+# Query params of presigned S3/GCS/CloudFront URLs, they change on every request for the same object
+SIGNATURE_QUERY_PARAMS = {
+    "x-amz-algorithm",
+    "x-amz-credential",
+    "x-amz-date",
+    "x-amz-expires",
+    "x-amz-security-token",
+    "x-amz-signature",
+    "x-amz-signedheaders",
+    "x-goog-algorithm",
+    "x-goog-credential",
+    "x-goog-date",
+    "x-goog-expires",
+    "x-goog-signature",
+    "x-goog-signedheaders",
+    "awsaccesskeyid",
+    "signature",
+    "expires",
+    "key-pair-id",
+    "policy",
+}
+SIGNATURE_MARKERS = {"x-amz-signature", "x-goog-signature", "signature"}
+URL_INDEX_MAX_ENTRIES = 100_000
+
+
+def normalize_url(url: str) -> str:
+    """Drop signature query params, only if the URL is actually signed, and sort the rest."""
+    parsed = urlparse(url)
+    params = parse_qsl(parsed.query, keep_blank_values=True)
+    is_signed = any(key.lower() in SIGNATURE_MARKERS for key, _ in params)
+    if is_signed:
+        params = [
+            (key, value)
+            for key, value in params
+            if key.lower() not in SIGNATURE_QUERY_PARAMS
+        ]
+    return urlunparse(
+        parsed._replace(
+            scheme=parsed.scheme.lower(),
+            netloc=parsed.netloc.lower(),
+            query=urlencode(sorted(params)),
+            fragment="",
+        )
+    )
+
+
+def get_image_size(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+class ImageCacheStats:
+    """Cache hits and misses of one job, counted by the lookups themselves so concurrent jobs don't mix.
+
+    The downloads of a job run on several threads, so the counters are locked."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {
+            "memory_hits": 0,
+            "memory_misses": 0,
+            "disk_hits": 0,
+            "disk_misses": 0,
+        }
+
+    def count(self, key: str):
+        with self.lock:
+            self.counts[key] += 1
+
+    def get(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts)
+
+
+class ImageCache:
+    """Downloaded images cached on disk by content hash, decoded and fitted variants cached in memory.
+
+    Normalized URLs map to the content hash of what they pointed to, so re-running a job on
+    the same image skips the download, the decode and the fit."""
+
+    def __init__(self, directory: str, disk_max_bytes: int, memory_max_bytes: int):
+        self.directory = directory
+        self.lock = threading.Lock()
+        # Counters of every job since the worker started
+        self.totals = ImageCacheStats()
+        # URL hash -> content hash, "" until the index file of an entry from a previous run is read
+        self.url_index: LRUCache[str, str] = LRUCache(
+            max_size=URL_INDEX_MAX_ENTRIES,
+            get_size=lambda _: 1,
+            on_evict=self._evict_url,
+        )
+        # Content hash -> URL hashes pointing to it, so they are evicted with the content
+        self.content_urls: Dict[str, Set[str]] = {}
+        # Content hash -> file size on disk
+        self.disk: LRUCache[str, int] = LRUCache(
+            max_size=disk_max_bytes,
+            get_size=lambda size: size,
+            on_evict=self._evict_content,
+        )
+        # (normalized URL, width, height) -> decoded image, width and height are None when not fitted
+        self.memory: LRUCache[Tuple[str, int | None, int | None], Image.Image] = (
+            LRUCache(max_size=memory_max_bytes, get_size=get_image_size)
+        )
+        self._load_disk()
+
+    def _path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, content_hash)
+
+    def _url_path(self, url_hash: str) -> str:
+        return os.path.join(self.directory, "urls", url_hash)
+
+    def _scan(self, directory: str) -> List[os.DirEntry]:
+        os.makedirs(directory, exist_ok=True)
+        entries = [
+            entry
+            for entry in os.scandir(directory)
+            if entry.is_file() and not entry.name.endswith(".tmp")
+        ]
+        # Oldest first, so the most recently used files are the last to be evicted
+        return sorted(entries, key=lambda entry: entry.stat().st_mtime)
+
+    def _load_disk(self):
+        try:
+            content_entries = self._scan(self.directory)
+            url_entries = self._scan(os.path.join(self.directory, "urls"))
+        except OSError as e:
+            logging.warning(f"Image cache directory is not usable: {e}")
+            return
+        for entry in content_entries:
+            self.disk.put(entry.name, entry.stat().st_size)
+        # The index files are read on their first lookup, their content may be gone by then
+        for entry in url_entries:
+            self.url_index.put(entry.name, "")
+
+    def _remove_file(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _touch_file(self, path: str):
+        # The mtime orders the entries after a restart, so it is kept at the last use
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict_content(self, content_hash: str, _: int):
+        self._remove_file(self._path(content_hash))
+        with self.lock:
+            url_hashes = self.content_urls.pop(content_hash, set())
+        for url_hash in url_hashes:
+            self.url_index.remove(url_hash)
+            self._remove_file(self._url_path(url_hash))
+
+    def _evict_url(self, url_hash: str, content_hash: str):
+        with self.lock:
+            self.content_urls.get(content_hash, set()).discard(url_hash)
+        self._remove_file(self._url_path(url_hash))
+
+    def _read_file(self, content_hash: str) -> bytes | None:
+        if content_hash not in self.disk:
+            return None
+        path = self._path(content_hash)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        # Mark as recently used
+        self.disk.get(content_hash)
+        self._touch_file(path)
+        return data
+
+    def _write_file(self, content_hash: str, data: bytes):
+        path = self._path(content_hash)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Failed to write image to cache: {e}")
+            return
+        self.disk.put(content_hash, len(data))
+
+    def _read_url_file(self, url_hash: str) -> str | None:
+        # The URL index is persisted next to the images, so the disk cache survives restarts
+        try:
+            with open(self._url_path(url_hash), "r") as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _write_url_file(self, url_hash: str, content_hash: str):
+        path = self._url_path(url_hash)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                f.write(content_hash)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Failed to write image URL to cache: {e}")
+
+    def _link_url(self, url_hash: str, content_hash: str, old_content_hash: str | None):
+        with self.lock:
+            if old_content_hash:
+                self.content_urls.get(old_content_hash, set()).discard(url_hash)
+            self.content_urls.setdefault(content_hash, set()).add(url_hash)
+        self.url_index.put(url_hash, content_hash)
+
+    def _count(self, key: str, stats: ImageCacheStats | None):
+        self.totals.count(key)
+        if stats is not None:
+            stats.count(key)
+
+    def get_bytes(
+        self,
+        url: str,
+        fetch: Callable[[], bytes],
+        stats: ImageCacheStats | None = None,
+    ) -> bytes:
+        """Return the bytes of the URL, calling fetch only on a cache miss."""
+        url_hash = hashlib.sha256(normalize_url(url).encode()).hexdigest()
+        indexed = self.url_index.get(url_hash)
+        content_hash = indexed
+        if indexed == "":
+            content_hash = self._read_url_file(url_hash)
+            if content_hash is not None:
+                self._link_url(url_hash, content_hash, None)
+        if content_hash is not None:
+            data = self._read_file(content_hash)
+            if data is not None:
+                self._touch_file(self._url_path(url_hash))
+                self._count("disk_hits", stats)
+                return data
+        self._count("disk_misses", stats)
+        data = fetch()
+        new_content_hash = hashlib.sha256(data).hexdigest()
+        if new_content_hash not in self.disk:
+            self._write_file(new_content_hash, data)
+        else:
+            self.disk.get(new_content_hash)
+            self._touch_file(self._path(new_content_hash))
+        self._link_url(url_hash, new_content_hash, content_hash)
+        self._write_url_file(url_hash, new_content_hash)
+        return data
+
+    def get_image(
+        self,
+        url: str,
+        fetch: Callable[[], bytes],
+        stats: ImageCacheStats | None = None,
+    ) -> Image.Image:
+        """Return the decoded RGB image of the URL."""
+        key = (normalize_url(url), None, None)
+        image = self.memory.get(key)
+        if image is not None:
+            self._count("memory_hits", stats)
+            return image
+        self._count("memory_misses", stats)
+        image = Image.open(BytesIO(self.get_bytes(url, fetch, stats))).convert("RGB")
+        self.memory.put(key, image)
+        return image
+
+    def get_fitted_image(
+        self,
+        url: str,
+        width: int,
+        height: int,
+        load_image: Callable[[], Image.Image],
+        stats: ImageCacheStats | None = None,
+    ) -> Image.Image:
+        """Return the image of the URL fitted to width and height, load_image is only called on a miss."""
+        key = (normalize_url(url), width, height)
+        fitted = self.memory.get(key)
+        if fitted is not None:
+            self._count("memory_hits", stats)
+            return fitted
+        self._count("memory_misses", stats)
+        image = load_image()
+        if image.width == width and image.height == height:
+            return image
+        fitted = ImageOps.fit(image, (width, height))
+        self.memory.put(key, fitted)
+        return fitted
+
+    def stats(self) -> Dict[str, int]:
+        """Counters since the worker started."""
+        totals = self.totals.get()
+        return {
+            "memory_hits": totals["memory_hits"],
+            "memory_misses": totals["memory_misses"],
+            "memory_evictions": self.memory.stats()["evictions"],
+            "disk_hits": totals["disk_hits"],
+            "disk_misses": totals["disk_misses"],
+            "disk_evictions": self.disk.stats()["evictions"],
+            "url_evictions": self.url_index.stats()["evictions"],
+        }
+
+    def log_stats(self, job_stats: ImageCacheStats):
+        """Log the hits and misses of a job, next to the evictions since the worker started."""
+        job = job_stats.get()
+        total = self.stats()
+        logging.info(
+            f"🗂️ Image cache | Memory hits: {job['memory_hits']} | Memory misses: {job['memory_misses']} | Disk hits: {job['disk_hits']} | Disk misses: {job['disk_misses']} | Memory evictions: {total['memory_evictions']} | Disk evictions: {total['disk_evictions']}"
+        )
+
+
+IMAGE_CACHE = ImageCache(
+    directory=IMAGE_CACHE_DIR,
+    disk_max_bytes=IMAGE_CACHE_DISK_MAX_BYTES,
+    memory_max_bytes=IMAGE_CACHE_MEMORY_MAX_BYTES,
+)
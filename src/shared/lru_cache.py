@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, List, Set, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Thread-safe LRU cache bounded by the total size of its values.
+
+    Pinned entries are never evicted and don't count towards the size limit."""
+
+    def __init__(
+        self,
+        max_size: int,
+        get_size: Callable[[V], int],
+        on_evict: Callable[[K, V], None] | None = None,
+    ):
+        self.max_size = max_size
+        self.get_size = get_size
+        self.on_evict = on_evict
+        self.lock = threading.Lock()
+        self.items: "OrderedDict[K, Tuple[V, int]]" = OrderedDict()
+        self.pinned: Set[K] = set()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: K) -> V | None:
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def __contains__(self, key: K) -> bool:
+        with self.lock:
+            return key in self.items
+
+    def put(self, key: K, value: V, pinned: bool = False):
+        size = self.get_size(value)
+        evicted: List[Tuple[K, V]] = []
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None and key not in self.pinned:
+                self.size -= old[1]
+            self.pinned.discard(key)
+            if not pinned and size > self.max_size:
+                # Too large to ever fit, don't flush the whole cache for it
+                return
+            self.items[key] = (value, size)
+            if pinned:
+                self.pinned.add(key)
+            else:
+                self.size += size
+            for evict_key in list(self.items.keys()):
+                if self.size <= self.max_size:
+                    break
+                if evict_key in self.pinned:
+                    continue
+                evict_value, evict_size = self.items.pop(evict_key)
+                self.size -= evict_size
+                self.evictions += 1
+                evicted.append((evict_key, evict_value))
+        if self.on_evict is not None:
+            for evict_key, evict_value in evicted:
+                self.on_evict(evict_key, evict_value)
+
+    def remove(self, key: K) -> V | None:
+        """Drop an entry without calling on_evict, the caller cleans up after it."""
+        with self.lock:
+            item = self.items.pop(key, None)
+            if item is None:
+                return None
+            if key in self.pinned:
+                self.pinned.discard(key)
+            else:
+                self.size -= item[1]
+            return item[0]
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.items),
+                "size": self.size,
+            }
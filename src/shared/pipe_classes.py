@@ -1,17 +1,22 @@
-from diffusers import (
-    KandinskyV22InpaintPipeline,
-    KandinskyV22Pipeline,
-    KandinskyV22PriorPipeline,
-    StableDiffusionImg2ImgPipeline,
-    StableDiffusionInpaintPipeline,
-    StableDiffusionPipeline,
-    StableDiffusionXLImg2ImgPipeline,
-    StableDiffusionXLPipeline,
-    FluxPipeline,
-    StableDiffusion3Pipeline,
-    StableDiffusion3Img2ImgPipeline,
-)
-from src.shared.aura_sr import AuraSR
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+# Only used in annotations, so an endpoint doesn't load the pipelines of the others and AuraSR doesn't load diffusers
+if TYPE_CHECKING:
+    from diffusers import (
+        KandinskyV22InpaintPipeline,
+        KandinskyV22Pipeline,
+        KandinskyV22PriorPipeline,
+        StableDiffusionImg2ImgPipeline,
+        StableDiffusionInpaintPipeline,
+        StableDiffusionPipeline,
+        StableDiffusionXLImg2ImgPipeline,
+        StableDiffusionXLPipeline,
+        FluxPipeline,
+        StableDiffusion3Pipeline,
+        StableDiffusion3Img2ImgPipeline,
+    )
+    from src.shared.aura_sr import AuraSR
 
 
 class StableDiffusionPipeObject:
@@ -0,0 +1,185 @@
+import importlib
+import logging
+import os
+import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+import torch
+from huggingface_hub import try_to_load_from_cache
+
+# Ranges of the weight files read at the same time, cold start is mostly waiting on the disk
+PREFETCH_MAX_WORKERS = 8
+PREFETCH_RANGE_BYTES = 256 * 1024 * 1024
+PREFETCH_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+class PipelineLoad:
+    """Arguments of a from_pretrained call, kwargs go to the pipeline and its components."""
+
+    def __init__(self, pipeline_class: Any, model_id: str, **kwargs: Any):
+        self.pipeline_class = pipeline_class
+        self.model_id = model_id
+        self.kwargs = kwargs
+
+
+class ComponentLoad:
+    def __init__(self, load: PipelineLoad, name: str, model_class: Any):
+        self.load = load
+        self.name = name
+        self.model_class = model_class
+        self.prefetches: List["Future[int]"] = []
+        self.prefetched_ms = 0
+        self.load_ms = 0
+        self.move_ms = 0
+        self.model: "Future[torch.nn.Module] | None" = None
+
+
+def get_model_components(load: PipelineLoad) -> List[Tuple[str, Any]]:
+    """Components of the pipeline that hold weights, from its model_index.json."""
+    config = load.pipeline_class.load_config(load.model_id)
+    components: List[Tuple[str, Any]] = []
+    for name, value in config.items():
+        # Components passed in, like safety_checker=None, aren't loaded
+        if name.startswith("_") or name in load.kwargs:
+            continue
+        if not isinstance(value, (list, tuple)) or len(value) != 2 or None in value:
+            continue
+        library, class_name = value
+        try:
+            model_class = getattr(importlib.import_module(library), class_name)
+        except (ImportError, AttributeError):
+            # Left to the pipeline, like pipeline specific modules
+            continue
+        if isinstance(model_class, type) and issubclass(model_class, torch.nn.Module):
+            components.append((name, model_class))
+    return components
+
+
+def get_weight_files(model_id: str, subfolder: str, variant: str | None) -> List[str]:
+    """Safetensors shards of a component, empty when the model isn't downloaded yet."""
+    if os.path.isdir(model_id):
+        folder = model_id
+    else:
+        model_index = try_to_load_from_cache(model_id, "model_index.json")
+        if not isinstance(model_index, str):
+            return []
+        folder = os.path.dirname(model_index)
+    folder = os.path.join(folder, subfolder)
+    if not os.path.isdir(folder):
+        return []
+    # model.safetensors, model.fp16.safetensors, model.fp16-00001-of-00002.safetensors...
+    suffix = rf"\.{re.escape(variant)}" if variant is not None else ""
+    pattern = re.compile(rf"^[^.]+{suffix}(-\d+-of-\d+)?\.safetensors$")
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder) if pattern.match(name)
+    )
+
+
+def read_range(path: str, offset: int, length: int) -> int:
+    """Read part of a file so it's in the page cache when safetensors memory maps it."""
+    buffer = bytearray(PREFETCH_CHUNK_BYTES)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        read = 0
+        while read < length:
+            n = os.preadv(fd, [buffer], offset + read)
+            if n == 0:
+                break
+            read += n
+    finally:
+        os.close(fd)
+    return min(read, length)
+
+
+def prefetch_file(executor: ThreadPoolExecutor, path: str) -> List["Future[int]"]:
+    size = os.path.getsize(path)
+    return [
+        executor.submit(
+            read_range, path, offset, min(PREFETCH_RANGE_BYTES, size - offset)
+        )
+        for offset in range(0, size, PREFETCH_RANGE_BYTES)
+    ]
+
+
+def move_to_device(
+    component: ComponentLoad, model: torch.nn.Module, device: str
+) -> torch.nn.Module:
+    start = time.time()
+    model = model.to(device)
+    component.move_ms = round((time.time() - start) * 1000)
+    return model
+
+
+def load_pipelines(loads: List[PipelineLoad], device: str) -> List[Any]:
+    """Load pipelines on the device, the same as from_pretrained followed by .to(device).
+
+    The weight files of every component are read in parallel first. Components are then built one
+    at a time from memory, since building a model patches torch globally, and each one moves to the
+    device while the next one loads. Timings of every component are logged.
+    """
+    start = time.time()
+    components: List[ComponentLoad] = [
+        ComponentLoad(load, name, model_class)
+        for load in loads
+        for name, model_class in get_model_components(load)
+    ]
+    with ThreadPoolExecutor(
+        PREFETCH_MAX_WORKERS, thread_name_prefix="prefetch"
+    ) as prefetch_executor, ThreadPoolExecutor(
+        1, thread_name_prefix="to_device"
+    ) as move_executor:
+        for component in components:
+            for path in get_weight_files(
+                component.load.model_id,
+                component.name,
+                component.load.kwargs.get("variant"),
+            ):
+                component.prefetches.extend(prefetch_file(prefetch_executor, path))
+
+        for component in components:
+            for prefetch in component.prefetches:
+                prefetch.result()
+            component.prefetched_ms = round((time.time() - start) * 1000)
+            load_start = time.time()
+            model = component.model_class.from_pretrained(
+                component.load.model_id,
+                subfolder=component.name,
+                torch_dtype=component.load.kwargs.get("torch_dtype"),
+                variant=component.load.kwargs.get("variant"),
+                # The pipeline's default, without it transformers models hold a full model and a
+                # separate state dict on the host
+                low_cpu_mem_usage=component.load.kwargs.get("low_cpu_mem_usage", True),
+            )
+            component.load_ms = round((time.time() - load_start) * 1000)
+            component.model = move_executor.submit(
+                move_to_device, component, model, device
+            )
+
+        pipelines: List[Any] = []
+        pipeline_ms: List[int] = []
+        for load in loads:
+            load_start = time.time()
+            loaded: Dict[str, Any] = {
+                component.name: component.model.result()
+                for component in components
+                if component.load is load and component.model is not None
+            }
+            pipeline = load.pipeline_class.from_pretrained(
+                load.model_id, **loaded, **load.kwargs
+            )
+            # Anything left to the pipeline is still on the CPU
+            pipelines.append(pipeline.to(device))
+            pipeline_ms.append(round((time.time() - load_start) * 1000))
+
+    for component in components:
+        size = sum(prefetch.result() for prefetch in component.prefetches)
+        logging.info(
+            f"⏱️ Load | {component.load.model_id} | {component.name} | Prefetched at: {component.prefetched_ms}ms | Load: {component.load_ms}ms | To {device}: {component.move_ms}ms | {size / (1024**2):.0f} MB"
+        )
+    for load, ms in zip(loads, pipeline_ms):
+        logging.info(f"⏱️ Load | {load.model_id} | Pipeline | {ms}ms")
+    logging.info(
+        f"⏱️ Load | {len(loads)} pipeline(s) | {len(components)} component(s) | Total: {round((time.time() - start) * 1000)}ms"
+    )
+    return pipelines
@@ -1,36 +1,52 @@
+import asyncio
 import logging
 import time
-from typing import Callable, List, TypeVar
+from typing import Callable, Iterable, Iterator, List, TypeVar
 from pydantic import ValidationError
 from tabulate import tabulate
-from src.shared.constants import WORKER_VERSION, TabulateLevels
-from src.shared.helpers import create_log_table_for_generate
-from .upload import upload_images
+from src.shared.constants import (
+    WORKER_MAX_CONCURRENCY,
+    WORKER_VERSION,
+    TabulateLevels,
+)
+from src.shared.helpers import create_log_table_for_generate, prefetch_input_images
+from .coalescer import GenerateCoalescer
+from .gpu_queue import run_on_gpu, wait_for_downloads
+from .image_cache import IMAGE_CACHE
+from .upload import UploadJob, submit_uploads
 from .classes import (
     GenerateFunctionProps,
     GenerateOutput,
+    InputValidationError,
     PredictionGenerateInput,
     PredictionUpscaleInput,
     UploadObject,
     UpscaleFunctionProps,
+    UpscaleInput,
     UpscaleOutput,
     predict_input_to_generate_input,
-    GenerateFunctionProps,
     predict_input_to_upscale_input,
 )
 
 T = TypeVar("T")
 
 
+def concurrency_modifier(current_concurrency: int) -> int:
+    """Number of jobs runpod hands to the worker at once, their GPU work still runs one job at a time."""
+    return WORKER_MAX_CONCURRENCY
+
+
 def create_predict_for_generate(
     model_name: str,
     get_pipe_object: Callable[[bool], T],
-    generate: Callable[[GenerateFunctionProps[T]], List[GenerateOutput]],
+    generate: Callable[[GenerateFunctionProps[T]], Iterable[GenerateOutput]],
     schedulers: List[str],
     default_scheduler: str,
     default_prompt_prefix: str | None = None,
     default_negative_prompt_prefix: str | None = None,
     dont_set_scheduler: bool = False,
+    coalescer: GenerateCoalescer[T] | None = None,
+    encode_prompts: Callable[[GenerateFunctionProps[T]], object] | None = None,
 ):
     class Model:
         def __init__(self):
@@ -38,7 +54,7 @@ def create_predict_for_generate(
 
     MODEL = Model()
 
-    def predict(job):
+    async def predict(job):
         job_input = job["input"]
         validated_input: PredictionGenerateInput | None = None
 
@@ -61,6 +77,10 @@ def create_predict_for_generate(
                 },
             }
 
+        # Start fetching input images right away, they download while the job is set up
+        generate_input = predict_input_to_generate_input(validated_input)
+        prefetch_input_images(generate_input)
+
         start_time = time.time()
         log_table = create_log_table_for_generate(
             model=model_name, input=validated_input
@@ -78,39 +98,70 @@ def create_predict_for_generate(
             )
         )
 
-        generate_input = predict_input_to_generate_input(validated_input)
-        outputs = generate(
-            GenerateFunctionProps(
-                input=generate_input,
-                pipe_object=MODEL.pipe_object,
-                model_name=model_name,
-                default_prompt_prefix=default_prompt_prefix,
-                default_negative_prompt_prefix=default_negative_prompt_prefix,
-                dont_set_scheduler=dont_set_scheduler,
-            )
+        props = GenerateFunctionProps(
+            input=generate_input,
+            pipe_object=MODEL.pipe_object,
+            model_name=model_name,
+            default_prompt_prefix=default_prompt_prefix,
+            default_negative_prompt_prefix=default_negative_prompt_prefix,
+            dont_set_scheduler=dont_set_scheduler,
         )
 
-        end_time = time.time()
-        duration_ms = round((end_time - start_time) * 1000)
-        logging.info(
-            tabulate(
-                [["🖼️ Generate", f"🟢 {duration_ms}ms"]] + log_table,
-                tablefmt=TabulateLevels.PRIMARY.value,
-            ),
-        )
+        # Input images download before the job queues for the GPU, so the GPU doesn't wait on the network.
+        # Meanwhile the prompts are encoded on the GPU thread, generate then gets them from the prompt cache.
+        downloads = [generate_input.init_image, generate_input.mask_image]
+        if encode_prompts is not None and any(downloads):
+            await asyncio.gather(
+                wait_for_downloads(downloads), run_on_gpu(encode_prompts, props)
+            )
+        else:
+            await wait_for_downloads(downloads)
+        queued_at = time.time()
 
-        upload_objects: List[UploadObject] = []
-        for i, output in enumerate(outputs):
-            upload_objects.append(
-                UploadObject(
-                    pil_image=output.image,
-                    signed_url=validated_input.signed_urls[i],
-                    target_extension=validated_input.output_image_extension,
-                    target_quality=validated_input.output_image_quality,
-                )
+        def to_upload_object(i: int, output: GenerateOutput) -> UploadObject:
+            return UploadObject(
+                pil_image=output.image,
+                signed_url=validated_input.signed_urls[i],
+                target_extension=validated_input.output_image_extension,
+                target_quality=validated_input.output_image_quality,
+            )
+
+        def log_generated():
+            end_time = time.time()
+            duration_ms = round((end_time - start_time) * 1000)
+            logging.info(
+                tabulate(
+                    [["🖼️ Generate", f"🟢 {duration_ms}ms"]] + log_table,
+                    tablefmt=TabulateLevels.PRIMARY.value,
+                ),
+            )
+
+        def get_upload_objects() -> Iterator[UploadObject]:
+            logging.info(
+                f"⏳ GPU queue | Waited: {round((time.time() - queued_at) * 1000)}ms"
+            )
+            for i, output in enumerate(generate(props)):
+                yield to_upload_object(i, output)
+            log_generated()
+
+        # Images are uploaded while the rest of the outputs are still being generated,
+        # the GPU moves on to the next job while the last uploads finish
+        batch_key = coalescer.get_key(props) if coalescer is not None else None
+        if coalescer is not None and batch_key is not None:
+            # Compatible jobs that queue around the same time share the pipeline calls
+            upload_job = UploadJob()
+            await coalescer.run(
+                batch_key,
+                props,
+                on_output=lambda output: upload_job.submit(
+                    to_upload_object(len(upload_job.tasks), output)
+                ),
             )
-        upload_results = upload_images(
-            upload_objects=upload_objects,
+            log_generated()
+        else:
+            upload_job = await run_on_gpu(submit_uploads, get_upload_objects())
+        upload_results = await asyncio.get_running_loop().run_in_executor(
+            None, upload_job.results
         )
 
         response = {
@@ -133,6 +184,9 @@ def create_predict_for_generate(
                 tablefmt=TabulateLevels.PRIMARY.value,
             )
         )
+        IMAGE_CACHE.log_stats(generate_input.image_cache_stats)
+        if coalescer is not None:
+            coalescer.log_stats()
 
         return response
 
@@ -145,7 +199,8 @@ P = TypeVar("P")
 def create_predict_for_upscale(
     model_name: str,
     get_pipe_object: Callable[[bool], P],
-    upscale: Callable[[UpscaleFunctionProps[P]], List[UpscaleOutput]],
+    upscale: Callable[[UpscaleFunctionProps[P]], Iterable[UpscaleOutput]],
+    prefetch_images: Callable[[UpscaleInput], None] | None = None,
 ):
     class Model:
         def __init__(self):
@@ -153,7 +208,7 @@ def create_predict_for_upscale(
 
     MODEL = Model()
 
-    def predict(job):
+    async def predict(job):
         job_input = job["input"]
         validated_input: PredictionUpscaleInput | None = None
 
@@ -183,30 +238,65 @@ def create_predict_for_upscale(
         )
 
         upscale_input = predict_input_to_upscale_input(validated_input)
-        outputs = upscale(
-            UpscaleFunctionProps(
-                input=upscale_input,
-                pipe_object=MODEL.pipe_object,
-                model_name=model_name,
-            )
-        )
-
-        end_time = time.time()
-        duration_ms = round((end_time - start_time) * 1000)
+        # Input images download before the job queues for the GPU, so the GPU doesn't wait on the network
+        if prefetch_images is not None:
+            prefetch_images(upscale_input)
+            await wait_for_downloads(upscale_input.image_downloads or [])
+            # Rejected inputs fail the job before it takes a turn on the GPU
+            for download in upscale_input.image_downloads or []:
+                e = download.exception()
+                if isinstance(e, InputValidationError):
+                    logging.error(f"🔴 Validation error: {e}")
+                    return {
+                        "error": {
+                            "code": "validation_error",
+                            "message": str(e),
+                        },
+                        "input": job_input,
+                        "metadata": {
+                            "worker_version": WORKER_VERSION,
+                        },
+                    }
+        queued_at = time.time()
 
-        upload_objects: List[UploadObject] = []
-        for i, output in enumerate(outputs):
-            upload_objects.append(
-                UploadObject(
+        def get_upload_objects() -> Iterator[UploadObject]:
+            logging.info(
+                f"⏳ GPU queue | Waited: {round((time.time() - queued_at) * 1000)}ms"
+            )
+            outputs = upscale(
+                UpscaleFunctionProps(
+                    input=upscale_input,
+                    pipe_object=MODEL.pipe_object,
+                    model_name=model_name,
+                )
+            )
+            for i, output in enumerate(outputs):
+                yield UploadObject(
                     pil_image=output.image,
                     signed_url=validated_input.signed_urls[i],
                     target_extension=validated_input.output_image_extension,
                     target_quality=validated_input.output_image_quality,
                 )
+
+        # Images are uploaded while the rest of the images are still being upscaled,
+        # the GPU moves on to the next job while the last uploads finish
+        try:
+            upload_job = await run_on_gpu(submit_uploads, get_upload_objects())
+            upload_results = await asyncio.get_running_loop().run_in_executor(
+                None, upload_job.results
             )
-        upload_results = upload_images(
-            upload_objects=upload_objects,
-        )
+        except InputValidationError as e:
+            logging.error(f"🔴 Validation error: {e}")
+            return {
+                "error": {
+                    "code": "validation_error",
+                    "message": str(e),
+                },
+                "input": job_input,
+                "metadata": {
+                    "worker_version": WORKER_VERSION,
+                },
+            }
 
         response = {
             "output": {
@@ -228,6 +318,7 @@ def create_predict_for_upscale(
                 tablefmt=TabulateLevels.PRIMARY.value,
             )
         )
+        IMAGE_CACHE.log_stats(upscale_input.image_cache_stats)
 
         return response
 
@@ -0,0 +1,129 @@
+import logging
+from typing import Any, Callable, Dict, Tuple
+import torch
+from .constants import PROMPT_EMBEDS_CACHE_MAX_BYTES
+from .lru_cache import LRUCache
+
+
+class PromptEmbeds:
+    def __init__(self, embeds: torch.Tensor, pooled_embeds: torch.Tensor | None):
+        self.embeds = embeds
+        self.pooled_embeds = pooled_embeds
+
+
+def get_prompt_embeds_size(prompt_embeds: PromptEmbeds) -> int:
+    size = prompt_embeds.embeds.numel() * prompt_embeds.embeds.element_size()
+    if prompt_embeds.pooled_embeds is not None:
+        pooled = prompt_embeds.pooled_embeds
+        size += pooled.numel() * pooled.element_size()
+    return size
+
+
+# (model, text, clip skip) -> text encoder outputs for a single prompt, kept on the GPU
+PROMPT_EMBEDS_CACHE: LRUCache[Tuple[str, str, int | None], PromptEmbeds] = LRUCache(
+    max_size=PROMPT_EMBEDS_CACHE_MAX_BYTES, get_size=get_prompt_embeds_size
+)
+
+
+@torch.no_grad()
+def encode_text(pipe: Any, text: str, clip_skip: int | None = None) -> PromptEmbeds:
+    """Run the text encoders of an SD, SDXL or SD3 pipeline on a single text, without guidance."""
+    kwargs: Dict[str, Any] = {
+        "prompt": text,
+        "device": pipe._execution_device,
+        "num_images_per_prompt": 1,
+        "do_classifier_free_guidance": False,
+        "clip_skip": clip_skip,
+    }
+    # SD3 has no defaults for its secondary prompts, None means "same as prompt"
+    if hasattr(pipe, "text_encoder_3"):
+        kwargs["prompt_2"] = None
+        kwargs["prompt_3"] = None
+    out = pipe.encode_prompt(**kwargs)
+    # SD returns (embeds, negative), SDXL and SD3 also return the pooled embeds
+    if len(out) == 4:
+        return PromptEmbeds(embeds=out[0], pooled_embeds=out[2])
+    return PromptEmbeds(embeds=out[0], pooled_embeds=None)
+
+
+@torch.no_grad()
+def encode_flux_text(
+    pipe: Any, text: str, clip_skip: int | None = None
+) -> PromptEmbeds:
+    """Run the T5 and CLIP text encoders of a FLUX pipeline, FLUX has no clip skip."""
+    embeds, pooled_embeds, _ = pipe.encode_prompt(
+        prompt=text,
+        prompt_2=None,
+        device=pipe._execution_device,
+        num_images_per_prompt=1,
+    )
+    return PromptEmbeds(embeds=embeds, pooled_embeds=pooled_embeds)
+
+
+def get_prompt_embeds(
+    pipe: Any,
+    model: str,
+    text: str,
+    clip_skip: int | None = None,
+    pinned: bool = False,
+    encode: Callable[[Any, str, int | None], PromptEmbeds] = encode_text,
+) -> PromptEmbeds:
+    key = (model, text, clip_skip)
+    prompt_embeds = PROMPT_EMBEDS_CACHE.get(key)
+    if prompt_embeds is None:
+        prompt_embeds = encode(pipe, text, clip_skip)
+        PROMPT_EMBEDS_CACHE.put(key, prompt_embeds, pinned=pinned)
+    return prompt_embeds
+
+
+def get_prompt_embeds_kwargs(
+    pipe: Any,
+    model: str,
+    prompt: str,
+    negative_prompt: str | None,
+    pinned_texts: Tuple[str | None, ...] = (),
+    clip_skip: int | None = None,
+) -> Dict[str, Any]:
+    """Pipeline kwargs with cached prompt and negative prompt embeds, in place of the prompt strings.
+
+    Texts in pinned_texts are never evicted, like the empty negative prompt and the default negative
+    prefix, which is the whole negative prompt of jobs that don't give one.
+    """
+    positive = get_prompt_embeds(
+        pipe, model, prompt, clip_skip=clip_skip, pinned=prompt in pinned_texts
+    )
+    if (
+        negative_prompt is None
+        and positive.pooled_embeds is not None
+        and getattr(pipe.config, "force_zeros_for_empty_prompt", False)
+    ):
+        # Same as SDXL does for a missing negative prompt
+        negative = PromptEmbeds(
+            embeds=torch.zeros_like(positive.embeds),
+            pooled_embeds=torch.zeros_like(positive.pooled_embeds),
+        )
+    else:
+        negative_text = negative_prompt or ""
+        negative = get_prompt_embeds(
+            pipe,
+            model,
+            negative_text,
+            clip_skip=clip_skip,
+            pinned=negative_text in pinned_texts,
+        )
+
+    kwargs: Dict[str, Any] = {
+        "prompt_embeds": positive.embeds,
+        "negative_prompt_embeds": negative.embeds,
+    }
+    if positive.pooled_embeds is not None:
+        kwargs["pooled_prompt_embeds"] = positive.pooled_embeds
+        kwargs["negative_pooled_prompt_embeds"] = negative.pooled_embeds
+    return kwargs
+
+
+def log_prompt_embeds_cache_stats():
+    stats = PROMPT_EMBEDS_CACHE.stats()
+    logging.info(
+        f"💬 Prompt embeds cache | Hits: {stats['hits']} | Misses: {stats['misses']} | Evictions: {stats['evictions']} | Entries: {stats['entries']} | Size: {stats['size'] / (1024**2):.1f} MB"
+    )
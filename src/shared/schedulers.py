@@ -1,32 +1,20 @@
-from diffusers import (
-    PNDMScheduler,
-    LMSDiscreteScheduler,
-    DDIMScheduler,
-    EulerDiscreteScheduler,
-    EulerAncestralDiscreteScheduler,
-    HeunDiscreteScheduler,
-    DPMSolverSinglestepScheduler,
-    DPMSolverMultistepScheduler,
-    DEISMultistepScheduler,
-    UniPCMultistepScheduler,
-    DDPMScheduler,
-    DDIMScheduler,
-    DDPMScheduler,
-    DPMSolverMultistepScheduler,
-)
+import copy
+import threading
+from typing import Any, Callable, Dict, Tuple
 
+# Scheduler class names, resolved on first use so picking a scheduler choice doesn't import diffusers
 SD_SCHEDULERS = {
-    "K_EULER_ANCESTRAL": {"from_config": EulerAncestralDiscreteScheduler.from_config},
-    "K_LMS": {"from_config": LMSDiscreteScheduler.from_config},
-    "PNDM": {"from_config": PNDMScheduler.from_config},
-    "DDIM": {"from_config": DDIMScheduler.from_config},
-    "K_EULER": {"from_config": EulerDiscreteScheduler.from_config},
-    "HEUN": {"from_config": HeunDiscreteScheduler.from_config},
-    "DPM++_2M": {"from_config": DPMSolverMultistepScheduler.from_config},
-    "DPM++_2S": {"from_config": DPMSolverSinglestepScheduler.from_config},
-    "DEIS": {"from_config": DEISMultistepScheduler.from_config},
-    "UNI_PC": {"from_config": UniPCMultistepScheduler.from_config},
-    "DDPM": {"from_config": DDPMScheduler.from_config},
+    "K_EULER_ANCESTRAL": {"scheduler": "EulerAncestralDiscreteScheduler"},
+    "K_LMS": {"scheduler": "LMSDiscreteScheduler"},
+    "PNDM": {"scheduler": "PNDMScheduler"},
+    "DDIM": {"scheduler": "DDIMScheduler"},
+    "K_EULER": {"scheduler": "EulerDiscreteScheduler"},
+    "HEUN": {"scheduler": "HeunDiscreteScheduler"},
+    "DPM++_2M": {"scheduler": "DPMSolverMultistepScheduler"},
+    "DPM++_2S": {"scheduler": "DPMSolverSinglestepScheduler"},
+    "DEIS": {"scheduler": "DEISMultistepScheduler"},
+    "UNI_PC": {"scheduler": "UniPCMultistepScheduler"},
+    "DDPM": {"scheduler": "DDPMScheduler"},
 }
 
 SD_SCHEDULER_CHOICES = [*SD_SCHEDULERS.keys()]
@@ -34,12 +22,60 @@ SD_SCHEDULER_DEFAULT = SD_SCHEDULER_CHOICES[0]
 
 KANDINSKY_22_SCHEDULERS = {
     "DDPM": {
-        "scheduler": DDPMScheduler,
+        "scheduler": "DDPMScheduler",
         "from_config": True,
     },
-    "DDIM": {"scheduler": DDIMScheduler},
-    "DPM++_2M": {"scheduler": DPMSolverMultistepScheduler},
+    "DDIM": {"scheduler": "DDIMScheduler"},
+    "DPM++_2M": {"scheduler": "DPMSolverMultistepScheduler"},
 }
 
 KANDINSKY_22_SCHEDULER_CHOICES = [*KANDINSKY_22_SCHEDULERS.keys()]
 KANDINSKY_22_SCHEDULER_DEFAULT = KANDINSKY_22_SCHEDULER_CHOICES[0]
+
+
+def get_scheduler_class(class_name: str) -> Any:
+    # diffusers only imports the module of the scheduler that is asked for
+    import diffusers
+
+    return getattr(diffusers, class_name)
+
+
+class SchedulerCache:
+    """Schedulers built once per pipeline and name, from the scheduler config the pipeline was loaded with.
+
+    Every job gets its own copy, so step state like timesteps and solver history never carries over.
+    """
+
+    def __init__(self, create: Callable[[str, Any], Any]):
+        self.create = create
+        self.lock = threading.Lock()
+        # Pipeline id -> scheduler config the pipeline was loaded with
+        self.base_configs: Dict[int, Any] = {}
+        # (pipeline id, scheduler name) -> scheduler that is only ever copied
+        self.templates: Dict[Tuple[int, str], Any] = {}
+
+    def get(self, name: str, pipeline: Any) -> Any:
+        key = id(pipeline)
+        with self.lock:
+            base_config = self.base_configs.setdefault(key, pipeline.scheduler.config)
+            template = self.templates.get((key, name))
+            if template is None:
+                template = self.create(name, base_config)
+                self.templates[(key, name)] = template
+        return copy.deepcopy(template)
+
+
+def create_kandinsky_22_scheduler(name: str, config: Any):
+    scheduler_class = get_scheduler_class(KANDINSKY_22_SCHEDULERS[name]["scheduler"])
+    if "from_config" in KANDINSKY_22_SCHEDULERS[name]:
+        return scheduler_class.from_config(config)
+    else:
+        return scheduler_class()
+
+
+SD_SCHEDULER_CACHE = SchedulerCache(
+    create=lambda name, config: get_scheduler_class(
+        SD_SCHEDULERS[name]["scheduler"]
+    ).from_config(config)
+)
+KANDINSKY_22_SCHEDULER_CACHE = SchedulerCache(create=create_kandinsky_22_scheduler)
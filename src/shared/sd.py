@@ -1,63 +1,71 @@
 import logging
 from PIL import Image
 import os
-from typing import Any, List, cast
+from typing import TYPE_CHECKING, Any, Dict, Hashable, Iterator, List, Tuple, cast
 import torch
 import time
-from diffusers import (
-    StableDiffusionPipeline,
-    StableDiffusionImg2ImgPipeline,
-    StableDiffusionInpaintPipeline,
-    StableDiffusionXLPipeline,
-    StableDiffusionXLImg2ImgPipeline,
-    StableDiffusion3Pipeline,
-    StableDiffusion3Img2ImgPipeline,
-)
 from src.shared.classes import (
     GenerateFunctionProps,
+    GenerateInput,
     GenerateOutput,
 )
-from src.shared.device import DEVICE_CUDA
+from src.shared.constants import REFINER_STREAM_FIRST_OUTPUT
 from src.shared.helpers import (
+    create_generators,
     download_and_fit_image,
+    get_batch_chunks,
     log_gpu_memory,
 )
 from src.shared.pipe_classes import StableDiffusionPipeObject
-from src.shared.schedulers import SD_SCHEDULERS
+from src.shared.prompt_cache import (
+    get_prompt_embeds_kwargs,
+    log_prompt_embeds_cache_stats,
+)
+from src.shared.schedulers import SD_SCHEDULER_CACHE
 
+if TYPE_CHECKING:
+    from diffusers import (
+        StableDiffusionPipeline,
+        StableDiffusionImg2ImgPipeline,
+        StableDiffusionInpaintPipeline,
+        StableDiffusionXLPipeline,
+        StableDiffusionXLImg2ImgPipeline,
+        StableDiffusion3Pipeline,
+        StableDiffusion3Img2ImgPipeline,
+    )
 
-def get_scheduler(name, config):
-    return SD_SCHEDULERS[name]["from_config"](config)
 
+def get_scheduler(name, pipeline):
+    return SD_SCHEDULER_CACHE.get(name, pipeline)
 
-def generate(
-    props: GenerateFunctionProps[StableDiffusionPipeObject],
-) -> List[GenerateOutput]:
-    # Props -----------------------------------------------------------------
-    input = props.input
-    pipe_object = props.pipe_object
-    model_name = props.model_name
-    default_prompt_prefix = props.default_prompt_prefix
-    default_negative_prompt_prefix = props.default_negative_prompt_prefix
-    dont_set_scheduler = props.dont_set_scheduler
-    # -----------------------------------------------------------------------
 
-    inference_start = time.time()
-    log_gpu_memory(message="Before inference")
+def get_refiner_batches(num_outputs: int, width: int, height: int) -> List[List[int]]:
+    if not REFINER_STREAM_FIRST_OUTPUT or num_outputs < 2:
+        return get_batch_chunks(num_outputs=num_outputs, width=width, height=height)
+    rest = get_batch_chunks(num_outputs=num_outputs - 1, width=width, height=height)
+    return [[0]] + [[i + 1 for i in indexes] for indexes in rest]
 
-    prompt = input.prompt
-    negative_prompt = input.negative_prompt
-    seed = input.seed
 
+def get_seed(input: GenerateInput) -> int:
+    seed = input.seed
     if seed is None:
         seed = int.from_bytes(os.urandom(3), "big")
         logging.info(f"Using seed: {seed}")
-    generator = torch.Generator(device=DEVICE_CUDA).manual_seed(seed)
+    return seed
+
+
+def get_prompts(
+    props: GenerateFunctionProps[StableDiffusionPipeObject],
+) -> Tuple[str, str | None]:
+    """Prompt and negative prompt of a job, with the prompt prefixes applied."""
+    input = props.input
+    prompt = input.prompt
+    negative_prompt = input.negative_prompt
 
     selected_prompt_prefix = (
         input.prompt_prefix
         if input.prompt_prefix is not None
-        else default_prompt_prefix
+        else props.default_prompt_prefix
     )
     if selected_prompt_prefix is not None:
         prompt = f"{selected_prompt_prefix} {prompt}"
@@ -65,7 +73,7 @@ def generate(
     selected_negative_prompt_prefix = (
         input.negative_prompt_prefix
         if input.negative_prompt_prefix is not None
-        else default_negative_prompt_prefix
+        else props.default_negative_prompt_prefix
     )
 
     if selected_negative_prompt_prefix is not None:
@@ -74,6 +82,75 @@ def generate(
         else:
             negative_prompt = f"{selected_negative_prompt_prefix} {negative_prompt}"
 
+    return prompt, negative_prompt
+
+
+def encode_prompts(
+    props: GenerateFunctionProps[StableDiffusionPipeObject],
+) -> Dict[str, Any]:
+    """Prompt embeds kwargs of a job, cached so a job can encode its prompts ahead of generate."""
+    prompt, negative_prompt = get_prompts(props)
+    # Every pipeline of the object shares the text encoders of text2img.
+    # The prompt prefix is never encoded on its own, only the negative prefix can be a whole text.
+    return get_prompt_embeds_kwargs(
+        pipe=props.pipe_object.text2img,
+        model=props.model_name,
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        pinned_texts=("", props.default_negative_prompt_prefix),
+    )
+
+
+def refine(
+    refiner: "StableDiffusionXLImg2ImgPipeline",
+    latents: List[Any],
+    seed: int,
+    prompt_embeds_kwargs: Dict[str, Any],
+    guidance_scale: float,
+    num_inference_steps: int,
+    width: int,
+    height: int,
+) -> Iterator[List[Image.Image]]:
+    """Refine base latents in batches, yielding the images of each batch as soon as it's done."""
+    for indexes in get_refiner_batches(
+        num_outputs=len(latents), width=width, height=height
+    ):
+        out = cast(
+            Any,
+            refiner(
+                **prompt_embeds_kwargs,
+                guidance_scale=guidance_scale,
+                num_inference_steps=num_inference_steps,
+                image=torch.stack([latents[i] for i in indexes]),
+                generator=create_generators(seed=seed, indexes=indexes),
+                num_images_per_prompt=len(indexes),
+            ),
+        ).images
+        yield list(out)
+
+
+def generate(
+    props: GenerateFunctionProps[StableDiffusionPipeObject],
+) -> Iterator[GenerateOutput]:
+    # Props -----------------------------------------------------------------
+    input = props.input
+    pipe_object = props.pipe_object
+    model_name = props.model_name
+    default_negative_prompt_prefix = props.default_negative_prompt_prefix
+    dont_set_scheduler = props.dont_set_scheduler
+    # -----------------------------------------------------------------------
+
+    inference_start = time.time()
+    log_gpu_memory(message="Before inference")
+
+    seed = get_seed(input)
+    prompt, negative_prompt = get_prompts(props)
+
+    # From the prompt cache when predict encoded them while the input images downloaded
+    prompt_embeds_kwargs = encode_prompts(props)
+    # The refiner pins the same texts for its own text encoder
+    pinned_texts = ("", default_negative_prompt_prefix)
+
     extra_kwargs = {}
     pipe_selected: (
         StableDiffusionPipeline
@@ -105,6 +182,8 @@ def generate(
             url=input.init_image_url,
             width=input.width,
             height=input.height,
+            prefetched=input.init_image,
+            cache_stats=input.image_cache_stats,
         )
         extra_kwargs["strength"] = input.prompt_strength
         end_i = time.time()
@@ -114,12 +193,14 @@ def generate(
 
         if input.mask_image_url is not None:
             # The process is: inpainting
-            pipe_selected = cast(StableDiffusionInpaintPipeline, pipe_object.inpaint)
+            pipe_selected = cast("StableDiffusionInpaintPipeline", pipe_object.inpaint)
             start_i = time.time()
             extra_kwargs["mask_image"] = download_and_fit_image(
                 url=input.mask_image_url,
                 width=input.width,
                 height=input.height,
+                prefetched=input.mask_image,
+                cache_stats=input.image_cache_stats,
             )
             extra_kwargs["strength"] = 0.99
             end_i = time.time()
@@ -139,64 +220,188 @@ def generate(
         raise ValueError("No pipeline selected")
 
     if dont_set_scheduler is False:
-        pipe_selected.scheduler = get_scheduler(
-            input.scheduler, pipe_selected.scheduler.config
-        )
+        pipe_selected.scheduler = get_scheduler(input.scheduler, pipe_selected)
 
+    # Base latents are kept for the refiner, otherwise images are yielded as soon as their batch is done
     output_images: List[Image.Image] = []
 
-    for i in range(input.num_outputs):
-        generator = torch.Generator(device=DEVICE_CUDA).manual_seed(seed + i)
+    batches = get_batch_chunks(
+        num_outputs=input.num_outputs, width=input.width, height=input.height
+    )
+    for indexes in batches:
+        generators = create_generators(seed=seed, indexes=indexes)
         out = cast(
             Any,
             pipe_selected(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
+                **prompt_embeds_kwargs,
                 guidance_scale=input.guidance_scale,
-                generator=generator,
-                num_images_per_prompt=1,
+                generator=generators,
+                num_images_per_prompt=len(indexes),
                 num_inference_steps=input.num_inference_steps,
                 **extra_kwargs,
             ),
-        ).images[0]
-        output_images.append(out)
+        ).images
+        if pipe_object.refiner is not None:
+            output_images.extend(out)
+        else:
+            for image in out:
+                yield GenerateOutput(image=image)
+
+    if len(batches) > 1:
+        logging.info(
+            f"-- Split {input.num_outputs} image(s) into {len(batches)} batch(es)"
+        )
 
     log_gpu_memory(message="After inference")
 
     if pipe_object.refiner is not None:
-        args = {
-            "prompt": prompt,
-            "negative_prompt": negative_prompt,
-            "guidance_scale": input.guidance_scale,
-            "num_inference_steps": input.num_inference_steps,
-        }
-
         s = time.time()
-        for i in range(len(output_images)):
-            generator = torch.Generator(device=DEVICE_CUDA).manual_seed(seed + i)
-            image = output_images[i]
-            out_image = cast(
-                Any,
-                pipe_object.refiner(
-                    **args,
-                    image=image,
-                    generator=generator,
-                    num_images_per_prompt=1,
-                ),
-            ).images[0]
-            output_images[i] = out_image
+        for refined in refine(
+            refiner=pipe_object.refiner,
+            latents=output_images,
+            seed=seed,
+            # The refiner has its own text encoder
+            prompt_embeds_kwargs=get_prompt_embeds_kwargs(
+                pipe=pipe_object.refiner,
+                model=f"{model_name}/refiner",
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                pinned_texts=pinned_texts,
+            ),
+            guidance_scale=input.guidance_scale,
+            num_inference_steps=input.num_inference_steps,
+            width=input.width,
+            height=input.height,
+        ):
+            for image in refined:
+                yield GenerateOutput(image=image)
         e = time.time()
         logging.info(
             f"🖌️ Refined {len(output_images)} image(s) in: {round((e - s) * 1000)}ms"
         )
 
-    outputs: List[GenerateOutput] = []
-    for image in output_images:
-        outputs.append(GenerateOutput(image=image))
+    log_prompt_embeds_cache_stats()
 
     inference_end = time.time()
     logging.info(
         f"🔮 🟢 Inference | {model_name} | {input.num_outputs} image(s) | {round((inference_end - inference_start) * 1000)}ms"
     )
 
-    return outputs
+
+def get_batch_key(
+    props: GenerateFunctionProps[StableDiffusionPipeObject],
+) -> Hashable | None:
+    """Text2img jobs with the same shape, steps, scheduler and guidance can share pipeline calls."""
+    input = props.input
+    if input.init_image_url is not None:
+        return None
+    return (
+        input.width,
+        input.height,
+        input.num_inference_steps,
+        input.scheduler,
+        input.guidance_scale,
+    )
+
+
+def generate_batch(
+    props_list: List[GenerateFunctionProps[StableDiffusionPipeObject]],
+) -> Iterator[Tuple[int, GenerateOutput]]:
+    """Generate the outputs of jobs with the same batch key together, yielding (job index, output).
+
+    Every row has the prompt embeds and seed of its own job, so a job gets the same outputs as on its own.
+    """
+    first = props_list[0]
+    input = first.input
+    pipe_object = first.pipe_object
+    model_name = first.model_name
+
+    inference_start = time.time()
+    log_gpu_memory(message="Before inference")
+
+    pinned_texts = ("", first.default_negative_prompt_prefix)
+    prompts = [get_prompts(props) for props in props_list]
+    seeds = [get_seed(props.input) for props in props_list]
+    prompt_embeds_kwargs = [encode_prompts(props) for props in props_list]
+
+    pipe_selected = pipe_object.text2img
+    if first.dont_set_scheduler is False:
+        pipe_selected.scheduler = get_scheduler(input.scheduler, pipe_selected)
+
+    extra_kwargs = {}
+    if pipe_object.refiner is not None:
+        extra_kwargs["output_type"] = "latent"
+
+    # (job index, output index) of every row
+    rows = [
+        (j, i)
+        for j, props in enumerate(props_list)
+        for i in range(props.input.num_outputs)
+    ]
+    latents: List[List[Any]] = [[] for _ in props_list]
+
+    batches = get_batch_chunks(
+        num_outputs=len(rows), width=input.width, height=input.height
+    )
+    for indexes in batches:
+        batch_rows = [rows[k] for k in indexes]
+        out = cast(
+            Any,
+            pipe_selected(
+                **{
+                    key: torch.cat(
+                        [prompt_embeds_kwargs[j][key] for j, _ in batch_rows]
+                    )
+                    for key in prompt_embeds_kwargs[0]
+                },
+                guidance_scale=input.guidance_scale,
+                generator=[
+                    generator
+                    for j, i in batch_rows
+                    for generator in create_generators(seed=seeds[j], indexes=[i])
+                ],
+                num_images_per_prompt=1,
+                num_inference_steps=input.num_inference_steps,
+                width=input.width,
+                height=input.height,
+                **extra_kwargs,
+            ),
+        ).images
+        for (j, _), image in zip(batch_rows, out):
+            if pipe_object.refiner is not None:
+                latents[j].append(image)
+            else:
+                yield j, GenerateOutput(image=image)
+
+    log_gpu_memory(message="After inference")
+
+    if pipe_object.refiner is not None:
+        s = time.time()
+        for j, (prompt, negative_prompt) in enumerate(prompts):
+            for refined in refine(
+                refiner=pipe_object.refiner,
+                latents=latents[j],
+                seed=seeds[j],
+                prompt_embeds_kwargs=get_prompt_embeds_kwargs(
+                    pipe=pipe_object.refiner,
+                    model=f"{model_name}/refiner",
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    pinned_texts=pinned_texts,
+                ),
+                guidance_scale=input.guidance_scale,
+                num_inference_steps=input.num_inference_steps,
+                width=input.width,
+                height=input.height,
+            ):
+                for image in refined:
+                    yield j, GenerateOutput(image=image)
+        e = time.time()
+        logging.info(f"🖌️ Refined {len(rows)} image(s) in: {round((e - s) * 1000)}ms")
+
+    log_prompt_embeds_cache_stats()
+
+    inference_end = time.time()
+    logging.info(
+        f"🔮 🟢 Inference | {model_name} | {len(props_list)} job(s) | {len(rows)} image(s) | {round((inference_end - inference_start) * 1000)}ms"
+    )
@@ -1,21 +1,86 @@
-from io import BytesIO
 import logging
 import time
-from typing import List
+import threading
+from typing import IO, Callable, Dict, Iterable, List, TypeVar
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 import requests
 from urllib.parse import urlparse
 from concurrent.futures import Future, ThreadPoolExecutor
 from .classes import UploadObject
+from .constants import (
+    UPLOAD_ENCODE_WORKERS,
+    UPLOAD_POOL_MAXSIZE,
+    UPLOAD_SPOOL_MIN_PIXELS,
+)
+from .encode import encode_image, encode_image_to_file
 from .helpers import parse_content_type, time_log
 
+T = TypeVar("T")
+
 
 class UploadedImageResult:
     def __init__(self, image_url: str):
         self.image_url = image_url
 
 
+class UploadClient:
+    """Process-wide HTTP session, keeps connections to S3 alive across images and jobs."""
+
+    def __init__(self, pool_maxsize: int):
+        # Define the retry strategy
+        retry_strategy = Retry(
+            total=3,  # Total number of retries
+            status_forcelist=[429, 500, 502, 503, 504]
+            + list(range(400, 429))
+            + list(range(431, 500))
+            + list(range(501, 600)),  # List of status codes to retry on
+            allowed_methods=["PUT"],  # HTTP methods to retry
+            backoff_factor=1,  # A backoff factor to apply between attempts
+        )
+
+        # Create an HTTPAdapter with the retry strategy and a keep-alive pool per host
+        self.adapter = HTTPAdapter(
+            max_retries=retry_strategy,
+            pool_connections=pool_maxsize,
+            pool_maxsize=pool_maxsize,
+        )
+
+        # Create a session and mount the adapter
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def get_pool_stats(self) -> Dict[str, Dict[str, int]]:
+        """Connections opened, requests sent and idle connections for each host."""
+        stats: Dict[str, Dict[str, int]] = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                # The pool queue is pre-filled with None placeholders, only count real connections
+                "idle": (
+                    sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                    if pool.pool is not None
+                    else 0
+                ),
+            }
+        return stats
+
+    def log_pool_stats(self):
+        for host, stats in self.get_pool_stats().items():
+            logging.info(
+                f"^^ Upload pool | {host} | Connections: {stats['connections']} | Requests: {stats['requests']} | Idle: {stats['idle']}"
+            )
+
+
+UPLOAD_CLIENT = UploadClient(pool_maxsize=UPLOAD_POOL_MAXSIZE)
+
+
 def extract_s3_url_from_signed_url(signed_url: str) -> str:
     """Helper function to extract the key from the signed URL."""
     parsed_url = urlparse(signed_url)
@@ -23,58 +88,58 @@ def extract_s3_url_from_signed_url(signed_url: str) -> str:
     return f"s3://{path}"
 
 
-def convert_and_upload_image_to_signed_url(upload_object: UploadObject) -> str:
-    """Convert an individual image to a target format and upload to the provided signed URL."""
+def convert_image(upload_object: UploadObject) -> memoryview | IO[bytes]:
+    """Convert an individual image to the target format.
 
-    with time_log(
-        f"📨 Converted image to {upload_object.target_extension}",
-        ms=True,
-        start_log=False,
-        prefix=False,
-    ):
-        _pil_image = upload_object.pil_image
-        if upload_object.target_extension == "jpeg":
-            _pil_image = _pil_image.convert("RGB")
-        img_format = upload_object.target_extension.upper()
-        img_bytes = BytesIO()
-        _pil_image.save(
-            img_bytes, format=img_format, quality=upload_object.target_quality
-        )
-        file_bytes = img_bytes.getvalue()
-
-    # Define the retry strategy
-    retry_strategy = Retry(
-        total=3,  # Total number of retries
-        status_forcelist=[429, 500, 502, 503, 504]
-        + list(range(400, 429))
-        + list(range(431, 500))
-        + list(range(501, 600)),  # List of status codes to retry on
-        allowed_methods=["PUT"],  # HTTP methods to retry
-        backoff_factor=1,  # A backoff factor to apply between attempts
-    )
-
-    # Create an HTTPAdapter with the retry strategy
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-
-    # Create a session and mount the adapter
-    session = requests.Session()
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
+    Large images are encoded into a temporary file that is streamed as the request body,
+    smaller ones are kept in memory."""
+
+    width, height = upload_object.pil_image.size
+    spool = width * height >= UPLOAD_SPOOL_MIN_PIXELS
 
     with time_log(
-        f"📨 Uploaded image to S3",
+        f"📨 Converted image to {upload_object.target_extension}{' (spooled to disk)' if spool else ''}",
         ms=True,
         start_log=False,
         prefix=False,
     ):
-        response = session.put(
-            upload_object.signed_url,
-            data=file_bytes,
-            headers={
-                "Content-Type": parse_content_type(upload_object.target_extension)
-            },
+        if spool:
+            return encode_image_to_file(
+                upload_object.pil_image,
+                upload_object.target_extension,
+                upload_object.target_quality,
+            )
+        return encode_image(
+            upload_object.pil_image,
+            upload_object.target_extension,
+            upload_object.target_quality,
         )
 
+
+def upload_image_to_signed_url(
+    upload_object: UploadObject, body: memoryview | IO[bytes]
+) -> str:
+    """Upload an already converted image to the provided signed URL."""
+
+    # File bodies are streamed, requests sets the Content-Length from the file size
+    try:
+        with time_log(
+            f"📨 Uploaded image to S3",
+            ms=True,
+            start_log=False,
+            prefix=False,
+        ):
+            response = UPLOAD_CLIENT.session.put(
+                upload_object.signed_url,
+                data=body,
+                headers={
+                    "Content-Type": parse_content_type(upload_object.target_extension)
+                },
+            )
+    finally:
+        if not isinstance(body, memoryview):
+            body.close()
+
     if response.status_code != 200:
         # throw an exception if the upload fails
         logging.info(f"^^ Failed to upload image. Status code: {response.status_code}")
@@ -84,43 +149,159 @@ def convert_and_upload_image_to_signed_url(upload_object: UploadObject) -> str:
     return s3_url
 
 
-def upload_images(
-    upload_objects: List[UploadObject],
-) -> List[UploadedImageResult]:
-    """Upload all images to S3 in parallel and return the S3 URLs"""
-    logging.info(
-        f"^^ 📤 🟡 Started - Convert and upload {len(upload_objects)} image(s) to S3 in parallel"
-    )
-    start = time.time()
-
-    logging.info(
-        f"^^ Target extension: {upload_objects[0].target_extension} - Target quality: {upload_objects[0].target_quality}"
-    )
-
-    # Run all uploads at same time in threadpool
-    tasks: List[Future] = []
-    with ThreadPoolExecutor(max_workers=len(upload_objects)) as executor:
-        logging.info(f"^^ Submitting to thread")
-        for i, upload_object in enumerate(upload_objects):
-            tasks.append(
-                executor.submit(
-                    convert_and_upload_image_to_signed_url,
-                    upload_object,
-                )
+def convert_and_upload_image_to_signed_url(upload_object: UploadObject) -> str:
+    """Convert an individual image to a target format and upload to the provided signed URL."""
+    return upload_image_to_signed_url(upload_object, convert_image(upload_object))
+
+
+class UploadStageStats:
+    """Per job timings of the encode and upload stages."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_ms: Dict[str, List[float]] = {"encode": [], "upload": []}
+        self.max_queue_depth: Dict[str, int] = {"encode": 0, "upload": 0}
+
+    def add_time(self, stage: str, ms: float):
+        with self.lock:
+            self.stage_ms[stage].append(ms)
+
+    def add_queue_depth(self, stage: str, depth: int):
+        with self.lock:
+            self.max_queue_depth[stage] = max(self.max_queue_depth[stage], depth)
+
+    def log(self):
+        for stage, times in self.stage_ms.items():
+            if len(times) == 0:
+                continue
+            logging.info(
+                f"^^ Upload stage | {stage} | Total: {round(sum(times))}ms | Max: {round(max(times))}ms | Max queue depth: {self.max_queue_depth[stage]}"
             )
 
-    # Get results
-    results: List[UploadedImageResult] = []
-    for i, task in enumerate(tasks):
-        results.append(
-            UploadedImageResult(
-                image_url=task.result(),
+
+class UploadPipeline:
+    """Long-lived encode and upload thread pools, shared by every job of the worker.
+
+    Images are encoded on one pool and handed to the other for the PUT, so encoding
+    of the next image runs while the previous one is still being uploaded."""
+
+    def __init__(self, encode_workers: int, upload_workers: int):
+        self.encode_executor = ThreadPoolExecutor(
+            max_workers=encode_workers, thread_name_prefix="encode"
+        )
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=upload_workers, thread_name_prefix="upload"
+        )
+        self.lock = threading.Lock()
+        self.queue_depth: Dict[str, int] = {"encode": 0, "upload": 0}
+
+    def _enter(self, stage: str, stats: UploadStageStats):
+        with self.lock:
+            self.queue_depth[stage] += 1
+            depth = self.queue_depth[stage]
+        stats.add_queue_depth(stage, depth)
+
+    def _leave(self, stage: str):
+        with self.lock:
+            self.queue_depth[stage] -= 1
+
+    def _run_stage(
+        self, stage: str, stats: UploadStageStats, fn: Callable[..., T], *args
+    ) -> T:
+        start = time.time()
+        try:
+            return fn(*args)
+        finally:
+            self._leave(stage)
+            stats.add_time(stage, (time.time() - start) * 1000)
+
+    def submit(
+        self, upload_object: UploadObject, stats: UploadStageStats
+    ) -> "Future[str]":
+        result: "Future[str]" = Future()
+
+        def on_uploaded(upload_future: "Future[str]"):
+            exception = upload_future.exception()
+            if exception is not None:
+                result.set_exception(exception)
+            else:
+                result.set_result(upload_future.result())
+
+        def on_encoded(encode_future: "Future[memoryview | IO[bytes]]"):
+            exception = encode_future.exception()
+            if exception is not None:
+                result.set_exception(exception)
+                return
+            self._enter("upload", stats)
+            upload_future = self.upload_executor.submit(
+                self._run_stage,
+                "upload",
+                stats,
+                upload_image_to_signed_url,
+                upload_object,
+                encode_future.result(),
             )
+            upload_future.add_done_callback(on_uploaded)
+
+        self._enter("encode", stats)
+        encode_future = self.encode_executor.submit(
+            self._run_stage, "encode", stats, convert_image, upload_object
+        )
+        encode_future.add_done_callback(on_encoded)
+        return result
+
+
+UPLOAD_PIPELINE = UploadPipeline(
+    encode_workers=UPLOAD_ENCODE_WORKERS,
+    upload_workers=UPLOAD_POOL_MAXSIZE,
+)
+
+
+class UploadJob:
+    """Uploads of a single job, submitted to the upload pipeline as its images come in."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.stats = UploadStageStats()
+        self.tasks: "List[Future[str]]" = []
+        logging.info(
+            f"^^ 📤 🟡 Started - Convert and upload image(s) to S3 in parallel as they are produced"
         )
 
-    end = time.time()
-    logging.info(
-        f"^^ 📤 🟢 {len(upload_objects)} image(s) converted and uploaded to S3 in: {round((end - start) *1000)}ms"
-    )
+    def submit(self, upload_object: UploadObject):
+        if len(self.tasks) == 0:
+            logging.info(
+                f"^^ Target extension: {upload_object.target_extension} - Target quality: {upload_object.target_quality}"
+            )
+        logging.info(f"^^ Submitting image {len(self.tasks) + 1} to upload pipeline")
+        self.tasks.append(UPLOAD_PIPELINE.submit(upload_object, self.stats))
+
+    def results(self) -> List[UploadedImageResult]:
+        """Wait for every upload and return the S3 URLs"""
+        results: List[UploadedImageResult] = []
+        for task in self.tasks:
+            results.append(
+                UploadedImageResult(
+                    image_url=task.result(),
+                )
+            )
+
+        end = time.time()
+        logging.info(
+            f"^^ 📤 🟢 {len(self.tasks)} image(s) converted and uploaded to S3 in: {round((end - self.start) *1000)}ms"
+        )
+        self.stats.log()
+        UPLOAD_CLIENT.log_pool_stats()
+
+        return results
+
 
-    return results
+def submit_uploads(
+    upload_objects: Iterable[UploadObject],
+) -> UploadJob:
+    """Submit images to the upload pipeline as they come in, without waiting for the uploads"""
+    # Each upload is submitted as soon as the image is available, so uploads overlap with inference
+    upload_job = UploadJob()
+    for upload_object in upload_objects:
+        upload_job.submit(upload_object)
+    return upload_job
@@ -0,0 +1,177 @@
+"""Time and peak device memory of AuraSR tiling, merging and upscaling, on synthetic images.
+
+Runs a randomly initialized upsampler unless --model is given, so it works offline. Peak memory is
+only reported on CUDA, tensor memory on the CPU isn't tracked.
+
+Usage: python -m src.tools.aura_sr_benchmark [--device DEVICE] [--width PX] [--height PX] [--model ID]
+"""
+
+import argparse
+import time
+from typing import Callable, List
+import numpy as np
+import torch
+from PIL import Image
+from tabulate import tabulate
+from src.shared.aura_sr import AuraSR, merge_tiles, tile_image
+
+# Small enough to run on the CPU, with the tile size of the released models
+TINY_CONFIG = {
+    "dim": 8,
+    "image_size": 256,
+    "input_image_size": 64,
+    "style_network": {"dim_in": 128, "dim_out": 8, "depth": 1},
+    "unconditional": True,
+    "num_conv_kernels": 2,
+}
+
+
+def tile_image_loop(image, chunk_size=64):
+    """tile_image before it was vectorized, a list of (c, chunk_size, chunk_size) slices."""
+    c, h, w = image.shape
+    h_chunks = int(np.ceil(h / chunk_size))
+    w_chunks = int(np.ceil(w / chunk_size))
+    tiles = []
+    for i in range(h_chunks):
+        for j in range(w_chunks):
+            tile = image[
+                :,
+                i * chunk_size : (i + 1) * chunk_size,
+                j * chunk_size : (j + 1) * chunk_size,
+            ]
+            tiles.append(tile)
+    return tiles, h_chunks, w_chunks
+
+
+def merge_tiles_loop(tiles, h_chunks, w_chunks, chunk_size=64):
+    """merge_tiles before it was vectorized, one slice assignment per tile."""
+    c = tiles[0].shape[0]
+    merged = torch.zeros(
+        (c, h_chunks * chunk_size, w_chunks * chunk_size), dtype=tiles[0].dtype
+    )
+    for idx, tile in enumerate(tiles):
+        i = idx // w_chunks
+        j = idx % w_chunks
+        tile_h, tile_w = tile.shape[1:]
+        merged[
+            :,
+            i * chunk_size : i * chunk_size + tile_h,
+            j * chunk_size : j * chunk_size + tile_w,
+        ] = tile
+    return merged
+
+
+def create_aura_sr(
+    device: str,
+    precision: str = "fp32",
+    channels_last: bool = False,
+    model_id: str | None = None,
+    seed: int = 0,
+) -> AuraSR:
+    """Pretrained model_id, or a random upsampler with the same weights for every precision of a seed."""
+    if model_id is not None:
+        return AuraSR.from_pretrained(
+            model_id, device=device, precision=precision, channels_last=channels_last
+        )
+    torch.manual_seed(seed)
+    return AuraSR(
+        TINY_CONFIG, device=device, precision=precision, channels_last=channels_last
+    )
+
+
+def create_test_image(width: int, height: int, seed: int = 0) -> Image.Image:
+    """Smooth gradients, where seams and precision loss show, with some fine noise on top."""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width)[None, :]
+    y = np.linspace(0, 255, height)[:, None]
+    base = np.stack(
+        [x + 0 * y, y + 0 * x, np.full((height, width), 128.0) + (x - y) / 4], -1
+    )
+    noise = rng.normal(0, 8, (height, width, 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), "RGB")
+
+
+def measure(fn: Callable[[], object], device: str, repeat: int) -> tuple[float, str]:
+    """Median ms of fn and its peak allocated device memory."""
+    is_cuda = torch.device(device).type == "cuda"
+    times: List[float] = []
+    peak = 0
+    for _ in range(repeat):
+        if is_cuda:
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            start_allocated = torch.cuda.memory_allocated()
+        start = time.perf_counter()
+        fn()
+        if is_cuda:
+            torch.cuda.synchronize()
+            peak = max(peak, torch.cuda.max_memory_allocated() - start_allocated)
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times)), f"{peak / (1024**2):.0f}" if is_cuda else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--width", type=int, default=256)
+    parser.add_argument("--height", type=int, default=192)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--max-batch-size", type=int, default=None)
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument(
+        "--model", default=None, help="Pretrained model, like fal/AuraSR-v2"
+    )
+    parser.add_argument(
+        "--tiling-only", action="store_true", help="Skip the upsampler, for large sizes"
+    )
+    args = parser.parse_args()
+
+    # Tiling of the input and merging of the upscaled tiles, without the upsampler in between
+    tile_size = TINY_CONFIG["input_image_size"]
+    input_tensor = torch.rand(
+        3, args.height // tile_size * tile_size, args.width // tile_size * tile_size
+    )
+    tiles, h_chunks, w_chunks = tile_image(input_tensor, tile_size)
+    upscaled_tiles = torch.rand(tiles.shape[0], 3, tile_size * 4, tile_size * 4)
+    rows = []
+    for name, tile, merge, merge_input in (
+        ("Loop", tile_image_loop, merge_tiles_loop, list(upscaled_tiles)),
+        ("Vectorized", tile_image, merge_tiles, upscaled_tiles),
+    ):
+        ms, _ = measure(
+            lambda: (
+                tile(input_tensor, tile_size),
+                merge(merge_input, h_chunks, w_chunks, tile_size * 4),
+            ),
+            "cpu",
+            args.repeat,
+        )
+        rows.append([f"Tile + merge ({name})", f"{ms:.1f}", "-"])
+    if args.tiling_only:
+        print(
+            tabulate(rows, headers=["Step", "ms", "Peak device MB"], tablefmt="simple")
+        )
+        return
+
+    aura_sr = create_aura_sr(args.device, args.precision, model_id=args.model)
+    image = create_test_image(args.width, args.height)
+    for name, upscale in (
+        ("upscale_4x", lambda: aura_sr.upscale_4x(image, args.max_batch_size)),
+        (
+            "upscale_4x_overlapped",
+            lambda: aura_sr.upscale_4x_overlapped(image, args.max_batch_size),
+        ),
+    ):
+        ms, peak = measure(upscale, args.device, args.repeat)
+        rows.append([name, f"{ms:.1f}", peak])
+
+    print(tabulate(rows, headers=["Step", "ms", "Peak device MB"], tablefmt="simple"))
+    print(
+        f"🔍 {args.width}x{args.height} | Device: {args.device} | Tile batch size: {aura_sr.get_tile_batch_size(args.max_batch_size)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
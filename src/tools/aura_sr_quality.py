@@ -0,0 +1,102 @@
+"""PSNR of the AuraSR precision and memory format modes against fp32, on fixed seeds and synthetic images.
+
+Every mode gets the same weights and the same noise, so the difference is only the numerics. Runs a
+randomly initialized upsampler unless --model is given.
+
+Usage: python -m src.tools.aura_sr_quality [--device DEVICE] [--size PX] [--seeds N ...] [--model ID]
+"""
+
+import argparse
+from typing import List
+import numpy as np
+import torch
+from PIL import Image
+from tabulate import tabulate
+from src.tools.aura_sr_benchmark import create_aura_sr, create_test_image
+
+# (precision, channels_last), compared against fp32 without channels_last
+MODES = [
+    ("fp32", True),
+    ("fp16", False),
+    ("fp16", True),
+    ("bf16", False),
+    ("bf16", True),
+]
+
+
+def psnr(reference: Image.Image, image: Image.Image) -> float:
+    reference_array = np.asarray(reference, dtype=np.float64)
+    mse = ((reference_array - np.asarray(image, dtype=np.float64)) ** 2).mean()
+    return float("inf") if mse == 0 else float(10 * np.log10(255**2 / mse))
+
+
+def create_test_images(size: int) -> List[Image.Image]:
+    """A smooth gradient and pure noise, the two ends of what precision loss shows on."""
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    return [create_test_image(size, size), Image.fromarray(noise, "RGB")]
+
+
+def upscale(aura_sr, image: Image.Image, seed: int) -> Image.Image:
+    torch.manual_seed(seed)
+    return aura_sr.upscale_4x_overlapped(image)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--size", type=int, default=128)
+    parser.add_argument("--seeds", type=int, nargs="*", default=[0, 1])
+    parser.add_argument(
+        "--model", default=None, help="Pretrained model, like fal/AuraSR-v2"
+    )
+    args = parser.parse_args()
+
+    images = create_test_images(args.size)
+    reference_model = create_aura_sr(args.device, model_id=args.model)
+    references = {
+        (i, seed): upscale(reference_model, image, seed)
+        for i, image in enumerate(images)
+        for seed in args.seeds
+    }
+    del reference_model
+
+    rows = []
+    for precision, channels_last in MODES:
+        aura_sr = create_aura_sr(
+            args.device, precision, channels_last=channels_last, model_id=args.model
+        )
+        for i, image in enumerate(images):
+            scores = [
+                psnr(references[(i, seed)], upscale(aura_sr, image, seed))
+                for seed in args.seeds
+            ]
+            rows.append(
+                [
+                    precision,
+                    channels_last,
+                    ["gradient", "noise"][i],
+                    f"{min(scores):.1f}",
+                    f"{np.mean(scores):.1f}",
+                ]
+            )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Precision",
+                "channels_last",
+                "Image",
+                "Min PSNR dB",
+                "Mean PSNR dB",
+            ],
+            tablefmt="simple",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
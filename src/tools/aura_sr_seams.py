@@ -0,0 +1,126 @@
+"""Time, tile count and seam visibility of the AuraSR tile modes, on a synthetic gradient.
+
+The seam score is the mean pixel jump across a mode's own tile edges divided by the mean jump
+everywhere else, so 1.0 means the edges can't be told apart from the rest of the image. Runs a
+randomly initialized upsampler unless --model is given.
+
+Usage: python -m src.tools.aura_sr_seams [--device DEVICE] [--size PX] [--overlaps N ...] [--model ID]
+"""
+
+import argparse
+import time
+from typing import Callable, List
+import numpy as np
+import torch
+from PIL import Image
+from tabulate import tabulate
+from src.shared.aura_sr import AuraSR
+from src.tools.aura_sr_benchmark import create_aura_sr
+
+
+def seam_score(image: Image.Image, edges: List[int]) -> float:
+    """Mean jump across the given output pixel edges over the mean jump elsewhere, averaged over both axes."""
+    array = np.asarray(image, dtype=np.float64)
+    scores = []
+    for axis in (0, 1):
+        jumps = np.abs(np.diff(array, axis=axis)).mean(
+            axis=tuple(a for a in (0, 1, 2) if a != axis)
+        )
+        # Jump i is between pixel i and i + 1, so an edge at pixel e is jump e - 1
+        at_edges = sorted({e - 1 for e in edges if 0 < e < len(jumps) + 1})
+        scores.append(jumps[at_edges].mean() / np.delete(jumps, at_edges).mean())
+    return float(np.mean(scores))
+
+
+def get_grid_edges(tile_size: int, size: int, start: int = 0) -> List[int]:
+    return list(range(start, size, tile_size))
+
+
+def get_feathered_edges(tile_size: int, overlap: int, size: int) -> List[int]:
+    # Both ends of every tile, which are the ends of the blended overlaps
+    stride = tile_size - overlap
+    return sorted(
+        {e for start in range(0, size, stride) for e in (start, start + tile_size)}
+    )
+
+
+def create_gradient(size: int) -> Image.Image:
+    # No noise, so any seam stands out against the smooth ramp
+    x = np.linspace(0, 255, size)
+    gradient = np.stack([*np.meshgrid(x, x), np.full((size, size), 128.0)], -1)
+    return Image.fromarray(gradient.astype(np.uint8), "RGB")
+
+
+def run(
+    name: str,
+    upscale: Callable[[], Image.Image],
+    tiles: int,
+    edges: List[int],
+) -> List:
+    torch.manual_seed(0)
+    start = time.time()
+    image = upscale()
+    elapsed = time.time() - start
+    return [name, tiles, f"{elapsed:.2f}", f"{seam_score(image, edges):.2f}"]
+
+
+def compare_modes(aura_sr: AuraSR, image: Image.Image, overlaps: List[int]) -> List:
+    tile_size = aura_sr.input_image_size * 4
+    width, height = image.size
+    output_size = max(width, height) * 4
+    grid = get_grid_edges(tile_size, output_size)
+    rows = [
+        run(
+            "plain",
+            lambda: aura_sr.upscale_4x(image),
+            aura_sr.get_feathered_tile_count(width, height, 0),
+            grid,
+        ),
+        run(
+            "two-pass",
+            lambda: aura_sr.upscale_4x_overlapped(image),
+            aura_sr.get_overlapped_tile_count(width, height),
+            grid + get_grid_edges(tile_size, output_size, tile_size // 2),
+        ),
+    ]
+    for overlap in overlaps:
+        rows.append(
+            run(
+                f"feathered {overlap}",
+                lambda: aura_sr.upscale_4x_feathered_many([image], overlap)[0],
+                aura_sr.get_feathered_tile_count(width, height, overlap),
+                get_feathered_edges(tile_size, overlap * 4, output_size),
+            )
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument("--size", type=int, default=192)
+    parser.add_argument(
+        "--overlaps",
+        type=int,
+        nargs="*",
+        default=[8, 16, 32],
+        help="Feathered tile overlaps in input pixels",
+    )
+    parser.add_argument(
+        "--model", default=None, help="Pretrained model, like fal/AuraSR-v2"
+    )
+    args = parser.parse_args()
+
+    aura_sr = create_aura_sr(args.device, model_id=args.model)
+    rows = compare_modes(aura_sr, create_gradient(args.size), args.overlaps)
+    print(
+        tabulate(
+            rows, headers=["Mode", "Tiles", "Seconds", "Seam score"], tablefmt="simple"
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
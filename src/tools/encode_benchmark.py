@@ -0,0 +1,81 @@
+"""Encode time and size of the image encoder backends, on synthetic images.
+
+Usage: python -m src.tools.encode_benchmark [--size PX] [--repeat N] [--qualities Q ...]
+"""
+
+import argparse
+import time
+from typing import List
+import numpy as np
+from PIL import Image
+from tabulate import tabulate
+from src.shared import encode
+from src.shared.encode import IMAGE_ENCODERS
+from src.tools.upload_benchmark import create_images
+
+
+def time_encode(
+    encoder_name: str,
+    images: List[Image.Image],
+    extension: str,
+    quality: int,
+    repeat: int,
+) -> tuple[float, int]:
+    """Median ms per image and mean encoded bytes."""
+    encoder = IMAGE_ENCODERS[encoder_name]
+    times: List[float] = []
+    sizes: List[int] = []
+    for _ in range(repeat):
+        for image in images:
+            start = time.perf_counter()
+            encoded = encoder(image, extension, quality)
+            times.append((time.perf_counter() - start) * 1000)
+            sizes.append(encoded.nbytes)
+    return float(np.median(times)), round(float(np.mean(sizes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--images", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--qualities",
+        type=int,
+        nargs="*",
+        default=[50, 85, 100],
+        help="Output qualities, the API accepts 1-100",
+    )
+    parser.add_argument(
+        "--webp-methods", type=int, nargs="*", default=[0, 4, 6], help="WebP effort"
+    )
+    args = parser.parse_args()
+
+    images = create_images(args.images, args.size)
+    rows = []
+    for quality in args.qualities:
+        for encoder_name in IMAGE_ENCODERS:
+            if encoder_name == "simplejpeg" and encode.simplejpeg is None:
+                continue
+            ms, size = time_encode(encoder_name, images, "jpeg", quality, args.repeat)
+            rows.append(["jpeg", encoder_name, quality, f"{ms:.1f}", size])
+        # PNG ignores the quality
+        if quality == args.qualities[0]:
+            ms, size = time_encode("pil", images, "png", quality, args.repeat)
+            rows.append(["png", "pil", "-", f"{ms:.1f}", size])
+        for method in args.webp_methods:
+            encode.WEBP_METHOD = method
+            ms, size = time_encode("pil", images, "webp", quality, args.repeat)
+            rows.append([f"webp m{method}", "pil", quality, f"{ms:.1f}", size])
+
+    print(
+        tabulate(
+            rows,
+            headers=["Format", "Encoder", "Quality", "ms/image", "Bytes"],
+            tablefmt="simple",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
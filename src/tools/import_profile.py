@@ -0,0 +1,126 @@
+"""Import time profile of the endpoint handlers, from `python -X importtime`.
+
+The imports of each handler are collected from its source and run in a fresh interpreter,
+so the handler itself doesn't run and no model is loaded.
+
+Usage: python -m src.tools.import_profile [endpoint ...] [--top N] [--why package ...]
+"""
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ENDPOINTS_DIR = os.path.join(os.path.dirname(__file__), "..", "endpoints")
+
+
+def get_endpoints() -> List[str]:
+    return sorted(
+        name
+        for name in os.listdir(ENDPOINTS_DIR)
+        if os.path.isfile(os.path.join(ENDPOINTS_DIR, name, "handler.py"))
+    )
+
+
+def get_handler_imports(endpoint: str) -> List[str]:
+    """Modules imported at the top level of the handler, relative imports resolved."""
+    package = f"src.endpoints.{endpoint}"
+    with open(os.path.join(ENDPOINTS_DIR, endpoint, "handler.py")) as f:
+        tree = ast.parse(f.read())
+    modules: List[str] = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level > 0:
+                parts = package.split(".")
+                module = ".".join(parts[: len(parts) - node.level + 1])
+                modules.append(f"{module}.{node.module}" if node.module else module)
+            elif node.module is not None:
+                modules.append(node.module)
+    return modules
+
+
+def profile_imports(modules: List[str]) -> Tuple[int, List[Tuple[str, int, int, int]]]:
+    """Total ms and (module, depth, self us, cumulative us) of every module imported.
+
+    Modules loaded lazily, like most of diffusers, show up at depth 0 instead of under their importer.
+    """
+    # Endpoint folders like "22h" aren't valid identifiers, so no import statements
+    code = "\n".join(
+        ["import importlib, time", "start = time.perf_counter()"]
+        + [f"importlib.import_module({module!r})" for module in modules]
+        + ["print(round((time.perf_counter() - start) * 1000))"]
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows: List[Tuple[str, int, int, int]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        # Nested imports are indented by 2 more spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return int(result.stdout.strip().splitlines()[-1]), rows
+
+
+def get_import_chain(rows: List[Tuple[str, int, int, int]], package: str) -> List[str]:
+    """Chain of imports, from the handler down, that first pulled in the package."""
+    for i, (name, depth, _, _) in enumerate(rows):
+        if name.split(".")[0] != package:
+            continue
+        # importtime lists a module before the module that imported it
+        chain = [name]
+        for parent, parent_depth, _, _ in rows[i + 1 :]:
+            if parent_depth == depth - 1:
+                chain.append(parent)
+                depth = parent_depth
+        return chain[::-1]
+    return []
+
+
+def log_profile(endpoint: str, top: int, why: List[str]):
+    try:
+        total_ms, rows = profile_imports(get_handler_imports(endpoint))
+    except RuntimeError as e:
+        print(f"🔴 {endpoint} | {e}\n")
+        return
+    packages: Dict[str, int] = {}
+    for name, _, self_us, _ in rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    print(f"📦 {endpoint} | {total_ms}ms | {len(rows)} modules")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<24} {round(self_us / 1000):>6}ms")
+    for package in why:
+        chain = get_import_chain(rows, package)
+        print(f"  {package}: {' -> '.join(chain) if chain else 'not imported'}")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("endpoints", nargs="*", default=get_endpoints())
+    parser.add_argument("--top", type=int, default=10, help="Packages listed")
+    parser.add_argument(
+        "--why",
+        nargs="*",
+        default=["diffusers", "transformers", "scipy"],
+        help="Packages to show the import chain of",
+    )
+    args = parser.parse_args()
+    for endpoint in args.endpoints:
+        log_profile(endpoint, args.top, args.why)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""Cold start time of loading pipelines serially versus with load_pipelines, on a synthetic model cache.
+
+Builds a randomly initialized fp16 SDXL base and refiner in --cache once, about 2.6 GB, or a tiny one
+with --small. Before every run the files are dropped from the page cache, and the pipelines are loaded
+in a fresh interpreter, like a worker cold start. The loaded weights of both modes are compared after.
+
+Peak RSS counts the memory mapped weight pages that are resident. Prefetched files are already in the
+page cache, so load_pipelines peaks higher without allocating more, like serial loading from a warm cache.
+
+Usage: python -m src.tools.load_benchmark [--cache DIR] [--small] [--runs N] [--device DEVICE]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+import numpy as np
+import torch
+from tabulate import tabulate
+from src.shared.pipe_loader import PipelineLoad, load_pipelines
+
+MODES = ["serial", "load_pipelines"]
+
+# Channels and depth of the synthetic components, the full one is about the size of the real SDXL
+CONFIGS: Dict[str, Dict[str, Any]] = {
+    "full": {
+        "unet_channels": 192,
+        "layers_per_block": 2,
+        "text_encoder": (768, 12),
+        "text_encoder_2": (1024, 16),
+        "vae_channels": [128, 256, 512, 512],
+    },
+    "small": {
+        "unet_channels": 32,
+        "layers_per_block": 1,
+        "text_encoder": (32, 2),
+        "text_encoder_2": (64, 2),
+        "vae_channels": [32, 64],
+    },
+}
+
+
+def create_tokenizer(folder: str):
+    """CLIP tokenizer with byte level characters only and no merges, so nothing is downloaded."""
+    from transformers import CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for char in bytes_to_unicode().values():
+        vocab.setdefault(char, len(vocab))
+        vocab.setdefault(f"{char}</w>", len(vocab))
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(folder, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(
+        os.path.join(folder, "vocab.json"),
+        os.path.join(folder, "merges.txt"),
+        pad_token="<|endoftext|>",
+        model_max_length=77,
+    )
+
+
+def create_synthetic_cache(folder: str, small: bool = False):
+    """Random fp16 SDXL base and refiner in folder/base and folder/refiner, unless already there."""
+    from diffusers import (
+        AutoencoderKL,
+        EulerDiscreteScheduler,
+        StableDiffusionXLImg2ImgPipeline,
+        StableDiffusionXLPipeline,
+        UNet2DConditionModel,
+    )
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection
+
+    if all(
+        os.path.exists(os.path.join(folder, name, "model_index.json"))
+        for name in ("base", "refiner")
+    ):
+        return
+    config = CONFIGS["small" if small else "full"]
+    torch.manual_seed(0)
+    tokenizer = create_tokenizer(os.path.join(folder, "tokenizer"))
+
+    def create_unet(cross_attention_dim: int):
+        channels = config["unet_channels"]
+        return UNet2DConditionModel(
+            block_out_channels=(channels, channels * 2, channels * 4),
+            layers_per_block=config["layers_per_block"],
+            sample_size=32,
+            down_block_types=(
+                "DownBlock2D",
+                "CrossAttnDownBlock2D",
+                "CrossAttnDownBlock2D",
+            ),
+            up_block_types=("CrossAttnUpBlock2D", "CrossAttnUpBlock2D", "UpBlock2D"),
+            attention_head_dim=8,
+            use_linear_projection=True,
+            transformer_layers_per_block=(1, 2, 2),
+            cross_attention_dim=cross_attention_dim,
+        )
+
+    def create_text_encoder(model_class: Any, name: str):
+        hidden_size, layers = config[name]
+        return model_class(
+            CLIPTextConfig(
+                bos_token_id=0,
+                eos_token_id=1,
+                hidden_size=hidden_size,
+                intermediate_size=hidden_size * 4,
+                num_attention_heads=8,
+                num_hidden_layers=layers,
+                pad_token_id=1,
+                vocab_size=tokenizer.vocab_size,
+                max_position_embeddings=77,
+                projection_dim=hidden_size,
+            )
+        )
+
+    def create_vae():
+        channels = config["vae_channels"]
+        return AutoencoderKL(
+            block_out_channels=channels,
+            down_block_types=["DownEncoderBlock2D"] * len(channels),
+            up_block_types=["UpDecoderBlock2D"] * len(channels),
+            latent_channels=4,
+            layers_per_block=config["layers_per_block"],
+        )
+
+    base = StableDiffusionXLPipeline(
+        vae=create_vae(),
+        text_encoder=create_text_encoder(CLIPTextModel, "text_encoder"),
+        text_encoder_2=create_text_encoder(
+            CLIPTextModelWithProjection, "text_encoder_2"
+        ),
+        tokenizer=tokenizer,
+        tokenizer_2=tokenizer,
+        unet=create_unet(config["text_encoder"][0] + config["text_encoder_2"][0]),
+        scheduler=EulerDiscreteScheduler(),
+    )
+    base.to(torch.float16).save_pretrained(os.path.join(folder, "base"), variant="fp16")
+    refiner = StableDiffusionXLImg2ImgPipeline(
+        vae=create_vae(),
+        text_encoder=None,
+        text_encoder_2=create_text_encoder(
+            CLIPTextModelWithProjection, "text_encoder_2"
+        ),
+        tokenizer=None,
+        tokenizer_2=tokenizer,
+        unet=create_unet(config["text_encoder_2"][0]),
+        scheduler=EulerDiscreteScheduler(),
+        requires_aesthetics_score=True,
+        force_zeros_for_empty_prompt=False,
+    )
+    refiner.to(torch.float16).save_pretrained(
+        os.path.join(folder, "refiner"), variant="fp16"
+    )
+
+
+def get_loads(folder: str) -> List[PipelineLoad]:
+    """Same arguments as the SDXL endpoint, on the synthetic cache."""
+    from diffusers import StableDiffusionXLImg2ImgPipeline, StableDiffusionXLPipeline
+
+    return [
+        PipelineLoad(
+            StableDiffusionXLPipeline,
+            os.path.join(folder, "base"),
+            torch_dtype=torch.float16,
+            add_watermark=False,
+            safety_checker=None,
+            variant="fp16",
+        ),
+        PipelineLoad(
+            StableDiffusionXLImg2ImgPipeline,
+            os.path.join(folder, "refiner"),
+            torch_dtype=torch.float16,
+            add_watermark=False,
+            variant="fp16",
+        ),
+    ]
+
+
+def load_serial(loads: List[PipelineLoad], device: str) -> List[Any]:
+    """The loading before load_pipelines: from_pretrained, then .to(device), one pipeline at a time."""
+    return [
+        load.pipeline_class.from_pretrained(load.model_id, **load.kwargs).to(device)
+        for load in loads
+    ]
+
+
+def load(mode: str, loads: List[PipelineLoad], device: str) -> List[Any]:
+    if mode == "serial":
+        return load_serial(loads, device)
+    return load_pipelines(loads, device)
+
+
+def evict_page_cache(folder: str):
+    """Drop the files from the page cache, so they are read from the disk like on a cold start."""
+    for root, _, files in os.walk(folder):
+        for name in files:
+            fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+
+def run_cold(mode: str, folder: str, device: str) -> Dict[str, float]:
+    """Load in a fresh interpreter after evicting the cache, returns its ms and peak RSS."""
+    evict_page_cache(folder)
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "src.tools.load_benchmark",
+            "--cache",
+            folder,
+            "--device",
+            device,
+            "--run",
+            mode,
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def quiet_libraries():
+    """Hide the fp16 on CPU warnings and progress bars of every load."""
+    from diffusers.utils import logging as diffusers_logging
+    from transformers.utils import logging as transformers_logging
+
+    for library_logging in (diffusers_logging, transformers_logging):
+        library_logging.set_verbosity_error()
+        library_logging.disable_progress_bar()
+
+
+def get_max_difference(pipelines: List[Any], references: List[Any]) -> float:
+    difference = 0.0
+    for pipeline, reference in zip(pipelines, references):
+        for name, component in pipeline.components.items():
+            if not isinstance(component, torch.nn.Module):
+                continue
+            reference_state = reference.components[name].state_dict()
+            for key, tensor in component.state_dict().items():
+                difference = max(
+                    difference,
+                    float((tensor.float() - reference_state[key].float()).abs().max()),
+                )
+    return difference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cache", default="/tmp/load_benchmark")
+    parser.add_argument("--small", action="store_true", help="Tiny synthetic models")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--run", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    quiet_libraries()
+    cache = os.path.join(args.cache, "small" if args.small else "full")
+
+    if args.run is not None:
+        # One cold load, in the interpreter started by run_cold with the resolved cache folder
+        # diffusers is imported before the timer, only the loading is timed
+        loads = get_loads(args.cache)
+        start = time.time()
+        load(args.run, loads, args.device)
+        ms = (time.time() - start) * 1000
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(json.dumps({"ms": ms, "peak_mb": peak_mb}))
+        return
+
+    create_synthetic_cache(cache, args.small)
+    results: Dict[str, List[Dict[str, float]]] = {mode: [] for mode in MODES}
+    for _ in range(args.runs):
+        # Alternated, so both modes see the same disk and machine state
+        for mode in MODES:
+            results[mode].append(run_cold(mode, cache, args.device))
+
+    rows = [
+        [
+            mode,
+            " ".join(f"{result['ms']:.0f}" for result in results[mode]),
+            f"{np.median([result['ms'] for result in results[mode]]):.0f}",
+            f"{max(result['peak_mb'] for result in results[mode]):.0f}",
+        ]
+        for mode in MODES
+    ]
+    print(
+        tabulate(
+            rows,
+            headers=["Mode", "Cold runs ms", "Median ms", "Peak RSS MB"],
+            tablefmt="simple",
+        )
+    )
+    loads = get_loads(cache)
+    difference = get_max_difference(
+        load_pipelines(loads, args.device), load_serial(loads, args.device)
+    )
+    size = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(cache)
+        for name in files
+    )
+    print(
+        f"🔍 {size / (1024**2):.0f} MB cache | Device: {args.device} | Max weight difference: {difference}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Load test of the concurrent generate handler, with a fake generate and a local S3 stand-in.
+
+The fake generate sleeps on the GPU thread for every image, the images are encoded for real and
+uploaded to the stand-in with a fixed network delay. Reports jobs/s and p50/p95 job latency for
+each concurrency level, where the GPU-bound ceiling is 1 / (--outputs * --gpu-ms) jobs/s.
+
+Usage: python -m src.tools.load_test [--jobs N] [--concurrency N ...] [--outputs N] [--gpu-ms MS] [--delay-ms MS]
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from typing import Iterator, List
+import numpy as np
+from PIL import Image
+from src.shared.classes import GenerateFunctionProps, GenerateOutput
+from src.shared.predict import create_predict_for_generate
+from src.tools.stand_in_server import StandInServer
+
+
+def create_fake_generate(gpu_seconds: float, size: int):
+    def generate(props: GenerateFunctionProps[None]) -> Iterator[GenerateOutput]:
+        for i in range(props.input.num_outputs):
+            time.sleep(gpu_seconds)
+            yield GenerateOutput(image=Image.new("RGB", (size, size), (i * 40, 0, 0)))
+
+    return generate
+
+
+def create_job(server: StandInServer, job: int, outputs: int, size: int) -> dict:
+    return {
+        "input": {
+            "prompt": f"a red cat {job}",
+            "width": size,
+            "height": size,
+            "num_outputs": outputs,
+            "output_image_extension": "jpeg",
+            "output_image_quality": 90,
+            "signed_urls": [server.url(f"{job}/{i}.jpeg") for i in range(outputs)],
+        }
+    }
+
+
+async def run(predict, server: StandInServer, args, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def run_job(job: int):
+        # runpod hands the worker at most `concurrency` jobs at once
+        async with semaphore:
+            job_start = time.time()
+            response = await predict(create_job(server, job, args.outputs, args.size))
+            assert "output" in response, response
+            latencies.append((time.time() - job_start) * 1000)
+
+    start = time.time()
+    await asyncio.gather(*(run_job(job) for job in range(args.jobs)))
+    elapsed = time.time() - start
+    print(
+        f"🏋️ Concurrency: {concurrency} | {args.jobs / elapsed:.2f} jobs/s | Job p50: {np.percentile(latencies, 50):.0f}ms | Job p95: {np.percentile(latencies, 95):.0f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=24)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="*", default=[1, 2, 4, 8], help="Jobs at once"
+    )
+    parser.add_argument("--outputs", type=int, default=2, help="Images per job")
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument(
+        "--gpu-ms", type=int, default=150, help="GPU time of every image"
+    )
+    parser.add_argument(
+        "--delay-ms", type=int, default=250, help="Network time of every upload"
+    )
+    parser.add_argument("--verbose", action="store_true", help="Log every job")
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s"
+    )
+
+    predict = create_predict_for_generate(
+        model_name="Load test",
+        get_pipe_object=lambda _: None,
+        generate=create_fake_generate(args.gpu_ms / 1000, args.size),
+        schedulers=["K_EULER"],
+        default_scheduler="K_EULER",
+    )
+    with StandInServer(delay=args.delay_ms / 1000) as server:
+        for concurrency in args.concurrency:
+            asyncio.run(run(predict, server, args, concurrency))
+    print(f"🏋️ GPU-bound ceiling: {1000 / (args.outputs * args.gpu_ms):.2f} jobs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Per-job scheduler setup time, building from config on every job versus copying a cached scheduler.
+
+Uses the SD 1.5 scheduler config on a stand-in pipeline, so it runs offline without weights.
+set_timesteps is what the pipeline still runs on every job, for comparison.
+
+Usage: python -m src.tools.scheduler_benchmark [--iterations N] [--steps N]
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+from typing import Callable
+from tabulate import tabulate
+from src.shared.schedulers import (
+    SD_SCHEDULER_CACHE,
+    SD_SCHEDULERS,
+    SchedulerCache,
+    get_scheduler_class,
+)
+
+# scheduler_config.json of runwayml/stable-diffusion-v1-5
+SD_15_SCHEDULER_CONFIG = {
+    "_class_name": "PNDMScheduler",
+    "beta_end": 0.012,
+    "beta_schedule": "scaled_linear",
+    "beta_start": 0.00085,
+    "clip_sample": False,
+    "num_train_timesteps": 1000,
+    "set_alpha_to_one": False,
+    "skip_prk_steps": True,
+    "steps_offset": 1,
+    "trained_betas": None,
+}
+
+
+def measure(fn: Callable[[], object], iterations: int) -> float:
+    """Mean µs of fn, after one warm-up call."""
+    fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=30, help="num_inference_steps")
+    args = parser.parse_args()
+
+    pipeline = SimpleNamespace(
+        scheduler=get_scheduler_class("PNDMScheduler").from_config(
+            SD_15_SCHEDULER_CONFIG
+        )
+    )
+    # Its own cache, with the same schedulers as the SD endpoints
+    cache = SchedulerCache(create=SD_SCHEDULER_CACHE.create)
+    rows = []
+    for name, scheduler in SD_SCHEDULERS.items():
+        scheduler_class = get_scheduler_class(scheduler["scheduler"])
+        before = measure(
+            lambda: scheduler_class.from_config(pipeline.scheduler.config),
+            args.iterations,
+        )
+        after = measure(lambda: cache.get(name, pipeline), args.iterations)
+        job_scheduler = cache.get(name, pipeline)
+        try:
+            set_timesteps_us = measure(
+                lambda: job_scheduler.set_timesteps(args.steps, device="cpu"),
+                args.iterations,
+            )
+            set_timesteps = f"{set_timesteps_us:.0f}"
+        except ValueError:
+            # DPM++_2S on numpy 2, which is newer than requirements.txt
+            set_timesteps = "-"
+        rows.append(
+            [
+                name,
+                f"{before:.0f}",
+                f"{after:.0f}",
+                f"{before / after:.1f}x",
+                set_timesteps,
+            ]
+        )
+
+    print(
+        tabulate(
+            rows,
+            headers=[
+                "Scheduler",
+                "from_config µs",
+                "Cached copy µs",
+                "Speedup",
+                f"set_timesteps({args.steps}) µs",
+            ],
+            tablefmt="simple",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Local stand-in for the S3 signed URLs, used by the upload tests and benchmarks."""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class ReceivedUpload:
+    def __init__(self, path: str, size: int, started_at: float, finished_at: float):
+        self.path = path
+        self.size = size
+        self.started_at = started_at
+        self.finished_at = finished_at
+
+
+class StandInServer:
+    """Accepts PUTs on any path, counting the body bytes without keeping them.
+
+    delay is added to every upload, like the network time of a real S3 PUT. connections counts the
+    TCP connections clients opened, so keep-alive reuse can be checked.
+    """
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.uploads: List[ReceivedUpload] = []
+        self.connections = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._create_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _create_handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, like S3
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stand_in.lock:
+                    stand_in.connections += 1
+
+            def do_PUT(self):
+                started_at = time.time()
+                remaining = int(self.headers.get("Content-Length", 0))
+                size = 0
+                while remaining > 0:
+                    chunk = self.rfile.read(min(READ_CHUNK_BYTES, remaining))
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    remaining -= len(chunk)
+                time.sleep(stand_in.delay)
+                with stand_in.lock:
+                    stand_in.uploads.append(
+                        ReceivedUpload(self.path, size, started_at, time.time())
+                    )
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def url(self, key: str) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bucket/{key}"
+
+    def __enter__(self) -> "StandInServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,131 @@
+"""Offline benchmark of the upload pipeline, with synthetic images and a local S3 stand-in.
+
+Compares the long-lived encode and upload pools with the old per-job thread pool, where each
+thread encoded and then uploaded its own image.
+
+Usage: python -m src.tools.upload_benchmark [--jobs N] [--concurrency N ...] [--outputs N] [--size PX] [--delay-ms MS]
+"""
+
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+import numpy as np
+from PIL import Image
+from src.shared.classes import UploadObject
+from src.shared.upload import (
+    UPLOAD_PIPELINE,
+    convert_and_upload_image_to_signed_url,
+    submit_uploads,
+)
+from src.tools.stand_in_server import StandInServer
+
+
+def create_images(count: int, size: int) -> List[Image.Image]:
+    """Gradients with noise, so they take about as long to encode as generated images."""
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, size, dtype=np.float32)
+    images: List[Image.Image] = []
+    for i in range(count):
+        base = (gradient[None, :, None] + gradient[:, None, None] + i * 16) % 256
+        noise = rng.normal(0, 24, (size, size, 3))
+        images.append(
+            Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), "RGB")
+        )
+    return images
+
+
+def get_upload_objects(
+    server: StandInServer, images: List[Image.Image], job: int, extension: str
+) -> List[UploadObject]:
+    return [
+        UploadObject(
+            pil_image=image,
+            signed_url=server.url(f"{job}/{i}.{extension}"),
+            target_extension=extension,
+            target_quality=85,
+        )
+        for i, image in enumerate(images)
+    ]
+
+
+def upload_with_job_pool(upload_objects: List[UploadObject]):
+    """The uploads before the long-lived pools: a new pool per job, encode and upload in one thread."""
+    with ThreadPoolExecutor(max_workers=len(upload_objects)) as executor:
+        list(executor.map(convert_and_upload_image_to_signed_url, upload_objects))
+
+
+def upload_with_pipeline(upload_objects: List[UploadObject]):
+    submit_uploads(upload_objects).results()
+
+
+def run(
+    name: str,
+    upload: Callable[[List[UploadObject]], None],
+    server: StandInServer,
+    images: List[Image.Image],
+    jobs: int,
+    concurrency: int,
+    extension: str,
+):
+    latencies: List[float] = []
+
+    def run_job(job: int):
+        job_start = time.time()
+        upload(get_upload_objects(server, images, job, extension))
+        latencies.append((time.time() - job_start) * 1000)
+
+    # Jobs run side by side, like a worker taking several jobs at once
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run_job, range(jobs)))
+    elapsed = time.time() - start
+    print(
+        f"📤 {name:<10} | Concurrency: {concurrency} | {jobs * len(images) / elapsed:.1f} images/s | Job p50: {np.percentile(latencies, 50):.0f}ms | Job p95: {np.percentile(latencies, 95):.0f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="*", default=[1, 4], help="Jobs at once"
+    )
+    parser.add_argument("--outputs", type=int, default=4, help="Images per job")
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--extension", default="jpeg")
+    parser.add_argument(
+        "--delay-ms", type=int, default=150, help="Network time of every upload"
+    )
+    parser.add_argument("--verbose", action="store_true", help="Log stage metrics")
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING, format="%(message)s"
+    )
+
+    images = create_images(args.outputs, args.size)
+    with StandInServer(delay=args.delay_ms / 1000) as server:
+        # Warm up the encoders and the keep-alive connections
+        upload_with_pipeline(get_upload_objects(server, images, -1, args.extension))
+        for concurrency in args.concurrency:
+            for name, upload in [
+                ("Job pool", upload_with_job_pool),
+                ("Pipeline", upload_with_pipeline),
+            ]:
+                run(
+                    name,
+                    upload,
+                    server,
+                    images,
+                    args.jobs,
+                    concurrency,
+                    args.extension,
+                )
+    print(
+        f"📤 Pools | Encode workers: {UPLOAD_PIPELINE.encode_executor._max_workers} | Upload workers: {UPLOAD_PIPELINE.upload_executor._max_workers}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Peak Python memory of uploading a large image, in memory versus spooled to a temporary file.
+
+Uses tracemalloc, so it counts the encoded bytes held by Python and not the decoded image itself.
+
+Usage: python -m src.tools.upload_memory_benchmark [--size PX] [--extension EXT]
+"""
+
+import argparse
+import time
+import tracemalloc
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from src.shared import upload
+from src.shared.classes import UploadObject
+from src.tools.stand_in_server import StandInServer
+
+
+def create_image(size: int) -> Image.Image:
+    # Noise tiles, so the encoded image is large like a detailed upscale
+    rng = np.random.default_rng(0)
+    tile = rng.integers(0, 256, (512, 512, 3), dtype=np.uint8)
+    return Image.fromarray(np.tile(tile, (size // 512, size // 512, 1)), "RGB")
+
+
+def upload_buffered(upload_object: UploadObject) -> str:
+    """The upload before spooling: encode into a BytesIO, then PUT a getvalue() copy."""
+    img_bytes = BytesIO()
+    upload_object.pil_image.save(
+        img_bytes,
+        format=upload_object.target_extension.upper(),
+        quality=upload_object.target_quality,
+    )
+    response = upload.UPLOAD_CLIENT.session.put(
+        upload_object.signed_url, data=img_bytes.getvalue()
+    )
+    response.raise_for_status()
+    return upload_object.signed_url
+
+
+def measure(name: str, fn, upload_object: UploadObject, server: StandInServer):
+    tracemalloc.start()
+    start = time.time()
+    fn(upload_object)
+    elapsed = (time.time() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    received = server.uploads[-1].size
+    print(
+        f"📨 {name:<10} | Peak traced: {peak / (1024**2):.1f} MB | Uploaded: {received / (1024**2):.1f} MB | {elapsed:.0f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=8192, help="Multiple of 512")
+    parser.add_argument("--extension", default="png")
+    parser.add_argument("--quality", type=int, default=85)
+    args = parser.parse_args()
+
+    image = create_image(args.size)
+    with StandInServer() as server:
+        upload_object = UploadObject(
+            pil_image=image,
+            signed_url=server.url(f"large.{args.extension}"),
+            target_extension=args.extension,
+            target_quality=args.quality,
+        )
+        measure("Buffered", upload_buffered, upload_object, server)
+        # Spooled since the image is over UPLOAD_SPOOL_MIN_PIXELS
+        upload.UPLOAD_SPOOL_MIN_PIXELS = 0
+        measure(
+            "Spooled",
+            upload.convert_and_upload_image_to_signed_url,
+            upload_object,
+            server,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import json
+from functools import partial
+import pytest
+import torch
+from src.shared import helpers
+from src.shared.classes import GenerateFunctionProps, GenerateInput
+
+
+@pytest.fixture(scope="session")
+def tiny_tokenizer(tmp_path_factory):
+    from transformers import CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    # Byte level characters only, no merges, so no vocab download is needed
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for char in bytes_to_unicode().values():
+        vocab.setdefault(char, len(vocab))
+        vocab.setdefault(f"{char}</w>", len(vocab))
+    folder = tmp_path_factory.mktemp("tokenizer")
+    (folder / "vocab.json").write_text(json.dumps(vocab))
+    (folder / "merges.txt").write_text("#version: 0.2\n")
+    return CLIPTokenizer(
+        str(folder / "vocab.json"),
+        str(folder / "merges.txt"),
+        pad_token="<|endoftext|>",
+        model_max_length=77,
+    )
+
+
+@pytest.fixture(scope="session")
+def tiny_sd_pipe(tiny_tokenizer):
+    """Randomly initialized SD pipeline small enough to run on the CPU."""
+    from diffusers import (
+        AutoencoderKL,
+        EulerDiscreteScheduler,
+        StableDiffusionPipeline,
+        UNet2DConditionModel,
+    )
+    from transformers import CLIPTextConfig, CLIPTextModel
+
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=16,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+        norm_num_groups=8,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        down_block_types=["DownEncoderBlock2D"] * 2,
+        up_block_types=["UpDecoderBlock2D"] * 2,
+        latent_channels=4,
+        norm_num_groups=8,
+    )
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            bos_token_id=0,
+            eos_token_id=1,
+            hidden_size=32,
+            intermediate_size=37,
+            num_attention_heads=4,
+            num_hidden_layers=2,
+            pad_token_id=1,
+            vocab_size=tiny_tokenizer.vocab_size,
+            max_position_embeddings=77,
+        )
+    )
+    pipe = StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tiny_tokenizer,
+        unet=unet,
+        scheduler=EulerDiscreteScheduler(),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+@pytest.fixture(scope="session")
+def tiny_kandinsky_pipe_object(tiny_tokenizer):
+    """Randomly initialized Kandinsky 2.2 prior and decoder small enough to run on the CPU."""
+    from diffusers import (
+        DDPMScheduler,
+        KandinskyV22Pipeline,
+        KandinskyV22PriorPipeline,
+        PriorTransformer,
+        UnCLIPScheduler,
+        UNet2DConditionModel,
+        VQModel,
+    )
+    from transformers import (
+        CLIPImageProcessor,
+        CLIPTextConfig,
+        CLIPTextModelWithProjection,
+        CLIPVisionConfig,
+        CLIPVisionModelWithProjection,
+    )
+    from src.shared.pipe_classes import Kandinsky22PipeObject
+
+    torch.manual_seed(0)
+    prior_transformer = PriorTransformer(
+        num_attention_heads=2, attention_head_dim=12, embedding_dim=32, num_layers=1
+    )
+    # Zero std would collapse every image embed to the mean
+    prior_transformer.clip_std = torch.nn.Parameter(
+        torch.ones(prior_transformer.clip_std.shape)
+    )
+    prior = KandinskyV22PriorPipeline(
+        prior=prior_transformer,
+        image_encoder=CLIPVisionModelWithProjection(
+            CLIPVisionConfig(
+                hidden_size=32,
+                image_size=32,
+                projection_dim=32,
+                intermediate_size=37,
+                num_attention_heads=4,
+                num_hidden_layers=2,
+                patch_size=8,
+            )
+        ),
+        text_encoder=CLIPTextModelWithProjection(
+            CLIPTextConfig(
+                bos_token_id=0,
+                eos_token_id=1,
+                hidden_size=32,
+                projection_dim=32,
+                intermediate_size=37,
+                num_attention_heads=4,
+                num_hidden_layers=2,
+                pad_token_id=1,
+                vocab_size=tiny_tokenizer.vocab_size,
+                max_position_embeddings=77,
+            )
+        ),
+        tokenizer=tiny_tokenizer,
+        scheduler=UnCLIPScheduler(
+            variance_type="fixed_small_log",
+            prediction_type="sample",
+            clip_sample=True,
+            clip_sample_range=10.0,
+        ),
+        image_processor=CLIPImageProcessor(crop_size=32, size=32),
+    )
+    unet = UNet2DConditionModel(
+        in_channels=4,
+        out_channels=8,
+        addition_embed_type="image",
+        down_block_types=("ResnetDownsampleBlock2D", "SimpleCrossAttnDownBlock2D"),
+        up_block_types=("SimpleCrossAttnUpBlock2D", "ResnetUpsampleBlock2D"),
+        mid_block_type="UNetMidBlock2DSimpleCrossAttn",
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        encoder_hid_dim=32,
+        encoder_hid_dim_type="image_proj",
+        cross_attention_dim=32,
+        attention_head_dim=4,
+        resnet_time_scale_shift="scale_shift",
+        norm_num_groups=8,
+    )
+    movq = VQModel(
+        block_out_channels=[32, 64],
+        down_block_types=["DownEncoderBlock2D", "AttnDownEncoderBlock2D"],
+        up_block_types=["AttnUpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4,
+        layers_per_block=1,
+        norm_num_groups=8,
+        norm_type="spatial",
+        num_vq_embeddings=12,
+        vq_embed_dim=4,
+    )
+    text2img = KandinskyV22Pipeline(unet=unet, scheduler=DDPMScheduler(), movq=movq)
+    for pipe in (prior, text2img):
+        pipe.set_progress_bar_config(disable=True)
+    return Kandinsky22PipeObject(prior=prior, text2img=text2img)
+
+
+@pytest.fixture
+def cpu_generators(monkeypatch):
+    """Seed generators on the CPU instead of CUDA, in every module that creates them."""
+    create_generators = partial(helpers.create_generators, device="cpu")
+    for module in [
+        "src.shared.sd",
+        "src.endpoints.kandinsky22.generate",
+        "src.endpoints.kandinsky22.prior",
+    ]:
+        monkeypatch.setattr(f"{module}.create_generators", create_generators)
+    # The negative prior has a single generator with a fixed seed
+    monkeypatch.setattr("src.endpoints.kandinsky22.prior.DEVICE_CUDA", "cpu")
+
+
+def make_generate_props(
+    pipe_object,
+    model_name: str,
+    prompt: str = "a red cat",
+    seed: int = 1,
+    num_outputs: int = 1,
+    width: int = 64,
+    height: int = 64,
+    num_inference_steps: int = 4,
+    scheduler: str = "K_EULER",
+    **kwargs,
+) -> GenerateFunctionProps:
+    return GenerateFunctionProps(
+        input=GenerateInput(
+            prompt=prompt,
+            negative_prompt=kwargs.pop("negative_prompt", None),
+            prompt_prefix=kwargs.pop("prompt_prefix", None),
+            negative_prompt_prefix=kwargs.pop("negative_prompt_prefix", None),
+            width=width,
+            height=height,
+            num_outputs=num_outputs,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=kwargs.pop("guidance_scale", 7.0),
+            init_image_url=kwargs.pop("init_image_url", None),
+            mask_image_url=kwargs.pop("mask_image_url", None),
+            prompt_strength=kwargs.pop("prompt_strength", None),
+            scheduler=scheduler,
+            seed=seed,
+        ),
+        pipe_object=pipe_object,
+        model_name=model_name,
+        **kwargs,
+    )
@@ -0,0 +1,184 @@
+import numpy as np
+import pytest
+import torch
+from torchvision.transforms import ToPILImage
+from src.shared.aura_sr import (
+    TileBatchSizer,
+    create_checkerboard_weights,
+    create_feather_weights,
+    create_offset_weights,
+    get_overlapped_blend_weights,
+    merge_tiles,
+    merge_tiles_overlapped,
+    repeat_weights,
+    tile_image,
+    tile_image_overlapped,
+)
+from src.tools.aura_sr_benchmark import (
+    create_aura_sr,
+    create_test_image,
+    merge_tiles_loop,
+    tile_image_loop,
+)
+from src.tools.aura_sr_quality import psnr
+from src.tools.aura_sr_seams import compare_modes, create_gradient
+
+
+@pytest.fixture(scope="module")
+def tiny_aura_sr():
+    return create_aura_sr("cpu")
+
+
+@pytest.mark.parametrize("height, width", [(64, 64), (128, 192), (100, 150)])
+def test_tile_image_matches_loop(height, width):
+    image = torch.rand(3, height, width)
+    tiles, h_chunks, w_chunks = tile_image(image, 64)
+    loop_tiles, loop_h_chunks, loop_w_chunks = tile_image_loop(image, 64)
+
+    assert (h_chunks, w_chunks) == (loop_h_chunks, loop_w_chunks)
+    assert tiles.shape[0] == len(loop_tiles)
+    for tile, loop_tile in zip(tiles, loop_tiles):
+        # Edge tiles of the loop are cut short, tile_image zero pads them instead
+        tile_h, tile_w = loop_tile.shape[1:]
+        assert torch.equal(tile[:, :tile_h, :tile_w], loop_tile)
+        assert not tile[:, tile_h:].any() and not tile[:, :, tile_w:].any()
+
+
+@pytest.mark.parametrize("h_chunks, w_chunks", [(1, 1), (2, 3), (3, 1)])
+def test_merge_tiles_matches_loop(h_chunks, w_chunks):
+    tiles = torch.rand(h_chunks * w_chunks, 3, 256, 256)
+    assert torch.equal(
+        merge_tiles(tiles, h_chunks, w_chunks, 256),
+        merge_tiles_loop(list(tiles), h_chunks, w_chunks, 256),
+    )
+
+
+def test_process_tiles_keeps_finished_tiles_on_the_cpu(tiny_aura_sr):
+    image = torch.rand(3, 128, 192)
+    tiles, _, _ = tile_image(image, 64)
+
+    torch.manual_seed(0)
+    batched = tiny_aura_sr.process_tiles(tiles, max_batch_size=4)
+    assert batched.device.type == "cpu"
+    assert batched.dtype == torch.float32
+    assert batched.shape == (6, 3, 256, 256)
+    # Same noise draws as running the same batches one by one
+    torch.manual_seed(0)
+    for start in range(0, 6, 4):
+        assert torch.equal(
+            tiny_aura_sr.process_tiles(tiles[start : start + 4], max_batch_size=4),
+            batched[start : start + 4],
+        )
+
+
+def test_upscale_4x_output_size(tiny_aura_sr):
+    image = create_test_image(100, 70)
+    assert tiny_aura_sr.upscale_4x(image).size == (400, 280)
+    assert tiny_aura_sr.upscale_4x_overlapped(image).size == (400, 280)
+
+
+def test_blend_weights_tile_the_full_size_maps():
+    weights_aligned, weights_offset = get_overlapped_blend_weights(
+        256, torch.device("cpu")
+    )
+    assert weights_aligned.shape == (256, 256)
+    weight_tile = create_checkerboard_weights(256)
+    full_offset = create_offset_weights(weight_tile, (512, 768))
+    full_aligned = repeat_weights(weight_tile, (512, 768))
+    normalizer = full_offset + full_aligned
+
+    assert torch.equal(weights_aligned.repeat(2, 3), full_aligned / normalizer)
+    assert torch.equal(weights_offset.repeat(2, 3), full_offset / normalizer)
+
+
+@pytest.mark.parametrize("weight_type", ["checkboard", "constant"])
+def test_blend_overlapped_matches_full_size_weights(tiny_aura_sr, weight_type):
+    result1 = torch.rand(3, 512, 768)
+    result2 = torch.rand(3, 768, 1024)
+    result2_interior = result2[:, 128:-128, 128:-128]
+    # The blend before the weights were cached per tile, with (3, h, w) weight maps
+    if weight_type == "checkboard":
+        weight_tile = create_checkerboard_weights(256)
+        weights_1 = create_offset_weights(weight_tile, (512, 768))
+        weights_2 = repeat_weights(weight_tile, (512, 768))
+        normalizer = weights_1 + weights_2
+        weights_1 = (weights_1 / normalizer).unsqueeze(0).repeat(3, 1, 1)
+        weights_2 = (weights_2 / normalizer).unsqueeze(0).repeat(3, 1, 1)
+    else:
+        weights_1 = torch.ones_like(result2_interior) * 0.5
+        weights_2 = weights_1
+    expected = ToPILImage()(
+        (result1 * weights_2 + result2_interior * weights_1)[:, :400, :700]
+    )
+
+    blended = tiny_aura_sr.blend_overlapped(result1, result2, 100, 175, weight_type)
+    assert np.array_equal(np.asarray(blended), np.asarray(expected))
+
+
+def test_tile_batch_sizer_probes_up_after_clean_passes():
+    sizer = TileBatchSizer(max_batch_size=8, probe_after_passes=2)
+    assert sizer.back_off("cpu", torch.float32, 8) == 4
+    assert sizer.back_off("cpu", torch.float32, 4) == 2
+
+    # Partial passes don't count
+    sizer.record_pass("cpu", torch.float32, 1)
+    sizer.record_pass("cpu", torch.float32, 2)
+    assert sizer.get_batch_size("cpu", torch.float32) == 2
+    sizer.record_pass("cpu", torch.float32, 2)
+    assert sizer.get_batch_size("cpu", torch.float32) == 4
+    # An OOM resets the count
+    sizer.record_pass("cpu", torch.float32, 4)
+    sizer.back_off("cpu", torch.float32, 4)
+    sizer.record_pass("cpu", torch.float32, 2)
+    assert sizer.get_batch_size("cpu", torch.float32) == 2
+    for _ in range(10):
+        sizer.record_pass(
+            "cpu", torch.float32, sizer.get_batch_size("cpu", torch.float32)
+        )
+    assert sizer.get_batch_size("cpu", torch.float32) == 8
+    # Other dtypes are tracked separately
+    assert sizer.get_batch_size("cpu", torch.float16) == 8
+
+
+def test_process_tiles_backs_off_and_recovers(tiny_aura_sr, monkeypatch):
+    sizer = TileBatchSizer(
+        max_batch_size=4, simulated_max_batch_size=1, probe_after_passes=4
+    )
+    monkeypatch.setattr(tiny_aura_sr, "tile_batch_sizer", sizer)
+
+    assert tiny_aura_sr.process_tiles(torch.rand(3, 3, 64, 64)).shape[0] == 3
+    assert tiny_aura_sr.get_tile_batch_size() == 1
+    # Memory is available again, 4 passes of 1 tile and 4 of 2 tiles probe back up to 4
+    sizer.simulated_max_batch_size = None
+    assert tiny_aura_sr.process_tiles(torch.rand(16, 3, 64, 64)).shape[0] == 16
+    assert tiny_aura_sr.get_tile_batch_size() == 4
+
+
+@pytest.mark.parametrize("precision, min_psnr", [("fp16", 55), ("bf16", 45)])
+def test_reduced_precision_stays_close_to_fp32(tiny_aura_sr, precision, min_psnr):
+    image = create_test_image(64, 64)
+    torch.manual_seed(0)
+    reference = tiny_aura_sr.upscale_4x(image)
+    aura_sr = create_aura_sr("cpu", precision, channels_last=True)
+    torch.manual_seed(0)
+    assert psnr(reference, aura_sr.upscale_4x(image)) >= min_psnr
+
+
+def test_overlapped_tiles_round_trip():
+    image = torch.rand(3, 64 + 48 * 3, 64 + 48 * 4)
+    tiles, h_chunks, w_chunks = tile_image_overlapped(image, 64, 48)
+    weights = create_feather_weights(64, 16, torch.device("cpu"))
+    merged = merge_tiles_overlapped(tiles, h_chunks, w_chunks, 48, weights)
+    assert torch.allclose(merged, image, atol=1e-6)
+
+    # Without overlap they are the same tiles as tile_image
+    image = image[:, :192, :256]
+    tiles, h_chunks, w_chunks = tile_image_overlapped(image, 64, 64)
+    assert torch.equal(tiles, tile_image(image, 64)[0])
+    assert torch.equal(merge_tiles(tiles, h_chunks, w_chunks, 64), image)
+
+
+def test_feathered_tiles_hide_seams(tiny_aura_sr):
+    image = create_gradient(128)
+    rows = {row[0]: float(row[3]) for row in compare_modes(tiny_aura_sr, image, [16])}
+    assert rows["feathered 16"] < rows["two-pass"] < rows["plain"]
@@ -0,0 +1,51 @@
+import asyncio
+from typing import List
+import numpy as np
+from src.shared import sd
+from src.shared.coalescer import GenerateCoalescer
+from src.shared.pipe_classes import StableDiffusionPipeObject
+from .conftest import make_generate_props
+
+
+def test_coalesced_jobs_match_separate_jobs(tiny_sd_pipe, cpu_generators):
+    pipe_object = StableDiffusionPipeObject(text2img=tiny_sd_pipe, img2img=None)
+    jobs = [
+        make_generate_props(pipe_object, "tiny-sd", "a red cat", seed=1),
+        make_generate_props(pipe_object, "tiny-sd", "blue sky", seed=2, num_outputs=2),
+        make_generate_props(pipe_object, "tiny-sd", "green tree", seed=3),
+        # Another size, so another batch
+        make_generate_props(pipe_object, "tiny-sd", "a house", seed=4, width=96),
+    ]
+    separate = [
+        [np.asarray(output.image) for output in sd.generate(props)] for props in jobs
+    ]
+
+    coalescer = GenerateCoalescer(
+        get_batch_key=sd.get_batch_key,
+        generate_batch=sd.generate_batch,
+        window_ms=50,
+        max_outputs=8,
+    )
+    coalesced: List[List[np.ndarray]] = [[] for _ in jobs]
+
+    async def run_job(i: int):
+        await coalescer.run(
+            coalescer.get_key(jobs[i]),
+            jobs[i],
+            on_output=lambda output: coalesced[i].append(np.asarray(output.image)),
+        )
+
+    async def run_jobs():
+        await asyncio.gather(*(run_job(i) for i in range(len(jobs))))
+
+    asyncio.run(run_jobs())
+
+    assert coalescer.batch_sizes == {3: 1, 1: 1}
+    assert not coalescer.tasks
+    for separate_images, coalesced_images in zip(separate, coalesced):
+        assert len(coalesced_images) == len(separate_images)
+        # Same noise and prompts, but kernels can round differently at another batch size
+        for separate_image, coalesced_image in zip(separate_images, coalesced_images):
+            diff = np.abs(separate_image.astype(np.int16) - coalesced_image)
+            assert diff.max() <= 1
+            assert np.count_nonzero(diff) <= diff.size // 1000
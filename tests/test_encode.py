@@ -0,0 +1,76 @@
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image
+from src.shared import encode
+from src.shared.encode import (
+    encode_image_to_file,
+    encode_with_pil,
+    encode_with_simplejpeg,
+    get_image_encoder,
+)
+
+
+def create_image(mode: str = "RGB") -> Image.Image:
+    gradient = np.linspace(0, 255, 64, dtype=np.uint8)
+    array = np.stack([np.tile(gradient, (64, 1))] * 3, axis=-1)
+    return Image.fromarray(array, "RGB").convert(mode)
+
+
+def decode(data) -> Image.Image:
+    image = Image.open(BytesIO(data))
+    image.load()
+    return image
+
+
+@pytest.mark.parametrize("extension", ["jpeg", "png", "webp"])
+def test_encode_with_pil(extension):
+    encoded = encode_with_pil(create_image(), extension, 85)
+    # The buffer of the BytesIO, without a getvalue() copy
+    assert isinstance(encoded, memoryview)
+    image = decode(encoded)
+    assert image.format == extension.upper()
+    assert image.size == (64, 64)
+
+
+def test_jpeg_drops_alpha():
+    assert decode(encode_with_pil(create_image("RGBA"), "jpeg", 85)).mode == "RGB"
+
+
+def test_array_input_matches_pil_input():
+    image = create_image()
+    assert bytes(encode_with_pil(np.asarray(image), "jpeg", 85)) == bytes(
+        encode_with_pil(image, "jpeg", 85)
+    )
+
+
+@pytest.mark.skipif(encode.simplejpeg is None, reason="simplejpeg is not installed")
+def test_simplejpeg_matches_pil():
+    image = create_image()
+    simplejpeg_image = decode(encode_with_simplejpeg(image, "jpeg", 85))
+    pil_image = decode(encode_with_pil(image, "jpeg", 85))
+    assert simplejpeg_image.size == pil_image.size
+    diff = np.abs(
+        np.asarray(simplejpeg_image, dtype=np.int16) - np.asarray(pil_image)
+    ).max()
+    assert diff <= 8
+    # Other formats fall back to PIL
+    assert decode(encode_with_simplejpeg(image, "png", 85)).format == "PNG"
+
+
+def test_encode_to_file_is_rewound():
+    file = encode_image_to_file(create_image(), "png", 85)
+    try:
+        assert file.tell() == 0
+        assert decode(file.read()).size == (64, 64)
+    finally:
+        file.close()
+
+
+def test_unknown_encoder():
+    with pytest.raises(ValueError):
+        get_image_encoder("turbo")
+
+
+def test_pil_is_the_default_encoder():
+    assert get_image_encoder() is encode_with_pil
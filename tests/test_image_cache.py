@@ -0,0 +1,151 @@
+import hashlib
+import os
+import time
+from io import BytesIO
+from typing import Callable, List
+from PIL import Image
+from src.shared.image_cache import ImageCache, ImageCacheStats, normalize_url
+
+
+def encode_png(color) -> bytes:
+    data = BytesIO()
+    Image.new("RGB", (16, 16), color).save(data, format="PNG")
+    return data.getvalue()
+
+
+def counting_fetch(data: bytes, calls: List[int]) -> Callable[[], bytes]:
+    def fetch() -> bytes:
+        calls.append(1)
+        return data
+
+    return fetch
+
+
+def create_cache(directory, disk_max_bytes: int = 1024 * 1024) -> ImageCache:
+    return ImageCache(
+        str(directory), disk_max_bytes=disk_max_bytes, memory_max_bytes=1024 * 1024
+    )
+
+
+def list_url_files(directory) -> List[str]:
+    return os.listdir(os.path.join(directory, "urls"))
+
+
+def test_normalize_url_drops_signature_only_from_signed_urls():
+    signed = "https://Bucket.s3.amazonaws.com/a.png?X-Amz-Signature=1&X-Amz-Date=2&v=1"
+    assert normalize_url(signed) == "https://bucket.s3.amazonaws.com/a.png?v=1"
+    # An unsigned URL keeps its expires param, it may select a different object
+    assert (
+        normalize_url("https://example.com/a.png?expires=1")
+        == "https://example.com/a.png?expires=1"
+    )
+
+
+def test_resigned_url_hits_the_cache(tmp_path):
+    cache = create_cache(tmp_path)
+    calls: List[int] = []
+    fetch = counting_fetch(encode_png("red"), calls)
+    cache.get_bytes("https://example.com/a.png?X-Amz-Signature=1", fetch)
+    cache.get_bytes("https://example.com/a.png?X-Amz-Signature=2", fetch)
+
+    assert len(calls) == 1
+
+
+def test_disk_cache_survives_a_restart(tmp_path):
+    data = encode_png("red")
+    create_cache(tmp_path).get_bytes("https://example.com/a.png", lambda: data)
+    calls: List[int] = []
+
+    restarted = create_cache(tmp_path)
+    assert (
+        restarted.get_bytes("https://example.com/a.png", counting_fetch(data, calls))
+        == data
+    )
+    assert calls == []
+
+
+def test_url_files_are_evicted_with_their_content(tmp_path):
+    red = encode_png("red")
+    blue = encode_png("blue")
+    cache = create_cache(tmp_path, disk_max_bytes=len(red) + len(blue) - 1)
+    cache.get_bytes("https://example.com/red.png", lambda: red)
+    cache.get_bytes("https://example.com/red-copy.png", lambda: red)
+    assert len(list_url_files(tmp_path)) == 2
+
+    cache.get_bytes("https://example.com/blue.png", lambda: blue)
+
+    assert len(list_url_files(tmp_path)) == 1
+    assert cache.url_index.stats()["entries"] == 1
+    calls: List[int] = []
+    cache.get_bytes("https://example.com/red.png", counting_fetch(red, calls))
+    assert calls == [1]
+
+
+def test_url_files_from_a_previous_run_are_evicted_with_their_content(tmp_path):
+    red = encode_png("red")
+    blue = encode_png("blue")
+    create_cache(tmp_path).get_bytes("https://example.com/red.png", lambda: red)
+
+    restarted = create_cache(tmp_path, disk_max_bytes=len(red) + len(blue) - 1)
+    # Reading the index file links it to its content
+    restarted.get_bytes("https://example.com/red.png", lambda: red)
+    restarted.get_bytes("https://example.com/blue.png", lambda: blue)
+
+    assert len(list_url_files(tmp_path)) == 1
+
+
+def test_disk_hit_refreshes_the_eviction_order_after_a_restart(tmp_path):
+    images = [encode_png(color) for color in ["red", "green", "blue"]]
+    cache = create_cache(tmp_path)
+    for i, data in enumerate(images[:2]):
+        cache.get_bytes(f"https://example.com/{i}.png", lambda: data)
+    # The older image is read last, so it is the most recently used
+    for i, data in enumerate(images[:2]):
+        past = time.time() - 60 + i * 30
+        path = os.path.join(tmp_path, hashlib.sha256(data).hexdigest())
+        os.utime(path, (past, past))
+    cache.get_bytes("https://example.com/0.png", lambda: images[0])
+
+    restarted = create_cache(
+        tmp_path, disk_max_bytes=sum(len(data) for data in images) - 1
+    )
+    restarted.get_bytes("https://example.com/2.png", lambda: images[2])
+
+    calls: List[int] = []
+    restarted.get_bytes("https://example.com/0.png", counting_fetch(images[0], calls))
+    assert calls == []
+    restarted.get_bytes("https://example.com/1.png", counting_fetch(images[1], calls))
+    assert calls == [1]
+
+
+def test_job_stats_only_count_their_own_lookups(tmp_path):
+    cache = create_cache(tmp_path)
+    data = encode_png("red")
+    first_job = ImageCacheStats()
+    second_job = ImageCacheStats()
+    cache.get_image("https://example.com/a.png", lambda: data, stats=first_job)
+    cache.get_image("https://example.com/a.png", lambda: data, stats=second_job)
+    cache.get_fitted_image(
+        "https://example.com/a.png",
+        8,
+        8,
+        load_image=lambda: cache.get_image(
+            "https://example.com/a.png", lambda: data, stats=second_job
+        ),
+        stats=second_job,
+    )
+
+    assert first_job.get() == {
+        "memory_hits": 0,
+        "memory_misses": 1,
+        "disk_hits": 0,
+        "disk_misses": 1,
+    }
+    assert second_job.get() == {
+        "memory_hits": 2,
+        "memory_misses": 1,
+        "disk_hits": 0,
+        "disk_misses": 0,
+    }
+    totals = cache.stats()
+    assert (totals["memory_hits"], totals["disk_misses"]) == (2, 1)
@@ -0,0 +1,55 @@
+from functools import partial
+import numpy as np
+import pytest
+from src.endpoints.kandinsky22 import generate
+from src.shared.helpers import get_batch_chunks
+from .conftest import make_generate_props
+
+
+def generate_arrays(props):
+    return [np.asarray(output.image) for output in generate.generate(props)]
+
+
+@pytest.mark.parametrize("max_batch_outputs", [4, 2])
+def test_batched_decoder_matches_sequential_seeds(
+    tiny_kandinsky_pipe_object, cpu_generators, monkeypatch, max_batch_outputs
+):
+    monkeypatch.setattr(
+        generate,
+        "get_batch_chunks",
+        partial(get_batch_chunks, max_batch_pixels=max_batch_outputs * 64 * 64),
+    )
+    seed = 1234
+    batched = generate_arrays(
+        make_generate_props(
+            tiny_kandinsky_pipe_object,
+            "tiny-kandinsky",
+            prompt=f"a red cat {max_batch_outputs}",
+            seed=seed,
+            num_outputs=4,
+            scheduler="DDPM",
+            guidance_scale=4.0,
+        )
+    )
+    # The prior embeds of every seed + i are cached by the batched run, so only the decoder differs
+    sequential = [
+        generate_arrays(
+            make_generate_props(
+                tiny_kandinsky_pipe_object,
+                "tiny-kandinsky",
+                prompt=f"a red cat {max_batch_outputs}",
+                seed=seed + i,
+                num_outputs=1,
+                scheduler="DDPM",
+                guidance_scale=4.0,
+            )
+        )[0]
+        for i in range(4)
+    ]
+    assert len(batched) == 4
+    # Same noise, but kernels can round differently at another batch size, so allow one 8-bit level
+    for batched_image, sequential_image in zip(batched, sequential):
+        diff = np.abs(batched_image.astype(np.int16) - sequential_image)
+        assert diff.max() <= 1
+        assert np.count_nonzero(diff) <= diff.size // 1000
+    assert not np.array_equal(sequential[0], sequential[1])
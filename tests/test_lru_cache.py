@@ -0,0 +1,79 @@
+from typing import List, Tuple
+from src.shared.lru_cache import LRUCache
+
+
+def test_evicts_least_recently_used_first():
+    evicted: List[Tuple[str, int]] = []
+    cache: LRUCache[str, int] = LRUCache(
+        max_size=3, get_size=lambda _: 1, on_evict=lambda *item: evicted.append(item)
+    )
+    for i, key in enumerate("abc"):
+        cache.put(key, i)
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == 0
+    cache.put("d", 3)
+
+    assert evicted == [("b", 1)]
+    assert "b" not in cache
+    assert cache.stats()["evictions"] == 1
+
+
+def test_bounded_by_size_of_values():
+    cache: LRUCache[str, bytes] = LRUCache(max_size=10, get_size=len)
+    cache.put("a", b"x" * 4)
+    cache.put("b", b"x" * 4)
+    cache.put("c", b"x" * 4)
+
+    assert "a" not in cache
+    assert cache.stats()["size"] == 8
+
+
+def test_value_larger_than_cache_is_not_stored():
+    cache: LRUCache[str, bytes] = LRUCache(max_size=10, get_size=len)
+    cache.put("a", b"x" * 4)
+    cache.put("big", b"x" * 11)
+
+    assert "big" not in cache
+    assert "a" in cache
+
+
+def test_pinned_entries_are_never_evicted():
+    cache: LRUCache[str, int] = LRUCache(max_size=1, get_size=lambda _: 1)
+    cache.put("pinned", 0, pinned=True)
+    cache.put("a", 1)
+    cache.put("b", 2)
+
+    assert "pinned" in cache
+    assert "a" not in cache
+    assert cache.stats()["size"] == 1
+
+
+def test_replacing_a_value_updates_the_size():
+    cache: LRUCache[str, bytes] = LRUCache(max_size=10, get_size=len)
+    cache.put("a", b"x" * 8)
+    cache.put("a", b"x" * 2)
+
+    assert cache.stats()["size"] == 2
+
+
+def test_remove_skips_on_evict():
+    evicted: List[str] = []
+    cache: LRUCache[str, int] = LRUCache(
+        max_size=2, get_size=lambda _: 1, on_evict=lambda key, _: evicted.append(key)
+    )
+    cache.put("a", 0)
+
+    assert cache.remove("a") == 0
+    assert cache.remove("a") is None
+    assert evicted == []
+    assert cache.stats()["size"] == 0
+
+
+def test_counts_hits_and_misses():
+    cache: LRUCache[str, int] = LRUCache(max_size=2, get_size=lambda _: 1)
+    cache.put("a", 0)
+    cache.get("a")
+    cache.get("b")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
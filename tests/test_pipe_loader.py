@@ -0,0 +1,103 @@
+import os
+import pytest
+import torch
+from src.shared.pipe_loader import (
+    get_model_components,
+    get_weight_files,
+    load_pipelines,
+)
+from src.tools.load_benchmark import (
+    create_synthetic_cache,
+    get_loads,
+    get_max_difference,
+    load_serial,
+)
+
+
+@pytest.fixture(scope="module")
+def synthetic_cache(tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp("load"))
+    create_synthetic_cache(folder, small=True)
+    return folder
+
+
+def test_get_weight_files_picks_the_variant_and_its_shards(tmp_path):
+    files = {
+        "unet": [
+            "diffusion_pytorch_model.safetensors",
+            "diffusion_pytorch_model.fp16.safetensors",
+            "diffusion_pytorch_model.bin",
+        ],
+        "text_encoder": [
+            "model.fp16-00002-of-00002.safetensors",
+            "model.fp16-00001-of-00002.safetensors",
+            "model.safetensors.index.fp16.json",
+        ],
+    }
+    for subfolder, names in files.items():
+        os.makedirs(tmp_path / subfolder)
+        for name in names:
+            (tmp_path / subfolder / name).write_bytes(b"")
+
+    def get_names(subfolder, variant):
+        return [
+            os.path.basename(path)
+            for path in get_weight_files(str(tmp_path), subfolder, variant)
+        ]
+
+    assert get_names("unet", "fp16") == ["diffusion_pytorch_model.fp16.safetensors"]
+    assert get_names("unet", None) == ["diffusion_pytorch_model.safetensors"]
+    assert get_names("text_encoder", "fp16") == [
+        "model.fp16-00001-of-00002.safetensors",
+        "model.fp16-00002-of-00002.safetensors",
+    ]
+    assert get_names("vae", "fp16") == []
+    # Models that aren't downloaded yet are left to from_pretrained
+    assert get_weight_files("nobody/not-downloaded", "unet", "fp16") == []
+
+
+def test_get_model_components_skips_missing_and_passed_in(synthetic_cache):
+    base, refiner = get_loads(synthetic_cache)
+    assert {name for name, _ in get_model_components(base)} == {
+        "unet",
+        "vae",
+        "text_encoder",
+        "text_encoder_2",
+    }
+    # The refiner has no first text encoder
+    assert {name for name, _ in get_model_components(refiner)} == {
+        "unet",
+        "vae",
+        "text_encoder_2",
+    }
+    base.kwargs["vae"] = None
+    assert "vae" not in {name for name, _ in get_model_components(base)}
+
+
+def test_load_pipelines_matches_from_pretrained(synthetic_cache, monkeypatch):
+    from transformers import CLIPTextModelWithProjection
+
+    # Components load with the same flags the pipeline would pass them
+    load_kwargs = []
+    from_pretrained = CLIPTextModelWithProjection.from_pretrained.__func__
+
+    def record_from_pretrained(cls, *args, **kwargs):
+        load_kwargs.append(kwargs)
+        return from_pretrained(cls, *args, **kwargs)
+
+    monkeypatch.setattr(
+        CLIPTextModelWithProjection,
+        "from_pretrained",
+        classmethod(record_from_pretrained),
+    )
+    loads = get_loads(synthetic_cache)
+    pipelines = load_pipelines(loads, "cpu")
+    assert [kwargs["low_cpu_mem_usage"] for kwargs in load_kwargs] == [True, True]
+    monkeypatch.undo()
+
+    assert get_max_difference(pipelines, load_serial(loads, "cpu")) == 0
+    for pipeline in pipelines:
+        assert pipeline.unet.dtype == torch.float16
+        assert pipeline.text_encoder_2.dtype == torch.float16
+    assert type(pipelines[1]).__name__ == "StableDiffusionXLImg2ImgPipeline"
+    assert pipelines[1].text_encoder is None
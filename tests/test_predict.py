@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+from PIL import Image
+from src.shared import predict as predict_module
+from src.shared.predict import create_predict_for_generate
+from src.tools.load_test import create_fake_generate, create_job
+from src.tools.stand_in_server import StandInServer
+
+GPU_SECONDS = 0.1
+UPLOAD_SECONDS = 0.3
+
+
+def test_concurrent_jobs_only_queue_for_the_gpu():
+    predict = create_predict_for_generate(
+        model_name="Load test",
+        get_pipe_object=lambda _: None,
+        generate=create_fake_generate(GPU_SECONDS, 256),
+        schedulers=["K_EULER"],
+        default_scheduler="K_EULER",
+    )
+
+    async def run_jobs(server: StandInServer):
+        return await asyncio.gather(
+            *(predict(create_job(server, job, 2, 256)) for job in range(4))
+        )
+
+    with StandInServer(delay=UPLOAD_SECONDS) as server:
+        start = time.time()
+        responses = asyncio.run(run_jobs(server))
+        elapsed = time.time() - start
+
+    assert [response["output"]["images"] for response in responses] == [
+        [f"s3://bucket/{job}/{i}.jpeg" for i in range(2)] for job in range(4)
+    ]
+    # GPU work is serialized, the uploads of one job overlap the GPU work of the next
+    assert elapsed >= 4 * 2 * GPU_SECONDS
+    assert elapsed < 4 * (2 * GPU_SECONDS + UPLOAD_SECONDS)
+
+
+def test_prompts_are_encoded_while_input_images_download(monkeypatch):
+    download_seconds = 0.3
+    downloaded_at: List[float] = []
+    encoded_at: List[float] = []
+
+    def prefetch_input_images(generate_input):
+        download: Future = Future()
+
+        def finish():
+            downloaded_at.append(time.time())
+            download.set_result(Image.new("RGB", (256, 256)))
+
+        threading.Timer(download_seconds, finish).start()
+        generate_input.init_image = download
+
+    monkeypatch.setattr(predict_module, "prefetch_input_images", prefetch_input_images)
+    predict = create_predict_for_generate(
+        model_name="Load test",
+        get_pipe_object=lambda _: None,
+        generate=create_fake_generate(GPU_SECONDS, 256),
+        schedulers=["K_EULER"],
+        default_scheduler="K_EULER",
+        encode_prompts=lambda props: encoded_at.append(time.time()),
+    )
+    with StandInServer() as server:
+        job = create_job(server, 0, 1, 256)
+        job["input"]["init_image_url"] = "https://example.com/init.png"
+        job["input"]["prompt_strength"] = 0.8
+        response = asyncio.run(predict(job))
+
+    assert response["output"]["images"] == ["s3://bucket/0/0.jpeg"]
+    assert len(encoded_at) == 1
+    assert encoded_at[0] < downloaded_at[0]
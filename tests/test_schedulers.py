@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+from typing import List
+import torch
+from src.shared.schedulers import (
+    KANDINSKY_22_SCHEDULER_CACHE,
+    SD_SCHEDULER_CACHE,
+    get_scheduler_class,
+)
+from src.tools.scheduler_benchmark import SD_15_SCHEDULER_CONFIG
+
+# The caches key pipelines by id, so they stay alive like the loaded pipelines do
+PIPELINES: List[SimpleNamespace] = []
+
+
+def create_pipeline(class_name: str = "PNDMScheduler", **config):
+    scheduler_class = get_scheduler_class(class_name)
+    pipeline = SimpleNamespace(
+        scheduler=scheduler_class.from_config({**SD_15_SCHEDULER_CONFIG, **config})
+    )
+    PIPELINES.append(pipeline)
+    return pipeline
+
+
+def test_jobs_get_their_own_scheduler():
+    pipeline = create_pipeline()
+    first = SD_SCHEDULER_CACHE.get("DPM++_2M", pipeline)
+    first.set_timesteps(10)
+    first.model_outputs[0] = torch.ones(1)
+
+    second = SD_SCHEDULER_CACHE.get("DPM++_2M", pipeline)
+    assert second is not first
+    # No timesteps or solver history from the previous job
+    assert second.num_inference_steps is None
+    assert all(output is None for output in second.model_outputs)
+    second.set_timesteps(20)
+    assert len(first.timesteps) == 10
+
+
+def test_schedulers_keep_the_pipeline_config():
+    pipeline = create_pipeline(beta_end=0.02)
+    scheduler = SD_SCHEDULER_CACHE.get("K_EULER", pipeline)
+    assert type(scheduler).__name__ == "EulerDiscreteScheduler"
+    assert scheduler.config.beta_end == 0.02
+    assert scheduler.config.steps_offset == 1
+
+    # Even after a job left another scheduler on the pipeline
+    pipeline.scheduler = SD_SCHEDULER_CACHE.get("DDIM", create_pipeline())
+    assert SD_SCHEDULER_CACHE.get("DPM++_2M", pipeline).config.beta_end == 0.02
+
+    # Each pipeline has its own templates
+    other = SD_SCHEDULER_CACHE.get("K_EULER", create_pipeline(beta_end=0.015))
+    assert other.config.beta_end == 0.015
+
+
+def test_kandinsky_ddpm_ignores_the_previous_scheduler():
+    pipeline = create_pipeline("DDPMScheduler", beta_end=0.015)
+    pipeline.scheduler = KANDINSKY_22_SCHEDULER_CACHE.get("DDIM", pipeline)
+    assert KANDINSKY_22_SCHEDULER_CACHE.get("DDPM", pipeline).config.beta_end == 0.015
@@ -0,0 +1,113 @@
+from functools import partial
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from src.shared import sd
+from src.shared.helpers import create_generators, get_batch_chunks
+from src.shared.pipe_classes import StableDiffusionPipeObject
+from src.shared.prompt_cache import PROMPT_EMBEDS_CACHE
+from .conftest import make_generate_props
+
+
+def generate_arrays(props):
+    return [np.asarray(output.image) for output in sd.generate(props)]
+
+
+def test_get_batch_chunks_fits_pixel_budget():
+    assert get_batch_chunks(4, 512, 512, max_batch_pixels=4 * 512 * 512) == [
+        [0, 1, 2, 3]
+    ]
+    assert get_batch_chunks(4, 512, 512, max_batch_pixels=3 * 512 * 512) == [
+        [0, 1, 2],
+        [3],
+    ]
+    # A single output larger than the budget still runs on its own
+    assert get_batch_chunks(2, 1024, 1024, max_batch_pixels=512 * 512) == [[0], [1]]
+
+
+def test_batched_noise_matches_sequential_seeds():
+    from diffusers.utils.torch_utils import randn_tensor
+
+    shape = (1, 4, 8, 8)
+    batched = randn_tensor(
+        (4, *shape[1:]), generator=create_generators(7, [0, 1, 2, 3], device="cpu")
+    )
+    for i in range(4):
+        sequential = randn_tensor(
+            shape, generator=create_generators(7 + i, [0], device="cpu")
+        )
+        assert torch.equal(batched[i : i + 1], sequential)
+
+
+@pytest.mark.parametrize("max_batch_outputs", [4, 2, 1])
+def test_batched_outputs_match_sequential_seeds(
+    tiny_sd_pipe, cpu_generators, monkeypatch, max_batch_outputs
+):
+    pipe_object = StableDiffusionPipeObject(text2img=tiny_sd_pipe, img2img=None)
+    monkeypatch.setattr(
+        sd,
+        "get_batch_chunks",
+        partial(get_batch_chunks, max_batch_pixels=max_batch_outputs * 64 * 64),
+    )
+    seed = 1234
+    batched = generate_arrays(
+        make_generate_props(pipe_object, "tiny-sd", seed=seed, num_outputs=4)
+    )
+    sequential = [
+        generate_arrays(
+            make_generate_props(pipe_object, "tiny-sd", seed=seed + i, num_outputs=1)
+        )[0]
+        for i in range(4)
+    ]
+    assert len(batched) == 4
+    # Same noise, but kernels can round differently at another batch size, so allow one 8-bit level
+    for batched_image, sequential_image in zip(batched, sequential):
+        diff = np.abs(batched_image.astype(np.int16) - sequential_image)
+        assert diff.max() <= 1
+        assert np.count_nonzero(diff) <= diff.size // 1000
+    # Different seeds do give different images
+    assert not np.array_equal(sequential[0], sequential[1])
+
+
+def test_default_negative_prefix_is_pinned(tiny_sd_pipe, cpu_generators):
+    pipe_object = StableDiffusionPipeObject(text2img=tiny_sd_pipe, img2img=None)
+    props = make_generate_props(
+        pipe_object,
+        "tiny-sd-pinned",
+        default_prompt_prefix="photo of",
+        default_negative_prompt_prefix="blurry",
+    )
+    generate_arrays(props)
+
+    pinned = {key for key in PROMPT_EMBEDS_CACHE.pinned if key[0] == "tiny-sd-pinned"}
+    # Without a negative prompt, the negative prefix is the whole negative text
+    assert pinned == {("tiny-sd-pinned", "blurry", None)}
+    assert ("tiny-sd-pinned", "photo of a red cat", None) in PROMPT_EMBEDS_CACHE
+
+
+def test_inpaint_runs_the_inpaint_pipeline(tiny_sd_pipe, cpu_generators, monkeypatch):
+    from diffusers import StableDiffusionInpaintPipeline
+
+    inpaint = StableDiffusionInpaintPipeline(**tiny_sd_pipe.components)
+    inpaint.set_progress_bar_config(disable=True)
+    pipe_object = StableDiffusionPipeObject(
+        text2img=tiny_sd_pipe, img2img=None, inpaint=inpaint
+    )
+    images = {
+        "https://example.com/init.png": Image.new("RGB", (64, 64), (200, 40, 40)),
+        "https://example.com/mask.png": Image.new("RGB", (64, 64), (255, 255, 255)),
+    }
+    monkeypatch.setattr(sd, "download_and_fit_image", lambda url, **kwargs: images[url])
+    props = make_generate_props(
+        pipe_object,
+        "tiny-sd",
+        init_image_url="https://example.com/init.png",
+        mask_image_url="https://example.com/mask.png",
+        prompt_strength=0.8,
+    )
+
+    # The inpaint pipeline is only referenced in annotations until this path runs
+    outputs = generate_arrays(props)
+    assert len(outputs) == 1
+    assert outputs[0].ndim == 3
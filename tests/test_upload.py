@@ -0,0 +1,104 @@
+import time
+from typing import Iterator, List
+import pytest
+from PIL import Image
+from src.shared import upload
+from src.shared.classes import UploadObject
+from src.shared.encode import encode_image
+from src.shared.upload import UPLOAD_PIPELINE, submit_uploads
+from src.tools.stand_in_server import StandInServer
+
+GENERATE_SECONDS = 0.2
+UPLOAD_SECONDS = 0.2
+
+
+@pytest.fixture
+def stand_in():
+    with StandInServer(delay=UPLOAD_SECONDS) as server:
+        yield server
+
+
+def fake_generate(
+    stand_in: StandInServer, num_outputs: int, generated_at: List[float]
+) -> Iterator[UploadObject]:
+    for i in range(num_outputs):
+        time.sleep(GENERATE_SECONDS)
+        generated_at.append(time.time())
+        yield UploadObject(
+            pil_image=Image.new("RGB", (64, 64), (i * 40, 0, 0)),
+            signed_url=stand_in.url(f"{i}.jpeg"),
+            target_extension="jpeg",
+            target_quality=85,
+        )
+
+
+def test_uploads_overlap_generation(stand_in):
+    generated_at: List[float] = []
+    start = time.time()
+    upload_job = submit_uploads(fake_generate(stand_in, 4, generated_at))
+    results = upload_job.results()
+    elapsed = time.time() - start
+
+    assert [result.image_url for result in results] == [
+        f"s3://bucket/{i}.jpeg" for i in range(4)
+    ]
+    # The first upload is done before the last image is generated
+    first_upload = min(stand_in.uploads, key=lambda upload: upload.started_at)
+    assert first_upload.path == "/bucket/0.jpeg"
+    assert first_upload.finished_at < generated_at[-1]
+    # Only the last upload is left after generation, instead of waiting for all of them to start
+    assert elapsed < 4 * GENERATE_SECONDS + 2 * UPLOAD_SECONDS
+    assert all(upload.size > 0 for upload in stand_in.uploads)
+
+
+def test_upload_pipeline_stage_metrics(stand_in):
+    upload_job = submit_uploads(fake_generate(stand_in, 3, []))
+    upload_job.results()
+
+    assert len(upload_job.stats.stage_ms["encode"]) == 3
+    assert len(upload_job.stats.stage_ms["upload"]) == 3
+    assert min(upload_job.stats.stage_ms["upload"]) >= UPLOAD_SECONDS * 1000
+    assert upload_job.stats.max_queue_depth["upload"] >= 1
+    # Queues of the shared pools drain once the job is done
+    assert UPLOAD_PIPELINE.queue_depth == {"encode": 0, "upload": 0}
+
+
+@pytest.mark.parametrize("spool_min_pixels", [0, 1024 * 1024])
+def test_spooled_and_buffered_uploads_send_the_whole_image(
+    stand_in, monkeypatch, spool_min_pixels
+):
+    monkeypatch.setattr(upload, "UPLOAD_SPOOL_MIN_PIXELS", spool_min_pixels)
+    image = Image.effect_noise((256, 256), 64).convert("RGB")
+    upload_object = UploadObject(
+        pil_image=image,
+        signed_url=stand_in.url("large.png"),
+        target_extension="png",
+        target_quality=85,
+    )
+    expected = len(bytes(encode_image(image, "png", 85)))
+
+    assert (
+        upload.convert_and_upload_image_to_signed_url(upload_object)
+        == "s3://bucket/large.png"
+    )
+    assert stand_in.uploads[-1].size == expected
+
+
+def test_uploads_reuse_one_connection(stand_in):
+    for i in range(5):
+        upload.convert_and_upload_image_to_signed_url(
+            UploadObject(
+                pil_image=Image.new("RGB", (64, 64)),
+                signed_url=stand_in.url(f"reuse/{i}.jpeg"),
+                target_extension="jpeg",
+                target_quality=85,
+            )
+        )
+
+    assert len(stand_in.uploads) == 5
+    # One after the other, so the pooled session keeps using the first connection
+    assert stand_in.connections == 1
+    host, port = stand_in.server.server_address[:2]
+    pool_stats = upload.UPLOAD_CLIENT.get_pool_stats()[f"http://{host}:{port}"]
+    assert pool_stats["connections"] == 1
+    assert pool_stats["requests"] == 5